@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+from langchain_utils import retrieve_batch, prepare_context, astart_generation, consume_generation
+from concurrency_utils import MODEL_CONCURRENCY, ModelOverloadedError
+from metrics_utils import counter, record_stage, to_thread_timed, track_stage_timings
+
+# /chat/batch: вопросы без истории; эмбеддинги и поиск — пакетом, генерации — не больше BATCH_CONCURRENCY одновременно.
+# Генерации идут через тот же ограничитель модели, что и /chat; по умолчанию пакет занимает на один слот меньше,
+# чтобы один слот модели оставался интерактивным запросам (при MODEL_CONCURRENCY=1 они ждут в общей очереди)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(max(1, MODEL_CONCURRENCY - 1))))
+BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", "5"))
+
+batch_items_total = counter("rag_batch_items_total", "Batch questions by outcome (ok, error).")
+
+def _sources(docs):
+    return [{"source": doc.metadata.get("source"), "file_id": doc.metadata.get("file_id")} for doc in docs]
+
+async def answer_item(question, question_embedding, docs, model, limiter, timings): # -> (ответ, упакованные чанки)
+    packed_docs, _, ready_answer = await to_thread_timed(timings, prepare_context, model, question_embedding, docs)
+    if ready_answer is not None:
+        return ready_answer, packed_docs
+
+    # Перегрузка модели для пакета не ошибка: ждём Retry-After и пробуем снова
+    for attempt in range(BATCH_RETRIES + 1):
+        try:
+            tokens = await astart_generation(question, [], model, question_embedding, docs, packed_docs, limiter, timings=timings)
+            break
+        except ModelOverloadedError as e:
+            if attempt == BATCH_RETRIES:
+                raise
+            await asyncio.sleep(e.retry_after)
+    try:
+        answer = "".join([token async for token in consume_generation(tokens, timings)])
+    finally:
+        tokens.release()
+    return answer, packed_docs
+
+async def run_batch(questions, model, limiter, include_timings=False): # события NDJSON: batch, затем result/error в порядке готовности, done
+    batch_start = time.perf_counter()
+    batch_timings = {}
+
+    def retrieve():
+        with track_stage_timings(batch_timings):
+            return retrieve_batch(questions)
+    question_embeddings, docs_per_question = await asyncio.to_thread(retrieve)
+    event = {"type": "batch", "size": len(questions)}
+    if include_timings:
+        event["timings"] = {stage: round(ms, 2) for stage, ms in batch_timings.items()}
+    yield event
+
+    pending = asyncio.Queue()
+    for index in range(len(questions)):
+        pending.put_nowait(index)
+    results = asyncio.Queue()
+
+    async def worker():
+        while not pending.empty():
+            index = pending.get_nowait()
+            timings = {}
+            start = time.perf_counter()
+            try:
+                answer, packed_docs = await answer_item(questions[index], question_embeddings[index], docs_per_question[index],
+                                                        model, limiter, timings)
+            except Exception as e:
+                batch_items_total.inc(outcome="error")
+                await results.put({"type": "error", "index": index, "question": questions[index], "detail": str(e)})
+                continue
+            record_stage("batch", "item", time.perf_counter() - start, timings)
+            batch_items_total.inc(outcome="ok")
+            result = {"type": "result", "index": index, "question": questions[index], "answer": answer, "sources": _sources(packed_docs)}
+            if include_timings:
+                result["timings"] = {stage: round(ms, 2) for stage, ms in timings.items()}
+            await results.put(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BATCH_CONCURRENCY, len(questions)))]
+    failed = 0
+    try:
+        for _ in range(len(questions)):
+            event = await results.get()
+            failed += event["type"] == "error"
+            yield event
+    finally:
+        # Клиент отключился — оставшиеся вопросы не генерируем
+        for task in workers:
+            task.cancel()
+    record_stage("batch", "total", time.perf_counter() - batch_start)
+    yield {"type": "done", "completed": len(questions) - failed, "failed": failed, "seconds": round(time.perf_counter() - batch_start, 3)}
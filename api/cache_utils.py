@@ -0,0 +1,100 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+
+# Кэш ответов: запись = эмбеддинг вопроса + набор найденных чанков + ответ модели
+_answer_cache: "OrderedDict[int, dict]" = OrderedDict()
+_answer_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+_answer_cache_lock = threading.Lock()
+_next_entry_id = 0
+
+def chunk_key(doc): # стабильный идентификатор чанка: id из Chroma либо file_id + хэш текста
+    if getattr(doc, 'id', None):
+        return str(doc.id)
+    content_hash = hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()
+    return f"{doc.metadata.get('file_id')}:{content_hash}"
+
+def _normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def _is_expired(entry, now):
+    return ANSWER_CACHE_TTL > 0 and now - entry['created_at'] > ANSWER_CACHE_TTL
+
+def lookup_answer(model, question_embedding, docs):
+    chunk_ids = frozenset(chunk_key(doc) for doc in docs)
+    query = _normalize(question_embedding)
+    now = time.time()
+
+    with _answer_cache_lock:
+        best_id, best_score = None, ANSWER_CACHE_SIMILARITY
+        for entry_id, entry in list(_answer_cache.items()):
+            if _is_expired(entry, now):
+                del _answer_cache[entry_id]
+                _answer_cache_stats['expired'] += 1
+                continue
+            if entry['model'] != model or entry['chunk_ids'] != chunk_ids:
+                continue
+            score = sum(a * b for a, b in zip(query, entry['embedding']))
+            if score >= best_score:
+                best_id, best_score = entry_id, score
+
+        if best_id is None:
+            _answer_cache_stats['misses'] += 1
+            return None
+
+        _answer_cache.move_to_end(best_id)
+        _answer_cache_stats['hits'] += 1
+        return _answer_cache[best_id]['answer']
+
+def store_answer(model, question_embedding, docs, answer):
+    global _next_entry_id
+    entry = {
+        'model': model,
+        'embedding': _normalize(question_embedding),
+        'chunk_ids': frozenset(chunk_key(doc) for doc in docs),
+        'file_ids': {str(doc.metadata.get('file_id')) for doc in docs},
+        'answer': answer,
+        'created_at': time.time()
+    }
+
+    with _answer_cache_lock:
+        _next_entry_id += 1
+        _answer_cache[_next_entry_id] = entry
+        while len(_answer_cache) > ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+            _answer_cache_stats['evictions'] += 1
+
+def invalidate_file(file_id): # удаляет из кэша все ответы, построенные на чанках этого файла
+    return invalidate_files([file_id])
+
+def invalidate_files(file_ids): # один проход по кэшу для многих файлов
+    file_ids = {str(file_id) for file_id in file_ids}
+    with _answer_cache_lock:
+        stale = [entry_id for entry_id, entry in _answer_cache.items() if not file_ids.isdisjoint(entry['file_ids'])]
+        for entry_id in stale:
+            del _answer_cache[entry_id]
+        _answer_cache_stats['invalidations'] += len(stale)
+    return len(stale)
+
+def clear_answer_cache():
+    with _answer_cache_lock:
+        _answer_cache_stats['invalidations'] += len(_answer_cache)
+        _answer_cache.clear()
+
+def get_answer_cache_stats():
+    with _answer_cache_lock:
+        lookups = _answer_cache_stats['hits'] + _answer_cache_stats['misses']
+        return dict(
+            _answer_cache_stats,
+            size=len(_answer_cache),
+            max_size=ANSWER_CACHE_SIZE,
+            hit_rate=_answer_cache_stats['hits'] / lookups if lookups else 0.0
+        )
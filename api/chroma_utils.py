@@ -1,53 +1,205 @@
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
-from langchain_chroma import Chroma
-from typing import List
+from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import os
+import time
 from langchain_core.documents import Document
+from cache_utils import invalidate_file, invalidate_files
+from embedding_utils import CachedEmbeddings, track_embedding_cache
+from lexical_utils import lexical_index
+from vectorstore_utils import create_vectorstore, delete_where
+from db_utils import get_document_ids_by_prefix, delete_document_records
+from resource_utils import lazy_resource
+from loader_utils import EMBEDDING_MODEL_NAME, text_splitter, load_and_split_with_timings, iter_splits, iter_batches
+from metrics_utils import track_stage_timings, record_stage, ingest_chunks_total
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+# Файлы от этого размера индексируются потоково в потоке задачи, а не целиком в пуле разбора
+STREAM_MIN_BYTES = int(os.getenv("STREAM_MIN_BYTES", str(20 * 1024 * 1024)))
 
-embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+# Модель и хранилище создаются при первом обращении: импорт модуля не загружает SentenceTransformer и не открывает Chroma
+embedding_model = lazy_resource("embedding_model", lambda: SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL_NAME))
 
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
+def get_embedding_function():
+    return embedding_model.get()
 
-def load_and_split_document(file_path: str) -> List[Document]:
-    if file_path.endswith('.pdf'):
-        loader = PyPDFLoader(file_path)
-    elif file_path.endswith('.docx'):
-        loader = Docx2txtLoader(file_path)
-    elif file_path.endswith('.html'):
-        loader = UnstructuredHTMLLoader(file_path)
-    else:
-        raise ValueError(f"Unsupported file type: {file_path}")
+# Векторы документов берутся из кэша в rag_app.db, считаются только новые тексты; модель нужна лишь для промахов
+cached_embedding_function = CachedEmbeddings(get_embedding_function, EMBEDDING_MODEL_NAME)
 
-    documents = loader.load()
-    return text_splitter.split_documents(documents)
+# Бэкенд выбирается переменной VECTOR_STORE: chroma (по умолчанию) или numpy
+vectorstore_resource = lazy_resource("vectorstore", lambda: create_vectorstore(cached_embedding_function))
 
-def index_document_to_chroma(file_path: str, file_id: int) -> bool:
-    try:
-        splits = load_and_split_document(file_path)
+def get_vectorstore():
+    return vectorstore_resource.get()
+
+def add_chunks(splits: List[Document], origin: str = "upload") -> List[str]: # все записи в Chroma идут через эту функцию, чтобы BM25-индекс не отставал
+    # Эмбеддинги считаются внутри add_documents; время записи — всё остальное
+    with track_stage_timings() as timings:
+        start = time.perf_counter()
+        ids = get_vectorstore().add_documents(splits)
+        lexical_index.add_documents(ids, splits)
+        elapsed = time.perf_counter() - start
+    record_stage("ingest", "write", max(0.0, elapsed - timings.get("embed", 0.0) / 1000))
+    ingest_chunks_total.inc(len(splits), origin=origin)
+    return ids
+
+def _build_lexical_index():
+    def fetch_page(offset, limit):
+        page = get_vectorstore().get(include=["documents", "metadatas"], limit=limit, offset=offset)
+        return page['ids'], page['documents'], page['metadatas']
+    lexical_index.load(fetch_page)
+    return lexical_index
+
+lexical_index_resource = lazy_resource("lexical_index", _build_lexical_index)
 
-        for i, split in enumerate(splits, start=1):
-            split.metadata['file_id'] = file_id
-            split.metadata['source']  = os.path.basename(file_path)
+def load_lexical_index():
+    return lexical_index_resource.get()
 
-        vectorstore.add_documents(splits)
+def stream_document_to_chroma(file_path: str, file_id: int, source_name: str, on_progress=None, origin: str = "upload") -> int: # число записанных чанков
+    # Чанки пишутся пачками по EMBED_BATCH_SIZE по мере разбора страниц, поэтому пиковая память не зависит от размера файла.
+    # При ошибке уже записанные пачки файла удаляются, чтобы в индексе не осталось половины документа
+    chunks = 0
+    try:
+        for batch in iter_batches(iter_splits(file_path), EMBED_BATCH_SIZE):
+            for split in batch:
+                split.metadata['file_id'] = file_id
+                split.metadata['source'] = source_name
+            add_chunks(batch, origin=origin)
+            chunks += len(batch)
+            if on_progress:
+                # PyPDFLoader кладёт номер страницы и их общее число в метаданные; для остальных форматов прогресс неизвестен
+                metadata = batch[-1].metadata
+                progress = (metadata['page'] + 1) / metadata['total_pages'] if 'total_pages' in metadata and 'page' in metadata else 0.5
+                on_progress(min(0.99, progress), f"{chunks} chunks indexed")
+    except Exception:
+        if chunks:
+            delete_docs_from_chroma([file_id])
+        raise
+    invalidate_file(file_id)
+    return chunks
+
+def index_document_to_chroma(file_path: str, file_id: int, on_progress=None, source_name: str = None) -> bool:
+    try:
+        with track_embedding_cache() as cache_stats:
+            chunks = stream_document_to_chroma(file_path, file_id, source_name or os.path.basename(file_path), on_progress)
+        print(f"Indexed {chunks} chunks for file_id {file_id} (embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses)")
         return True
     except Exception as e:
         print(f"Error indexing document: {e}")
         return False
 
-def delete_doc_from_chroma(file_id: int):
-    try:
-        docs = vectorstore.get(where={"file_id": file_id})
-        print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
+def index_documents_bulk(files, on_progress=None): # files: список (file_path, file_id, source_name)
+    # Разбор PDF/DOCX загружает CPU, поэтому идёт в пуле процессов; эмбеддинги считаются пачками по EMBED_BATCH_SIZE чанков
+    start = time.perf_counter()
+    report = {file_id: {"file_id": file_id, "source": source_name, "success": False, "chunks": 0, "error": None}
+              for _, file_id, source_name in files}
+    pending_chunks = {file_id: 0 for _, file_id, _ in files}
+    batch = []
+    parsed_files = 0
 
-        vectorstore._collection.delete(where={"file_id": file_id})
-        print(f"Deleted all documents with file_id {file_id}")
+    def embed_batch(chunk):
+        try:
+            add_chunks(chunk)
+            for split in chunk:
+                pending_chunks[split.metadata['file_id']] -= 1
+        except Exception as e:
+            for file_id in {split.metadata['file_id'] for split in chunk}:
+                report[file_id]["error"] = f"Embedding failed: {e}"
 
-        return True
+    # Большие файлы не гоняются через пул: чанки всего файла пришлось бы держать в памяти и передавать между процессами
+    large_files = [entry for entry in files if os.path.getsize(entry[0]) >= STREAM_MIN_BYTES]
+    pooled_files = [entry for entry in files if os.path.getsize(entry[0]) < STREAM_MIN_BYTES]
+
+    with track_embedding_cache() as cache_stats, track_stage_timings() as stage_timings, \
+         ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(load_and_split_with_timings, file_path): (file_id, source_name)
+                   for file_path, file_id, source_name in pooled_files}
+
+        for file_path, file_id, source_name in large_files:
+            parsed_files += 1
+            try:
+                report[file_id]["chunks"] = stream_document_to_chroma(file_path, file_id, source_name)
+            except Exception as e:
+                report[file_id]["error"] = f"Indexing failed: {e}"
+            if on_progress:
+                on_progress(parsed_files / len(files), f"{parsed_files}/{len(files)} files parsed")
+
+        for future in as_completed(futures):
+            file_id, source_name = futures[future]
+            parsed_files += 1
+            try:
+                splits, timings = future.result()
+                for stage, ms in timings.items():
+                    record_stage("ingest", stage, ms / 1000)
+            except Exception as e:
+                report[file_id]["error"] = f"Parsing failed: {e}"
+                continue
+
+            for split in splits:
+                split.metadata['file_id'] = file_id
+                split.metadata['source'] = source_name
+            report[file_id]["chunks"] = len(splits)
+            pending_chunks[file_id] = len(splits)
+
+            batch.extend(splits)
+            while len(batch) >= EMBED_BATCH_SIZE:
+                embed_batch(batch[:EMBED_BATCH_SIZE])
+                del batch[:EMBED_BATCH_SIZE]
+
+            if on_progress:
+                on_progress(parsed_files / len(files), f"{parsed_files}/{len(files)} files parsed")
+
+        if batch:
+            embed_batch(batch)
+
+    for file_id, entry in report.items():
+        entry["success"] = entry["error"] is None and entry["chunks"] > 0 and pending_chunks[file_id] == 0
+        if entry["error"] is None and entry["chunks"] == 0:
+            entry["error"] = "No text extracted"
+        invalidate_file(file_id)
+
+    elapsed = time.perf_counter() - start
+    succeeded = [entry for entry in report.values() if entry["success"]]
+    total_chunks = sum(entry["chunks"] for entry in succeeded)
+    return {
+        "files": list(report.values()),
+        "succeeded": len(succeeded),
+        "failed": len(report) - len(succeeded),
+        "chunks": total_chunks,
+        "seconds": elapsed,
+        "docs_per_second": len(succeeded) / elapsed if elapsed else 0.0,
+        "chunks_per_second": total_chunks / elapsed if elapsed else 0.0,
+        "embedding_cache": dict(cache_stats),
+        "stage_ms": {stage: round(ms, 1) for stage, ms in stage_timings.items()}
+    }
+
+def delete_docs_from_chroma(file_ids: List[int]) -> Optional[int]: # число удалённых чанков или None при ошибке
+    file_ids = list(file_ids)
+    if not file_ids:
+        return 0
+    try:
+        # Один удаляющий фильтр $in на все файлы; чанки в память не читаются
+        deleted = delete_where(get_vectorstore(), {"file_id": {"$in": file_ids}})
+        lexical_index.remove_files(file_ids)
+        invalidate_files(file_ids)
+        print(f"Deleted {deleted} document chunks for {len(file_ids)} files")
+        return deleted
     except Exception as e:
-        print(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
-        return False
+        print(f"Error deleting documents with file_ids {file_ids[:10]} from Chroma: {str(e)}")
+        return None
+
+def delete_doc_from_chroma(file_id: int):
+    return delete_docs_from_chroma([file_id]) is not None
+
+def delete_documents(file_ids: List[int] = None, filename_prefix: str = None) -> dict: # чанки из хранилища и записи document_store
+    file_ids = list(file_ids or [])
+    if filename_prefix:
+        file_ids.extend(get_document_ids_by_prefix(filename_prefix))
+    file_ids = sorted(set(file_ids))
+
+    chunks = delete_docs_from_chroma(file_ids)
+    if chunks is None:
+        return {"success": False, "file_ids": len(file_ids), "documents": 0, "chunks": 0}
+    return {"success": True, "file_ids": len(file_ids), "documents": delete_document_records(file_ids), "chunks": chunks}
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import re
+from cache_utils import chunk_key
+from metrics_utils import counter
+
+# Одинаковые одновременные вопросы без истории с одним и тем же контекстом делят одну генерацию:
+# первый запрос (лидер) запускает её в отдельной задаче, остальные читают те же токены и слот модели не занимают
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+
+coalesced_requests_total = counter("rag_chat_coalesced_requests_total", "Generations by coalescing role (leader, follower, uncoalesced).")
+
+_flights = {}
+_coalesce_stats = {"leader": 0, "follower": 0, "uncoalesced": 0}
+
+def normalize_question(question):
+    return " ".join(re.findall(r"\w+", question.lower().replace("ё", "е")))
+
+def flight_key(model, question, docs):
+    return model, normalize_question(question), tuple(chunk_key(doc) for doc in docs)
+
+class Flight:
+    """One generation run in its own task; tokens are buffered so that late joiners replay them from the start."""
+
+    def __init__(self, key=None):
+        self.key = key
+        self.task = None
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self._started = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def start(self):
+        self._started.set()
+
+    async def wait_started(self): # до получения слота модели; ошибки admission control поднимаются здесь
+        await self._started.wait()
+        if self.error is not None and not self.tokens:
+            raise self.error
+
+    def publish(self, token):
+        self.tokens.append(token)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._started.set()
+        self._notify()
+
+    def leave(self):
+        self.subscribers -= 1
+        # Все слушатели ушли — генерацию дальше не ведём; новые запросы с тем же ключом начнут свою
+        if self.subscribers == 0 and not self.done:
+            _forget(self)
+            self.task.cancel()
+
+class Subscription:
+    """A request's hold on a flight, counted from joining rather than from the first read.
+
+    Iterating yields the flight's tokens from the start; `release()` is idempotent and must be called by the
+    holder even if it never reads, so that a follower that has not started streaming keeps the generation alive.
+    """
+
+    def __init__(self, flight):
+        self.flight = flight
+        self.position = 0
+        self.released = False
+        flight.subscribers += 1
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        flight = self.flight
+        while self.position >= len(flight.tokens):
+            if flight.done:
+                self.release()
+                if flight.error is not None:
+                    raise flight.error
+                raise StopAsyncIteration
+            await flight._changed.wait()
+        self.position += 1
+        return flight.tokens[self.position - 1]
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.flight.leave()
+
+def _forget(flight):
+    if flight.key is not None and _flights.get(flight.key) is flight:
+        del _flights[flight.key]
+
+async def _run_flight(flight, produce, limiter, slot):
+    try:
+        if slot is None:
+            slot = await limiter.acquire()
+        flight.start()
+        async for token in produce():
+            flight.publish(token)
+        flight.finish()
+    except asyncio.CancelledError:
+        # Слушателям — обычная ошибка: CancelledError оборвал бы их собственные запросы
+        flight.finish(RuntimeError("Generation was cancelled"))
+        raise
+    except Exception as e:
+        flight.finish(e)
+    finally:
+        if slot is not None:
+            slot.release()
+        _forget(flight)
+
+def start_flight(key, produce, limiter, slot=None): # -> Subscription; key=None — генерация только для этого запроса; slot — уже взятый слот или None
+    flight = _flights.get(key) if key is not None else None
+    if flight is not None:
+        if slot is not None:
+            slot.release()
+        _count("follower")
+        return Subscription(flight)
+
+    flight = Flight(key)
+    if key is not None:
+        _flights[key] = flight
+    flight.task = asyncio.create_task(_run_flight(flight, produce, limiter, slot))
+    _count("leader" if key is not None else "uncoalesced")
+    return Subscription(flight)
+
+def _count(role):
+    _coalesce_stats[role] += 1
+    coalesced_requests_total.inc(role=role)
+
+def get_coalesce_stats():
+    generations = sum(_coalesce_stats.values())
+    return {
+        "enabled": COALESCE_REQUESTS,
+        "leaders": _coalesce_stats["leader"],
+        "followers": _coalesce_stats["follower"],
+        "uncoalesced": _coalesce_stats["uncoalesced"],
+        "in_flight": len(_flights),
+        "coalesced_fraction": _coalesce_stats["follower"] / generations if generations else 0.0
+    }
@@ -0,0 +1,160 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from metrics_utils import histogram, counter
+
+# Не больше MODEL_CONCURRENCY одновременных запросов к модели; ещё до CHAT_QUEUE_SIZE ждут в очереди,
+# остальные сразу получают 429, а ждущие дольше CHAT_QUEUE_TIMEOUT — 503
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "2"))
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "16"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))
+
+queue_wait_seconds = histogram("rag_chat_queue_wait_seconds", "Time chat requests waited for a model slot.")
+queue_rejected_total = counter("rag_chat_queue_rejected_total", "Chat requests rejected by admission control (queue_full, timeout).")
+
+class ModelOverloadedError(Exception):
+    """Raised when a request cannot get a model slot; carries the HTTP status and a Retry-After hint in seconds."""
+
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class ModelSlot:
+    """A held model slot; `release()` is idempotent so streaming responses can release it from several places.
+
+    `share()` gives another holder of the same slot (e.g. a generation task outliving its request);
+    the slot returns to the limiter when every holder has released it.
+    """
+
+    def __init__(self, limiter, waited, holders=None):
+        self.limiter = limiter
+        self.waited = waited
+        self._holders = holders or {"count": 0, "acquired_at": time.perf_counter()}
+        self._holders["count"] += 1
+        self.released = False
+
+    def share(self):
+        return ModelSlot(self.limiter, self.waited, self._holders)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._holders["count"] -= 1
+            if self._holders["count"] == 0:
+                self.limiter._release(time.perf_counter() - self._holders["acquired_at"])
+
+class ModelLimiter:
+    """Per-model slots (asyncio semaphore) with a bounded wait queue; used from the event loop only."""
+
+    def __init__(self, model, limit=MODEL_CONCURRENCY, queue_size=CHAT_QUEUE_SIZE, timeout=CHAT_QUEUE_TIMEOUT):
+        self.model = model
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.avg_service_seconds = None  # скользящее среднее времени занятости слота, для Retry-After
+        self.loop = None  # цикл событий, в котором работает ограничитель; нужен фоновым потокам
+
+    def retry_after(self): # сколько ждать, пока очередь перед новым запросом рассосётся
+        service = self.avg_service_seconds or 1.0
+        return max(1, math.ceil(service * (self.waiting + 1) / self.limit))
+
+    async def acquire(self):
+        self.loop = asyncio.get_running_loop()
+        # waiting считает и тех, кто ещё внутри acquire: так в системе не больше limit + queue_size запросов
+        if self.active + self.waiting >= self.limit + self.queue_size:
+            self.rejected += 1
+            queue_rejected_total.inc(model=self.model, reason="queue_full")
+            raise ModelOverloadedError(429, "queue_full", self.retry_after())
+
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            queue_rejected_total.inc(model=self.model, reason="timeout")
+            raise ModelOverloadedError(503, "queue_timeout", self.retry_after())
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - start
+        queue_wait_seconds.observe(waited, model=self.model)
+        self.admitted += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.active += 1
+        return ModelSlot(self, waited)
+
+    async def try_acquire(self, reserve=0): # слот без ожидания, если очереди нет и свободно больше reserve слотов; иначе None
+        self.loop = asyncio.get_running_loop()
+        if self.waiting or self.active + reserve >= self.limit:
+            return None
+        await self._semaphore.acquire()  # слот свободен — не ждёт
+        self.admitted += 1
+        self.active += 1
+        return ModelSlot(self, 0.0)
+
+    def _release(self, service):
+        self.active -= 1
+        self.avg_service_seconds = service if self.avg_service_seconds is None else 0.8 * self.avg_service_seconds + 0.2 * service
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        slot = await self.acquire()
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_seconds": self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+            "avg_service_seconds": self.avg_service_seconds or 0.0
+        }
+
+_limiters = {}
+
+def get_model_limiter(model):
+    limiter = _limiters.get(model)
+    if limiter is None:
+        limiter = _limiters[model] = ModelLimiter(model)
+    return limiter
+
+@contextmanager
+def background_slot(model): # из рабочего потока: слот модели для фоновой генерации или None, если модель занята
+    # Фоновая работа не встаёт в очередь: она берёт слот, только когда нет ждущих запросов и свободен ещё хотя бы один
+    # слот для интерактивных (при лимите 1 — когда модель простаивает)
+    limiter = _limiters.get(model)
+    slot = None
+    if limiter is not None and limiter.loop is not None:
+        reserve = min(1, limiter.limit - 1)
+        slot = asyncio.run_coroutine_threadsafe(limiter.try_acquire(reserve), limiter.loop).result()
+    try:
+        yield slot
+    finally:
+        if slot is not None:
+            limiter.loop.call_soon_threadsafe(slot.release)
+
+def get_queue_stats():
+    return {model: limiter.stats() for model, limiter in _limiters.items()}
@@ -0,0 +1,109 @@
+import os
+import re
+from langchain_core.documents import Document
+from token_utils import estimate_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+MIN_OVERLAP_CHARS = 30
+# Перекрытие соседних чанков в text_splitter — 200 символов или CHUNK_OVERLAP_TOKENS word-piece (~250 символов латиницы); ищем его с запасом
+MAX_OVERLAP_CHARS = 400
+
+def _overlap_length(left, right): # длина хвоста left, совпадающего с началом right
+    probe = right[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    window_start = max(0, len(left) - MAX_OVERLAP_CHARS)
+    index = left.find(probe, window_start)
+    while index != -1:
+        overlap = len(left) - index
+        if right.startswith(left[index:]):
+            return overlap
+        index = left.find(probe, index + 1)
+    return 0
+
+def _merge_pair(left, right):
+    if right in left:
+        return left
+    if left in right:
+        return right
+    overlap = _overlap_length(left, right)
+    if overlap:
+        return left + right[overlap:]
+    overlap = _overlap_length(right, left)
+    if overlap:
+        return right + left[overlap:]
+    return None
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def _is_near_duplicate(shingles, kept_shingles): # доля шинглов фрагмента, уже присутствующих в выбранном контексте
+    for other in kept_shingles:
+        if shingles and len(shingles & other) / len(shingles) >= NEAR_DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+def pack_context(docs, token_budget=CONTEXT_TOKEN_BUDGET): # docs упорядочены по релевантности
+    tokens_before = sum(estimate_tokens(doc.page_content) for doc in docs)
+
+    # 1. Склеиваем перекрывающиеся и соседние чанки одного файла; место склейки — по лучшему рангу
+    groups = []
+    for rank, doc in enumerate(docs):
+        merged = False
+        for group in groups:
+            if group['file_id'] != doc.metadata.get('file_id'):
+                continue
+            text = _merge_pair(group['text'], doc.page_content)
+            if text is not None:
+                group['text'] = text
+                merged = True
+                break
+        if not merged:
+            groups.append({'file_id': doc.metadata.get('file_id'), 'metadata': dict(doc.metadata), 'text': doc.page_content, 'rank': rank})
+
+    # Склейка могла сделать перекрывающимися ранее независимые группы одного файла
+    changed = True
+    while changed:
+        changed = False
+        for i, group in enumerate(groups):
+            for other in groups[i + 1:]:
+                if group['file_id'] == other['file_id']:
+                    text = _merge_pair(group['text'], other['text'])
+                    if text is not None:
+                        group['text'] = text
+                        groups.remove(other)
+                        changed = True
+                        break
+            if changed:
+                break
+
+    # 2. Отбрасываем почти дубликаты и 3. набираем по релевантности до бюджета токенов
+    packed = []
+    kept_shingles = []
+    used_tokens = 0
+    dropped_duplicates = 0
+    dropped_over_budget = 0
+    for group in sorted(groups, key=lambda g: g['rank']):
+        shingles = _shingles(group['text'])
+        if _is_near_duplicate(shingles, kept_shingles):
+            dropped_duplicates += 1
+            continue
+        tokens = estimate_tokens(group['text'])
+        if packed and used_tokens + tokens > token_budget:
+            dropped_over_budget += 1
+            continue
+        kept_shingles.append(shingles)
+        used_tokens += tokens
+        packed.append(Document(page_content=group['text'], metadata=group['metadata']))
+
+    stats = {
+        "context_chunks_retrieved": len(docs),
+        "context_chunks_packed": len(packed),
+        "context_near_duplicates_dropped": dropped_duplicates,
+        "context_over_budget_dropped": dropped_over_budget,
+        "context_tokens_before_packing": tokens_before,
+        "context_tokens_saved": tokens_before - used_tokens
+    }
+    return packed, stats
@@ -1,75 +1,325 @@
 import sqlite3
+import threading
 from datetime import datetime
 
 DB_NAME = "rag_app.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# Версии схемы: применяются по порядку, номер последней применённой хранится в PRAGMA user_version.
+# Первая миграция использует IF NOT EXISTS, чтобы принять базы, созданные до появления версий.
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS application_logs
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            user_query TEXT,
+            gpt_response TEXT,
+            model TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS document_store
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT,
+            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS embedding_cache
+           (model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (model, text_hash))''',
+        '''CREATE TABLE IF NOT EXISTS notion_objects
+           (notion_id TEXT PRIMARY KEY,
+            object_type TEXT,
+            title TEXT,
+            last_edited_time TEXT,
+            content_hash TEXT,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS notion_documents
+           (file_id INTEGER PRIMARY KEY,
+            notion_id TEXT NOT NULL,
+            doc_key TEXT NOT NULL,
+            UNIQUE (notion_id, doc_key))''',
+        '''CREATE TABLE IF NOT EXISTS ingest_jobs
+           (id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress REAL DEFAULT 0,
+            detail TEXT,
+            filename TEXT,
+            file_path TEXT,
+            file_id INTEGER,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP)''',
+    ]),
+    (2, [
+        'CREATE INDEX IF NOT EXISTS idx_application_logs_session_created ON application_logs (session_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_document_store_upload_timestamp ON document_store (upload_timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_notion_documents_notion_id ON notion_documents (notion_id)',
+        'CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, created_at)',
+    ]),
+    (3, [
+        '''CREATE TABLE IF NOT EXISTS session_summaries
+           (session_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_until_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    ]),
+    (4, [
+        '''CREATE TABLE IF NOT EXISTS app_state
+           (key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    ]),
+]
+
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -20000',
+    'PRAGMA mmap_size = 268435456',
+]
+
+_local = threading.local()
+_migrate_lock = threading.Lock()
+_migrated = False
+
+def _connect():
+    conn = sqlite3.connect(DB_NAME, timeout=5, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def create_application_logs():
-    conn = get_db_connection()
-    conn.execute('''CREATE TABLE IF NOT EXISTS application_logs
-                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     session_id TEXT,
-                     user_query TEXT,
-                     gpt_response TEXT,
-                     model TEXT,
-                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    conn.close()
-
-def create_document_store():
-    conn = get_db_connection()
-    conn.execute('''CREATE TABLE IF NOT EXISTS document_store
-                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     filename TEXT,
-                     upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    conn.close()
+def migrate(conn):
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def get_schema_version():
+    return get_db_connection().execute('PRAGMA user_version').fetchone()[0]
+
+def get_db_connection():
+    # Одно соединение на поток: открывается при первом обращении и переиспользуется всеми функциями модуля
+    global _migrated
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    if not _migrated:
+        with _migrate_lock:
+            if not _migrated:
+                migrate(conn)
+                _migrated = True
+    return conn
+
+def close_db_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
 def insert_application_logs(session_id, user_query, gpt_response, model):
-    conn = get_db_connection()
-    conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
-                 (session_id, user_query, gpt_response, model))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
+                     (session_id, user_query, gpt_response, model))
 
 def get_chat_history(session_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at', (session_id,))
+    cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at, id', (session_id,))
     messages = []
     for row in cursor.fetchall():
         messages.extend([
             {"role": "human", "content": row['user_query']},
             {"role": "ai", "content": row['gpt_response']}
         ])
-    conn.close()
     return messages
 
-def insert_document_record(filename):
+def get_chat_turns(session_id, after_id=0):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
-    file_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    cursor.execute('SELECT id, user_query, gpt_response FROM application_logs WHERE session_id = ? AND id > ? ORDER BY created_at, id',
+                   (session_id, after_id))
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_session_summary(session_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT summary, summarized_until_id FROM session_summaries WHERE session_id = ?', (session_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def upsert_session_summary(session_id, summary, summarized_until_id):
+    with get_db_connection() as conn:
+        conn.execute('''INSERT INTO session_summaries (session_id, summary, summarized_until_id)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(session_id) DO UPDATE SET
+                            summary = excluded.summary,
+                            summarized_until_id = excluded.summarized_until_id,
+                            updated_at = CURRENT_TIMESTAMP''',
+                     (session_id, summary, summarized_until_id))
+
+def insert_document_record(filename):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
+        file_id = cursor.lastrowid
     return file_id
 
 def delete_document_record(file_id):
-    conn = get_db_connection()
-    conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
     return True
 
+def get_document_ids_by_prefix(filename_prefix):
+    # LIKE не подходит: он не различает регистр и трактует % и _ как шаблоны; префикс сравнивается через substr
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM document_store WHERE substr(filename, 1, ?) = ?', (len(filename_prefix), filename_prefix))
+    return [row['id'] for row in cursor.fetchall()]
+
+def delete_document_records(file_ids): # одна транзакция на все file_id -> число удалённых документов
+    deleted = 0
+    with get_db_connection() as conn:
+        for start in range(0, len(file_ids), 500):
+            batch = list(file_ids[start:start + 500])
+            placeholders = ', '.join('?' for _ in batch)
+            deleted += conn.execute(f'DELETE FROM document_store WHERE id IN ({placeholders})', batch).rowcount
+    return deleted
+
 def get_all_documents():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT id, filename, upload_timestamp FROM document_store ORDER BY upload_timestamp DESC')
     documents = cursor.fetchall()
-    conn.close()
     return [dict(doc) for doc in documents]
 
-create_application_logs()
-create_document_store()
\ No newline at end of file
+def get_cached_embeddings(model, text_hashes):
+    vectors = {}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for start in range(0, len(text_hashes), 500):
+        batch = text_hashes[start:start + 500]
+        placeholders = ', '.join('?' for _ in batch)
+        cursor.execute(f'SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})',
+                       (model, *batch))
+        for row in cursor.fetchall():
+            vectors[row['text_hash']] = row['vector']
+    return vectors
+
+def insert_cached_embeddings(model, items):
+    with get_db_connection() as conn:
+        conn.executemany('INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector) VALUES (?, ?, ?)',
+                         [(model, text_hash, vector) for text_hash, vector in items])
+
+def get_notion_objects():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT notion_id, object_type, title, last_edited_time, content_hash, synced_at FROM notion_objects')
+    objects = {row['notion_id']: dict(row) for row in cursor.fetchall()}
+    return objects
+
+def upsert_notion_object(notion_id, object_type, title, last_edited_time, content_hash, synced_at=None): # synced_at — UTC "YYYY-MM-DD HH:MM:SS", по умолчанию сейчас
+    with get_db_connection() as conn:
+        conn.execute('''INSERT INTO notion_objects (notion_id, object_type, title, last_edited_time, content_hash, synced_at)
+                        VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                        ON CONFLICT(notion_id) DO UPDATE SET
+                            object_type = excluded.object_type,
+                            title = excluded.title,
+                            last_edited_time = excluded.last_edited_time,
+                            content_hash = excluded.content_hash,
+                            synced_at = excluded.synced_at''',
+                     (notion_id, object_type, title, last_edited_time, content_hash, synced_at))
+
+def delete_notion_object(notion_id):
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM notion_objects WHERE notion_id = ?', (notion_id,))
+
+def get_notion_documents(notion_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT doc_key, file_id FROM notion_documents WHERE notion_id = ?', (notion_id,))
+    documents = {row['doc_key']: row['file_id'] for row in cursor.fetchall()}
+    return documents
+
+def get_or_create_notion_document(notion_id, doc_key, filename):
+    # file_id документа Notion стабилен между синхронизациями: строка document_store создаётся один раз
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT file_id FROM notion_documents WHERE notion_id = ? AND doc_key = ?', (notion_id, doc_key))
+        row = cursor.fetchone()
+        if row:
+            file_id = row['file_id']
+            cursor.execute('UPDATE document_store SET filename = ?, upload_timestamp = CURRENT_TIMESTAMP WHERE id = ?', (filename, file_id))
+            if cursor.rowcount == 0:
+                cursor.execute('INSERT INTO document_store (id, filename) VALUES (?, ?)', (file_id, filename))
+        else:
+            cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
+            file_id = cursor.lastrowid
+            cursor.execute('INSERT INTO notion_documents (file_id, notion_id, doc_key) VALUES (?, ?, ?)', (file_id, notion_id, doc_key))
+    return file_id
+
+def delete_notion_documents(file_ids, resync=False): # связи с Notion и строки document_store одной транзакцией
+    with get_db_connection() as conn:
+        for start in range(0, len(file_ids), 500):
+            batch = list(file_ids[start:start + 500])
+            placeholders = ', '.join('?' for _ in batch)
+            # resync — документы удалены вручную: их объекты Notion заново проиндексирует следующая инкрементальная синхронизация
+            if resync:
+                conn.execute(f'''DELETE FROM notion_objects WHERE notion_id IN
+                                (SELECT notion_id FROM notion_documents WHERE file_id IN ({placeholders}))''', batch)
+            conn.execute(f'DELETE FROM notion_documents WHERE file_id IN ({placeholders})', batch)
+            conn.execute(f'DELETE FROM document_store WHERE id IN ({placeholders})', batch)
+
+def clear_notion_state():
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM notion_documents')
+        conn.execute('DELETE FROM notion_objects')
+
+def get_app_state(key):
+    row = get_db_connection().execute('SELECT value FROM app_state WHERE key = ?', (key,)).fetchone()
+    return row['value'] if row else None
+
+def set_app_state(key, value):
+    with get_db_connection() as conn:
+        conn.execute('''INSERT INTO app_state (key, value) VALUES (?, ?)
+                        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP''', (key, value))
+
+def insert_ingest_job(job_id, kind, filename=None, file_path=None):
+    with get_db_connection() as conn:
+        conn.execute("INSERT INTO ingest_jobs (id, kind, status, filename, file_path) VALUES (?, ?, 'queued', ?, ?)",
+                     (job_id, kind, filename, file_path))
+
+def update_ingest_job(job_id, **fields):
+    # started_at/finished_at выставляются по смене статуса, остальные поля пишутся как есть
+    assignments = [f"{name} = ?" for name in fields]
+    if fields.get('status') == 'running':
+        assignments.append('started_at = CURRENT_TIMESTAMP')
+    if fields.get('status') in ('completed', 'failed'):
+        assignments.append('finished_at = CURRENT_TIMESTAMP')
+    with get_db_connection() as conn:
+        conn.execute(f"UPDATE ingest_jobs SET {', '.join(assignments)} WHERE id = ?", (*fields.values(), job_id))
+
+def get_ingest_job(job_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''SELECT *,
+                             (julianday(COALESCE(started_at, CURRENT_TIMESTAMP)) - julianday(created_at)) * 86400 AS queued_seconds,
+                             (julianday(COALESCE(finished_at, CURRENT_TIMESTAMP)) - julianday(started_at)) * 86400 AS running_seconds
+                      FROM ingest_jobs WHERE id = ?''', (job_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def get_unfinished_ingest_jobs():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM ingest_jobs WHERE status IN ('queued', 'running') ORDER BY created_at")
+    jobs = cursor.fetchall()
+    return [dict(job) for job in jobs]
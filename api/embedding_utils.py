@@ -0,0 +1,85 @@
+import hashlib
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import List
+from langchain_core.embeddings import Embeddings
+from db_utils import get_cached_embeddings, insert_cached_embeddings
+from metrics_utils import timed
+
+_tracking = threading.local()
+_totals = {"hits": 0, "misses": 0}
+_totals_lock = threading.Lock()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+@contextmanager
+def track_embedding_cache(): # собирает попадания/промахи кэша эмбеддингов для одной загрузки в текущем потоке
+    stats = {"hits": 0, "misses": 0}
+    stack = getattr(_tracking, 'stack', None)
+    if stack is None:
+        stack = _tracking.stack = []
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+def _record(hits, misses):
+    with _totals_lock:
+        _totals['hits'] += hits
+        _totals['misses'] += misses
+    for stats in getattr(_tracking, 'stack', None) or []:
+        stats['hits'] += hits
+        stats['misses'] += misses
+
+def get_embedding_cache_stats():
+    with _totals_lock:
+        return dict(_totals)
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that persists document vectors in SQLite keyed by (model, sha256 of text)."""
+
+    def __init__(self, underlying, model_name: str): # underlying: Embeddings или функция, создающая его при первом промахе
+        self._underlying = underlying
+        self.model_name = model_name
+
+    @property
+    def underlying(self) -> Embeddings:
+        if isinstance(self._underlying, Embeddings):
+            return self._underlying
+        return self._underlying()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with timed("ingest", "embed"):
+            return self._embed_documents(texts)
+
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        cached = get_cached_embeddings(self.model_name, list(set(hashes)))
+
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in cached and h not in missing:
+                missing[h] = text
+
+        computed = {}
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            insert_cached_embeddings(self.model_name, [(h, array('f', vector).tobytes()) for h, vector in computed.items()])
+
+        hits = sum(1 for h in hashes if h in cached)
+        _record(hits=hits, misses=len(texts) - hits)
+
+        result = []
+        for h in hashes:
+            if h in computed:
+                result.append(list(computed[h]))
+            else:
+                result.append(array('f', cached[h]).tolist())
+        return result
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
@@ -1,43 +1,154 @@
 import os
 import requests
 from notion_client import Client
-from chroma_utils import load_and_split_document, vectorstore, text_splitter, delete_doc_from_chroma
-from db_utils import insert_document_record, delete_document_record, get_all_documents
+from notion_client.errors import APIResponseError, HTTPResponseError, RequestTimeoutError
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from chroma_utils import stream_document_to_chroma, get_vectorstore, text_splitter, delete_documents, delete_docs_from_chroma, add_chunks
+from resource_utils import lazy_resource
+from lexical_utils import lexical_index
+from db_utils import (get_notion_objects, upsert_notion_object,
+                      delete_notion_object, get_notion_documents, get_or_create_notion_document,
+                      delete_notion_documents, clear_notion_state, get_app_state, set_app_state)
+from cache_utils import invalidate_file
+from embedding_utils import track_embedding_cache
+from metrics_utils import timed, notion_request_seconds, notion_requests_total
 import tempfile
-import uuid
+import hashlib
+import queue
+import random
+import threading
+import time
 from langchain_core.documents import Document
 from typing import List, Tuple
 
-NOTION_SECRET = "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"
-notion = Client(auth=NOTION_SECRET)
+NOTION_SECRET = os.getenv("NOTION_SECRET", "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")
+NOTION_BASE_URL = os.getenv("NOTION_BASE_URL", "https://api.notion.com")
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3"))  # запросов в секунду в среднем (лимит Notion API)
+NOTION_BURST = int(os.getenv("NOTION_BURST", "5"))
+NOTION_WORKERS = int(os.getenv("NOTION_WORKERS", "8"))
+NOTION_PAGE_WORKERS = int(os.getenv("NOTION_PAGE_WORKERS", "4"))
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "6"))
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+DOWNLOAD_WORKERS = int(os.getenv("NOTION_DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = (10, 120)
+SUPPORTED_ATTACHMENT_EXTENSIONS = ['.pdf', '.docx']
+LEGACY_TEXT_MIGRATION = "notion_legacy_text_removed"
+LEGACY_SCAN_PAGE_SIZE = 5000
+
+notion_client = lazy_resource("notion_client", lambda: Client(auth=NOTION_SECRET, base_url=NOTION_BASE_URL))
+
+# Общая HTTP-сессия для вложений: соединения переиспользуются между загрузками
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS))
+http_session.mount("http://", HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS))
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` accumulated."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds): # после 429 все потоки ждут, пока не пройдёт Retry-After
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+notion_rate_limiter = TokenBucket(NOTION_RATE_LIMIT, NOTION_BURST)
+
+# Пул для запросов дочерних блоков; страницы обходятся в отдельном пуле, чтобы не было взаимной блокировки
+notion_executor = ThreadPoolExecutor(max_workers=NOTION_WORKERS, thread_name_prefix="notion-api")
+
+def notion_method_name(method): # blocks.children.list и т.п. для меток метрик
+    endpoint = type(getattr(method, '__self__', method)).__name__.replace('Endpoint', '')
+    name = getattr(method, '__name__', None)
+    return f"{endpoint}.{name}" if name else endpoint
+
+def notion_call(method, **kwargs): # вызов Notion API с ограничением частоты и повтором при 429/5xx
+    # Длительность включает ожидание лимитера и повторы: именно столько синхронизация ждёт этот вызов
+    name = notion_method_name(method)
+    start = time.perf_counter()
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        notion_rate_limiter.acquire()
+        try:
+            result = method(**kwargs)
+            notion_requests_total.inc(method=name, outcome="ok")
+            notion_request_seconds.observe(time.perf_counter() - start, method=name)
+            return result
+        except (APIResponseError, HTTPResponseError, RequestTimeoutError) as e:
+            status = getattr(e, 'status', None)
+            notion_requests_total.inc(method=name, outcome=str(status or 'timeout'))
+            if attempt == NOTION_MAX_RETRIES or not (status in RETRYABLE_STATUSES or isinstance(e, RequestTimeoutError)):
+                notion_request_seconds.observe(time.perf_counter() - start, method=name)
+                raise
+            retry_after = None
+            headers = getattr(e, 'headers', None)
+            if headers and headers.get('retry-after'):
+                try:
+                    retry_after = float(headers.get('retry-after'))
+                except ValueError:
+                    retry_after = None
+            delay = retry_after if retry_after is not None else min(30, 2 ** attempt) * (0.5 + random.random() / 2)
+            if status == 429:
+                notion_rate_limiter.pause(delay)
+            print(f"  Notion API returned {status or 'timeout'}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def delete_legacy_notion_text(): # однократная миграция: отметка в app_state, чтобы не перебирать всё хранилище при каждой полной синхронизации
+    if get_app_state(LEGACY_TEXT_MIGRATION) is not None:
+        return
+
+    # Текстовые чанки старого формата хранили случайный file_id вида notion_text_xxxxxxxx; метаданные читаются страницами
+    legacy_file_ids = set()
+    offset = 0
+    while True:
+        metadatas = get_vectorstore().get(include=["metadatas"], limit=LEGACY_SCAN_PAGE_SIZE, offset=offset)['metadatas']
+        legacy_file_ids.update(
+            metadata['file_id'] for metadata in metadatas
+            if isinstance(metadata.get('file_id'), str) and metadata['file_id'].startswith('notion_text_')
+        )
+        if len(metadatas) < LEGACY_SCAN_PAGE_SIZE:
+            break
+        offset += LEGACY_SCAN_PAGE_SIZE
+
+    if legacy_file_ids:
+        legacy_file_ids = sorted(legacy_file_ids)
+        get_vectorstore().delete(where={"file_id": {"$in": legacy_file_ids}})
+        lexical_index.remove_files(legacy_file_ids)
+        print(f"Deleted legacy Notion text chunks for {len(legacy_file_ids)} documents")
+    set_app_state(LEGACY_TEXT_MIGRATION, "done")
 
 def delete_old_notion_data(): # функция для удаления старых данных Notion перед новой синхронизацией
     try:
         print("Deleting old Notion data...")
 
-        all_documents = get_all_documents()
-        notion_documents = [doc for doc in all_documents if doc['filename'].startswith('notion_')]
-        
-        deleted_count = 0
-        
-        # Удаляем каждый документ Notion из Chroma и базы данных
-        for doc in notion_documents:
-            try:
-                chroma_success = delete_doc_from_chroma(doc['id'])
+        # Все документы Notion удаляются одним фильтром по file_id и одной транзакцией в SQLite
+        result = delete_documents(filename_prefix='notion_')
+        if not result["success"]:
+            print(f"  Warning: Failed to delete {result['file_ids']} Notion documents from Chroma")
+        deleted_count = result["documents"]
+        print(f"  Deleted {result['chunks']} chunks of old Notion documents")
 
-                if chroma_success:
-                    db_success = delete_document_record(doc['id'])
-                    if db_success:
-                        deleted_count += 1
-                        print(f"  Deleted old Notion document: {doc['filename']}")
-                    else:
-                        print(f"  Warning: Failed to delete from DB: {doc['filename']}")
-                else:
-                    print(f"  Warning: Failed to delete from Chroma: {doc['filename']}")
-                    
-            except Exception as e:
-                print(f"  Error deleting document {doc['filename']}: {e}")
-        
+        delete_legacy_notion_text()
+
+        clear_notion_state()
         print(f"Deleted {deleted_count} old Notion documents")
         return deleted_count
         
@@ -45,18 +156,32 @@ def delete_old_notion_data(): # функция для удаления стар
         print(f"Error deleting old Notion data: {e}")
         return 0
     
-def download_file(url, file_extension): # Скачивает файл по URL и возвращает временный путь к файлу
+def download_file(url, file_extension=''): # потоково скачивает файл во временный файл; None — неподдерживаемый тип, ошибки поднимаются
+    temp_path = None
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
-        temp_file.write(response.content)
-        temp_file.close()
-        
-        return temp_file.name
+        with http_session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            first_chunk = next(chunks, b'')
+
+            if not file_extension:
+                file_extension = detect_file_extension(url, response.headers, first_chunk)
+            if file_extension not in SUPPORTED_ATTACHMENT_EXTENSIONS:
+                return None
+
+            with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
+                temp_path = temp_file.name
+                temp_file.write(first_chunk)
+                for chunk in chunks:
+                    temp_file.write(chunk)
+
+        return temp_path
     except Exception as e:
         print(f"Error downloading file from {url}: {e}")
-        return None
+        if temp_path and os.path.exists(temp_path):
+            os.unlink(temp_path)
+        # Ошибка загрузки — не «неподдерживаемый тип»: страница должна остаться несинхронизированной
+        raise
 
 def get_page_title(page): # фунция извлекает заголовок страницы Notion
     try:
@@ -81,7 +206,7 @@ def get_page_title(page): # фунция извлекает заголовок 
         print(f"Error getting page title: {e}")
         return "Untitled"
 
-def extract_text_from_block(block): # функция извлекает текст из блока Notion
+def extract_text_from_block(block, children=None): # функция извлекает текст из блока Notion
     block_type = block.get('type')
     content = []
 
@@ -101,8 +226,7 @@ def extract_text_from_block(block): # функция извлекает текс
     
     elif block_type == 'table':
         try:
-            table_blocks = notion.blocks.children.list(block['id'])
-            for row in table_blocks.get('results', []):
+            for row in (children or {}).get(block['id'], []):
                 if row.get('type') == 'table_row':
                     cells = row.get('table_row', {}).get('cells', [])
                     for cell in cells:
@@ -115,157 +239,151 @@ def extract_text_from_block(block): # функция извлекает текс
     
     return ' '.join(content)
 
-def process_notion_block(block, page_title): # функция обрабатывает отдельный блок Notion и извлекает файлы и текст
-    try:
-        block_type = block.get('type')
-        file_paths = []
-        text_content = []
-
-        if block_type == 'file':
-            file_data = block.get('file', {})
-            file_url = file_data.get('url')
-            if file_url:
-                file_name = file_data.get('name', 'unknown_file')
-                file_extension = os.path.splitext(file_name)[1].lower()
-                
-                if not file_extension:
-                    file_extension = determine_file_extension(file_url)
-                
-                if file_extension in ['.pdf', '.docx']:
-                    temp_path = download_file(file_url, file_extension)
-                    if temp_path:
-                        file_paths.append(temp_path)
-
-        elif block_type == 'image':
-            image_data = block.get('image', {})
-            image_url = image_data.get('url')
-            if image_url:
-                file_extension = determine_file_extension(image_url)
-                if file_extension in ['.pdf', '.docx']:
-                    temp_path = download_file(image_url, file_extension)
-                    if temp_path:
-                        file_paths.append(temp_path)
-                        
-        text = extract_text_from_block(block)
-        if text:
-            text_content.append(text)
-
-        # Рекурсивно обрабатываем дочерние блоки
-        if block.get('has_children', False):
-            try:
-                child_blocks = notion.blocks.children.list(block['id'])
-                for child_block in child_blocks.get('results', []):
-                    child_file_paths, child_text = process_notion_block(child_block, page_title)
-                    file_paths.extend(child_file_paths)
-                    text_content.extend(child_text)
-            except Exception as e:
-                print(f"Error processing child blocks: {e}")
+def iterate_paginated(method, **kwargs): # проходит по всем страницам ответа Notion API через start_cursor
+    while True:
+        response = notion_call(method, **kwargs)
+        yield from response.get('results', [])
+        if not response.get('has_more'):
+            break
+        kwargs['start_cursor'] = response.get('next_cursor')
+
+def make_attachment(key, file_data, file_url): # описание вложения; скачивание откладывается до индексации
+    url_name = os.path.basename(requests.utils.urlparse(file_url).path)
+    file_name = file_data.get('name') or url_name or 'unknown_file'
+    # Расширение из имени, иначе из пути URL: неподдерживаемые типы отсеиваются ещё до запроса
+    extension = os.path.splitext(file_name)[1] or os.path.splitext(url_name)[1]
+    return {
+        'key': key,
+        'url': file_url,
+        'name': file_name,
+        'extension': extension.lower()
+    }
+
+def list_block_children(block_id): # все дочерние блоки с учётом пагинации
+    return list(iterate_paginated(notion_client.get().blocks.children.list, block_id=block_id))
+
+def fetch_block_tree(root_id): # загружает дерево блоков по уровням, запрашивая потомков параллельно
+    children = {root_id: list_block_children(root_id)}
+    level = [block for block in children[root_id] if block.get('has_children', False)]
+
+    while level:
+        futures = {block['id']: notion_executor.submit(list_block_children, block['id']) for block in level}
+        level = []
+        for block_id, future in futures.items():
+            children[block_id] = future.result()
+            level.extend(block for block in children[block_id] if block.get('has_children', False))
+
+    return children
+
+def process_notion_block(block, page_title, children): # функция обрабатывает отдельный блок Notion и извлекает вложения и текст
+    block_type = block.get('type')
+    attachments = []
+    text_content = []
 
-        return file_paths, text_content
-    except Exception as e:
-        print(f"Error processing notion block: {e}")
-        return [], []
+    if block_type == 'file':
+        file_data = block.get('file', {})
+        file_url = file_data.get('url') or file_data.get(file_data.get('type'), {}).get('url')
+        if file_url:
+            attachments.append(make_attachment(f"block:{block['id']}", file_data, file_url))
+    # Блоки image не скачиваются: индексируются только PDF и DOCX
 
-def process_notion_page_content(page_id, page_title): # функция обрабатывает контент страницы Notion и извлекает файлы и текст
-    try:
-        blocks = notion.blocks.children.list(page_id)
-        file_paths = []
-        text_content = []
-        
-        for block in blocks.get('results', []):
-            block_file_paths, block_text = process_notion_block(block, page_title)
-            file_paths.extend(block_file_paths)
-            text_content.extend(block_text)
-        
-        return file_paths, text_content
-    except Exception as e:
-        print(f"Error processing notion page {page_title}: {e}")
-        return [], []
+
+    text = extract_text_from_block(block, children)
+    if text:
+        text_content.append(text)
+
+    # Дочерние блоки уже загружены в fetch_block_tree; строки таблиц разобраны в extract_text_from_block
+    if block_type != 'table':
+        for child_block in children.get(block['id'], []):
+            child_attachments, child_text = process_notion_block(child_block, page_title, children)
+            attachments.extend(child_attachments)
+            text_content.extend(child_text)
+
+    return attachments, text_content
+
+def process_notion_page_content(page_id, page_title): # функция обрабатывает контент страницы Notion и извлекает вложения и текст
+    children = fetch_block_tree(page_id)
+    attachments = []
+    text_content = []
+
+    for block in children[page_id]:
+        block_attachments, block_text = process_notion_block(block, page_title, children)
+        attachments.extend(block_attachments)
+        text_content.extend(block_text)
+
+    return attachments, text_content
 
 def process_page_properties(page): # фунция обрабатывает свойства страницы Notion, ища файлы в Files & Media
-    try:
-        file_paths = []
-        properties = page.get('properties', {})
-        
-        for prop_name, prop_value in properties.items():
-            prop_type = prop_value.get('type')
-            
-            if prop_type == 'files':
-                files = prop_value.get('files', [])
-                for file_item in files:
-                    file_type = file_item.get('type')
-                    file_data = file_item.get('file', {}) if file_type == 'file' else file_item.get('external', {})
-                    file_url = file_data.get('url')
-                    
-                    if file_url:
-                        file_name = file_data.get('name', 'unknown_file')
-                        file_extension = os.path.splitext(file_name)[1].lower()
-                        
-                        if not file_extension:
-                            file_extension = determine_file_extension(file_url)
-                        
-                        if file_extension in ['.pdf', '.docx']:
-                            temp_path = download_file(file_url, file_extension)
-                            if temp_path:
-                                file_paths.append(temp_path)
-        
-        return file_paths
-    except Exception as e:
-        print(f"Error processing page properties: {e}")
-        return []
+    attachments = []
+    properties = page.get('properties', {})
 
-def process_single_page(page_id, page_title): # функция обрабатывает одну страницу Notion: извлекает файлы и текст
-    print(f"  Processing page content: {page_title}")
-    page_file_paths, page_text = process_notion_page_content(page_id, page_title)
-    return page_file_paths, page_text
+    for prop_name, prop_value in properties.items():
+        prop_type = prop_value.get('type')
 
-def process_database_pages(database_id, database_title): # функция обрабатывает все страницы в базе данных Notion
-    try:
-        pages = notion.databases.query(database_id)
-        all_file_paths = []
-        all_text_content = []
-        
-        for page in pages.get('results', []):
-            page_title = get_page_title(page)
-            print(f"  Processing database page: {page_title}")
+        if prop_type == 'files':
+            files = prop_value.get('files', [])
+            for file_item in files:
+                file_type = file_item.get('type')
+                file_data = file_item.get('file', {}) if file_type == 'file' else file_item.get('external', {})
+                file_url = file_data.get('url')
 
-            property_files = process_page_properties(page)
-            all_file_paths.extend(property_files)
+                if file_url:
+                    file_data = dict(file_data, name=file_item.get('name') or file_data.get('name'))
+                    attachment = make_attachment(f"property:{prop_name}:{file_data.get('name')}", file_data, file_url)
+                    attachments.append(attachment)
 
-            page_file_paths, page_text = process_notion_page_content(page['id'], page_title)
-            all_file_paths.extend(page_file_paths)
-            all_text_content.extend(page_text)
-        
-        return all_file_paths, all_text_content
-    except Exception as e:
-        print(f"Error processing database pages {database_title}: {e}")
-        return [], []
+    return attachments
 
-def determine_file_extension(url): # функция определяет расширение файла по URL
-    try:
-        path = requests.utils.urlparse(url).path
-        extension = os.path.splitext(path)[1].lower()
+def process_single_page(page, page_title): # функция обрабатывает одну страницу Notion: извлекает вложения и текст
+    print(f"  Processing page content: {page_title}")
+    page_attachments, page_text = process_notion_page_content(page['id'], page_title)
+    page_attachments.extend(process_page_properties(page))
+    return page_attachments, page_text
+
+def query_database_pages(database_id): # функция возвращает все строки базы данных Notion с учётом пагинации
+    return list(iterate_paginated(notion_client.get().databases.query, database_id=database_id))
+
+def detect_file_extension(url, headers, first_chunk): # функция определяет расширение по URL, заголовкам ответа и первым байтам
+    path = requests.utils.urlparse(url).path
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ['.pdf', '.docx', '.doc']:
+        return extension
+
+    disposition = headers.get('content-disposition', '')
+    if 'filename=' in disposition:
+        extension = os.path.splitext(disposition.split('filename=')[-1].strip('"\' '))[1].lower()
         if extension in ['.pdf', '.docx', '.doc']:
             return extension
-        
-        try:
-            response = requests.head(url, timeout=5)
-            content_type = response.headers.get('content-type', '').lower()
-            
-            if 'pdf' in content_type:
-                return '.pdf'
-            elif 'word' in content_type or 'docx' in content_type:
-                return '.docx'
-            elif 'msword' in content_type:
-                return '.doc'
-        except:
-            pass
-        
-        return '.bin'
-    except:
-        return '.bin'
 
-def index_text_content(text_content, source_name): # функция индексирует текстовый контент в Chroma
+    content_type = headers.get('content-type', '').lower()
+    if 'pdf' in content_type:
+        return '.pdf'
+    elif 'msword' in content_type:
+        return '.doc'
+    elif 'word' in content_type or 'docx' in content_type:
+        return '.docx'
+
+    if first_chunk.startswith(b'%PDF'):
+        return '.pdf'
+    elif first_chunk.startswith(b'PK\x03\x04'):
+        # ZIP-контейнер — это и xlsx, и pptx, и обычный архив; docx узнаём по каталогу word/ в локальных заголовках
+        return '.docx' if b'word/' in first_chunk else '.zip'
+    elif first_chunk.startswith(b'\xd0\xcf\x11\xe0'):
+        return '.doc'
+
+    return '.bin'
+
+def content_hash(text_content, attachments): # хэш содержимого: текст и состав вложений (подписанные URL не учитываются)
+    digest = hashlib.sha256()
+    for text in text_content:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    for attachment in sorted(attachments, key=lambda a: a['key']):
+        digest.update(f"{attachment['key']}|{attachment['name']}".encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def index_text_content(text_content, source_name, file_id): # функция индексирует текстовый контент в Chroma -> 1/0, None при ошибке
     if not text_content:
         return 0
     
@@ -277,86 +395,255 @@ def index_text_content(text_content, source_name): # функция индекс
         text_doc = Document(
             page_content=full_text,
             metadata={
-                'file_id': f"notion_text_{uuid.uuid4().hex[:8]}",
+                'file_id': file_id,
                 'source': source_name
             }
         )
 
-        splits = text_splitter.split_documents([text_doc])
+        with timed("ingest", "split"):
+            splits = text_splitter.split_documents([text_doc])
 
         for i, split in enumerate(splits):
             split.metadata['chunk_id'] = i
 
         if splits:
-            vectorstore.add_documents(splits)
+            add_chunks(splits, origin="notion")
+            invalidate_file(file_id)
             print(f"    Successfully indexed text from {source_name} ({len(splits)} chunks)")
-            insert_document_record(f"notion_text_{source_name}_{uuid.uuid4().hex[:8]}")
             return 1
     
     except Exception as e:
         print(f"Error indexing text content for {source_name}: {e}")
+        return None
     
     return 0
 
-def index_notion(): # Основная функция для индексации данных из Notion
+def download_attachment(attachment): # выполняется в пуле загрузок
+    if attachment['extension'] and attachment['extension'] not in SUPPORTED_ATTACHMENT_EXTENSIONS:
+        return None
+    with timed("notion", "download"):
+        return download_file(attachment['url'], attachment['extension'])
+
+def index_attachment(attachment, file_path, file_id): # индексирует скачанное вложение в Chroma и удаляет временный файл -> 1/0, None при ошибке
     try:
-        print("Starting Notion indexing...")
+        if stream_document_to_chroma(file_path, file_id, f"notion_{attachment['name']}", origin="notion"):
+            print(f"    Successfully indexed file: {attachment['name']}")
+            return 1
+    except Exception as e:
+        print(f"Error indexing file {attachment['name']}: {e}")
+        return None
+    finally:
+        if os.path.exists(file_path):
+            os.unlink(file_path)
 
-        delete_old_notion_data()
-        search_results = notion.search(query="")    
-        all_file_paths = []
-        indexed_count = 0
-
-        for item in search_results.get('results', []):
-            object_type = item.get('object')
-            
-            if object_type == 'page':
-                page_title = get_page_title(item)
-                print(f"Processing standalone page: {page_title}")
-                page_files, page_text = process_single_page(item['id'], page_title)
-                all_file_paths.extend(page_files)
-
-                if page_text:
-                    indexed_count += index_text_content(page_text, f"page_{page_title}")
-                property_files = process_page_properties(item)
-                all_file_paths.extend(property_files)
-                
-            elif object_type == 'database':
-                database_title = get_page_title(item)
-                print(f"Processing database: {database_title}")
-                database_files, database_text = process_database_pages(item['id'], database_title)
-                all_file_paths.extend(database_files)
-                
-                if database_text:
-                    indexed_count += index_text_content(database_text, f"database_{database_title}")
-
-        for file_path in all_file_paths:
-            if file_path and os.path.exists(file_path):
-                try:
-                    file_id = insert_document_record(f"notion_{os.path.basename(file_path)}_{uuid.uuid4().hex[:8]}")
-                    splits = load_and_split_document(file_path)
-
-                    for split in splits:
-                        split.metadata['file_id'] = file_id
-                        split.metadata['source'] = f"notion_{os.path.basename(file_path)}"
-
-                    if splits:
-                        vectorstore.add_documents(splits)
-                        indexed_count += 1
-                        print(f"Successfully indexed file: {os.path.basename(file_path)}")
-
-                    os.unlink(file_path)
-                    
-                except Exception as e:
-                    print(f"Error indexing file {file_path}: {e}")
-                    if os.path.exists(file_path):
-                        os.unlink(file_path)
+    return 0
 
-        print(f"Notion indexing completed. Indexed {indexed_count} files and text documents.")
+def delete_notion_object_documents(notion_id): # удаляет чанки и записи документов объекта Notion
+    file_ids = list(get_notion_documents(notion_id).values())
+    if file_ids and delete_docs_from_chroma(file_ids) is not None:
+        delete_notion_documents(file_ids)
+
+def is_page_unchanged(page, state, incremental): # быстрая проверка по last_edited_time без запросов к API
+    previous = state.get(page['id'])
+    if not incremental or previous is None or previous['last_edited_time'] != page.get('last_edited_time'):
+        return False
+    # Notion округляет last_edited_time до минуты: правка в ту же минуту, когда началась прошлая синхронизация,
+    # его не меняет. Такие страницы обходятся заново, а совпадение решает хэш содержимого
+    edited_minute = (page.get('last_edited_time') or '')[:16]
+    synced_minute = (previous.get('synced_at') or '')[:16].replace(' ', 'T')
+    return edited_minute < synced_minute
+
+def crawl_notion_page(page, source_name, state, incremental, events, download_executor): # выполняется в пуле страниц
+    try:
+        attachments, page_text = process_single_page(page, get_page_title(page))
+        page_hash = content_hash(page_text, attachments)
+        previous = state.get(page['id'])
+
+        if incremental and previous and previous['content_hash'] == page_hash:
+            events.put(('unchanged', page, page_hash))
+            return
+
+        # Событие страницы ставится в очередь раньше вложений, чтобы старые чанки были удалены до записи новых
+        events.put(('page', page, source_name, page_text, attachments, page_hash))
+        for attachment in attachments:
+            download_executor.submit(download_and_queue, page, attachment, events)
+    except Exception as e:
+        events.put(('failed', page, e))
+
+def download_and_queue(page, attachment, events): # выполняется в пуле загрузок; ошибка передаётся в событии, а не теряется
+    try:
+        events.put(('file', page, attachment, download_attachment(attachment), None))
+    except Exception as e:
+        print(f"Error downloading attachment {attachment['name']}: {e}")
+        events.put(('file', page, attachment, None, e))
+
+def index_notion(incremental=True, on_progress=None): # Основная функция для индексации данных из Notion; ошибки поднимаются дальше
+    try:
+        print(f"Starting Notion indexing ({'incremental' if incremental else 'full'})...")
+        with track_embedding_cache() as cache_stats:
+            indexed_count = index_notion_content(incremental, on_progress)
+        print(f"Notion embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
         return indexed_count
-        
+
     except Exception as e:
         print(f"Error during Notion indexing: {e}")
         import traceback
         print(f"Full traceback: {traceback.format_exc()}")
-        return 0
\ No newline at end of file
+        # Задача синхронизации должна получить статус failed, а не «0 файлов проиндексировано»
+        raise
+
+def index_notion_content(incremental=True, on_progress=None): # синхронизирует рабочее пространство Notion с индексом
+    state = get_notion_objects()
+    # Время начала (UTC, как CURRENT_TIMESTAMP в SQLite): правки после него должны попасть в следующую синхронизацию
+    sync_started_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+    # Полная синхронизация и первая синхронизация после старого формата начинают с чистого листа
+    if not incremental or not state:
+        delete_old_notion_data()
+        state = {}
+
+    search_results = list(iterate_paginated(notion_client.get().search, query=""))
+    databases = [item for item in search_results if item.get('object') == 'database']
+    pages = [item for item in search_results if item.get('object') == 'page']
+
+    seen = set()
+    listing_complete = True
+    summary = {'new': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+    indexed_count = 0
+    jobs = []
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="notion-download") as download_executor, \
+         ThreadPoolExecutor(max_workers=NOTION_PAGE_WORKERS, thread_name_prefix="notion-page") as page_executor:
+        database_futures = {database['id']: page_executor.submit(query_database_pages, database['id']) for database in databases}
+        for database in databases:
+            database_title = get_page_title(database)
+            print(f"Processing database: {database_title}")
+            seen.add(database['id'])
+            try:
+                for page in database_futures[database['id']].result():
+                    jobs.append((page, f"database_{database_title}/{get_page_title(page)}"))
+                upsert_notion_object(database['id'], 'database', database_title, database.get('last_edited_time'), '')
+            except Exception as e:
+                listing_complete = False
+                print(f"Error processing database pages {database_title}: {e}")
+
+        queued_ids = {page['id'] for page, _ in jobs}
+        for page in pages:
+            if page['id'] not in queued_ids:
+                queued_ids.add(page['id'])
+                jobs.append((page, f"page_{get_page_title(page)}"))
+
+        # Конвейер: страницы обходятся и вложения скачиваются параллельно, а разбор и запись в Chroma и SQLite
+        # идут в этом потоке по мере поступления событий, не дожидаясь конца обхода
+        events = queue.Queue()
+        pending_crawls = 0
+        for page, source_name in jobs:
+            seen.add(page['id'])
+            if is_page_unchanged(page, state, incremental):
+                summary['unchanged'] += 1
+                continue
+            page_executor.submit(crawl_notion_page, page, source_name, state, incremental, events, download_executor)
+            pending_crawls += 1
+
+        pending_files = {}
+        page_hashes = {}
+        page_outcomes = {}
+        failed_pages = set()
+
+        finished_pages = summary['unchanged']
+
+        def finish_page(page):
+            nonlocal finished_pages
+            page_hash, outcome = page_hashes.pop(page['id']), page_outcomes.pop(page['id'])
+            if page['id'] in failed_pages:
+                # Страница проиндексирована не целиком: пустые отметки заставят следующую синхронизацию обработать её заново,
+                # а запись об объекте сохраняет его удаление, если страница пропадёт из Notion
+                failed_pages.discard(page['id'])
+                upsert_notion_object(page['id'], 'page', get_page_title(page), '', '')
+                outcome = 'failed'
+            else:
+                upsert_notion_object(page['id'], 'page', get_page_title(page), page.get('last_edited_time'), page_hash, sync_started_at)
+            summary[outcome] += 1
+            finished_pages += 1
+            if on_progress:
+                on_progress(finished_pages / len(jobs), f"{finished_pages}/{len(jobs)} pages")
+
+        while pending_crawls or any(pending_files.values()):
+            event = events.get()
+            kind, page = event[0], event[1]
+            try:
+                if kind == 'unchanged':
+                    pending_crawls -= 1
+                    page_hashes[page['id']] = event[2]
+                    page_outcomes[page['id']] = 'unchanged'
+                    finish_page(page)
+
+                elif kind == 'failed':
+                    pending_crawls -= 1
+                    summary['failed'] += 1
+                    finished_pages += 1
+                    print(f"Error syncing Notion page {page['id']}: {event[2]}")
+
+                elif kind == 'page':
+                    pending_crawls -= 1
+                    _, _, source_name, page_text, attachments, page_hash = event
+                    page_hashes[page['id']] = page_hash
+                    page_outcomes[page['id']] = 'updated' if page['id'] in state else 'new'
+                    pending_files[page['id']] = len(attachments)
+
+                    # Старые чанки удаляются и заменяются новыми под теми же file_id; связи снимаются только
+                    # у вложений, которых больше нет на странице
+                    documents = get_notion_documents(page['id'])
+                    current_keys = {attachment['key'] for attachment in attachments} | ({'text'} if page_text else set())
+                    if documents and delete_docs_from_chroma(list(documents.values())) is None:
+                        failed_pages.add(page['id'])
+                    else:
+                        stale_file_ids = [file_id for key, file_id in documents.items() if key not in current_keys]
+                        if stale_file_ids:
+                            delete_notion_documents(stale_file_ids)
+                        if page_text:
+                            file_id = get_or_create_notion_document(page['id'], 'text', f"notion_text_{source_name}")
+                            indexed = index_text_content(page_text, source_name, file_id)
+                            if indexed is None:
+                                failed_pages.add(page['id'])
+                            else:
+                                indexed_count += indexed
+
+                    if not attachments:
+                        finish_page(page)
+
+                elif kind == 'file':
+                    _, _, attachment, file_path, error = event
+                    pending_files[page['id']] -= 1
+                    if error is not None:
+                        failed_pages.add(page['id'])
+                    if file_path and page['id'] in failed_pages:
+                        # Старые чанки страницы не удалены — новые не пишем, временный файл не нужен
+                        os.unlink(file_path)
+                    elif file_path:
+                        file_id = get_or_create_notion_document(page['id'], attachment['key'], f"notion_{attachment['name']}")
+                        indexed = index_attachment(attachment, file_path, file_id)
+                        if indexed is None:
+                            failed_pages.add(page['id'])
+                        else:
+                            indexed_count += indexed
+                    if pending_files[page['id']] == 0:
+                        finish_page(page)
+            except Exception as e:
+                failed_pages.add(page['id'])
+                print(f"Error applying Notion {kind} event for page {page['id']}: {e}")
+
+    # Удаляем только объекты, которых больше нет в Notion, и только если список объектов получен полностью
+    if listing_complete:
+        for notion_id, previous in state.items():
+            if notion_id not in seen:
+                delete_notion_object_documents(notion_id)
+                delete_notion_object(notion_id)
+                if previous['object_type'] == 'page':
+                    summary['removed'] += 1
+                print(f"  Removed Notion object: {previous['title']}")
+
+    print(f"Notion indexing completed. Indexed {indexed_count} files and text documents. "
+          f"Pages: {summary['new']} new, {summary['updated']} updated, {summary['unchanged']} unchanged, "
+          f"{summary['removed']} removed, {summary['failed']} failed.")
+    return indexed_count
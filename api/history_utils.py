@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from db_utils import get_chat_turns, get_session_summary, upsert_session_summary
+from langchain_utils import get_llm
+from token_utils import estimate_tokens, estimate_messages_tokens
+from concurrency_utils import background_slot
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "150"))
+
+summarize_prompt = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        "You maintain a running summary of a conversation between an employee and a company knowledge-base assistant. "
+        "Update the summary with the new conversation lines, keeping names, product codes, numbers and open questions. "
+        f"Answer with the updated summary only, in the language of the conversation, at most {SUMMARY_MAX_WORDS} words."
+    ),
+    ("human", "Current summary:\n{summary}\n\nNew conversation lines:\n{lines}")
+])
+
+# Сводка обновляется в фоне; одновременно для сессии выполняется не больше одного обновления
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+def turn_messages(turn):
+    return [
+        {"role": "human", "content": turn['user_query']},
+        {"role": "ai", "content": turn['gpt_response']}
+    ]
+
+def update_session_summary(session_id, until_id, model):
+    try:
+        summary_row = get_session_summary(session_id)
+        summarized_until_id = summary_row['summarized_until_id'] if summary_row else 0
+        turns = [turn for turn in get_chat_turns(session_id, summarized_until_id) if turn['id'] <= until_id]
+        if not turns:
+            return
+
+        lines = "\n".join(f"User: {turn['user_query']}\nAssistant: {turn['gpt_response']}" for turn in turns)
+        # Сводка идёт через ограничитель модели; если модель занята, обновление откладывается до следующего хода
+        with background_slot(model) as slot:
+            if slot is None:
+                logging.info(f"Session ID: {session_id}, model {model} is busy, history summary postponed")
+                return
+            summary = (summarize_prompt | get_llm(model) | StrOutputParser()).invoke({
+                "summary": summary_row['summary'] if summary_row else "(empty)",
+                "lines": lines
+            })
+        upsert_session_summary(session_id, summary.strip(), turns[-1]['id'])
+    except Exception as e:
+        logging.error(f"Session ID: {session_id}, failed to update history summary: {e}")
+    finally:
+        with _summarizing_lock:
+            _summarizing.discard(session_id)
+
+def schedule_summary_update(session_id, until_id, model):
+    with _summarizing_lock:
+        if session_id in _summarizing:
+            return
+        _summarizing.add(session_id)
+    summary_executor.submit(update_session_summary, session_id, until_id, model)
+
+def build_chat_history(session_id, model="llama3.2"): # последние реплики в пределах бюджета токенов плюс сводка более ранних
+    summary_row = get_session_summary(session_id)
+    summarized_until_id = summary_row['summarized_until_id'] if summary_row else 0
+    turns = get_chat_turns(session_id, summarized_until_id)
+
+    summary_messages = []
+    if summary_row:
+        summary_messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary_row['summary']}"})
+    budget = HISTORY_TOKEN_BUDGET - estimate_messages_tokens(summary_messages)
+
+    kept = []
+    used_tokens = 0
+    for turn in reversed(turns):
+        turn_tokens = estimate_messages_tokens(turn_messages(turn))
+        if used_tokens + turn_tokens > budget:
+            break
+        kept.insert(0, turn)
+        used_tokens += turn_tokens
+
+    # Реплики, не попавшие в бюджет и ещё не вошедшие в сводку, сворачиваются в фоне
+    dropped = turns[:len(turns) - len(kept)]
+    if dropped:
+        schedule_summary_update(session_id, dropped[-1]['id'], model)
+
+    messages = summary_messages + [message for turn in kept for message in turn_messages(turn)]
+    stats = {
+        "history_turns": len(kept),
+        "dropped_turns": len(dropped),
+        "summary_tokens": estimate_messages_tokens(summary_messages),
+        "history_tokens": used_tokens
+    }
+    return messages, stats
+
+def prompt_token_usage(question, chat_history, history_stats, docs, context_stats=None): # оценка токенов промпта QA для одного запроса
+    context_tokens = sum(estimate_tokens(doc.page_content) for doc in docs)
+    question_tokens = estimate_tokens(question)
+    history_tokens = estimate_messages_tokens(chat_history)
+    return dict(
+        history_stats,
+        **(context_stats or {}),
+        question_tokens=question_tokens,
+        context_tokens=context_tokens,
+        prompt_tokens=question_tokens + context_tokens + history_tokens
+    )
@@ -0,0 +1,167 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from db_utils import (insert_ingest_job, update_ingest_job, get_ingest_job, get_unfinished_ingest_jobs,
+                      insert_document_record, delete_document_record)
+from chroma_utils import index_document_to_chroma, index_documents_bulk, delete_doc_from_chroma, delete_documents
+from etl_notion import index_notion
+from metrics_utils import timed
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+ALLOWED_EXTENSIONS = ['.pdf', '.docx', '.html']
+
+# Индексация выполняется вне потока запроса; состояние задач хранится в таблице ingest_jobs
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+def upload_path(job_id, filename):
+    return os.path.join(UPLOAD_DIR, f"{job_id}{os.path.splitext(filename)[1].lower()}")
+
+def _progress_reporter(job_id):
+    def report(progress, detail=None):
+        update_ingest_job(job_id, progress=progress, detail=detail)
+    return report
+
+def run_upload_job(job_id, file_path, filename):
+    update_ingest_job(job_id, status='running', progress=0.0)
+    file_id = None
+    try:
+        file_id = insert_document_record(filename)
+        update_ingest_job(job_id, file_id=file_id)
+        success = index_document_to_chroma(file_path, file_id, on_progress=_progress_reporter(job_id), source_name=filename)
+        if success:
+            update_ingest_job(job_id, status='completed', progress=1.0, file_id=file_id,
+                              detail=f"File {filename} has been successfully uploaded and indexed.")
+        else:
+            delete_document_record(file_id)
+            update_ingest_job(job_id, status='failed', error=f"Failed to index {filename}.")
+    except Exception as e:
+        logging.error(f"Upload job {job_id} failed: {e}")
+        if file_id is not None:
+            delete_document_record(file_id)
+        update_ingest_job(job_id, status='failed', error=str(e))
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def save_upload(file_obj, file_path):
+    with open(file_path, "wb") as buffer:
+        while chunk := file_obj.read(1024 * 1024):
+            buffer.write(chunk)
+
+def expand_bulk_upload(job_dir): # распаковывает zip-архивы; возвращает (путь, имя) поддерживаемых файлов и отклонённые имена
+    files, rejected = [], []
+    for stored_name in sorted(os.listdir(job_dir)):
+        stored_path = os.path.join(job_dir, stored_name)
+        original_name = stored_name.split('_', 1)[1]
+        extension = os.path.splitext(original_name)[1].lower()
+
+        if extension == '.zip':
+            with zipfile.ZipFile(stored_path) as archive:
+                for index, member in enumerate(archive.infolist()):
+                    member_name = os.path.basename(member.filename)
+                    if member.is_dir() or not member_name:
+                        continue
+                    if os.path.splitext(member_name)[1].lower() not in ALLOWED_EXTENSIONS:
+                        rejected.append(f"{original_name}/{member.filename}")
+                        continue
+                    # Имя из архива не используется как путь, чтобы исключить выход за пределы каталога
+                    target_path = os.path.join(job_dir, f"{os.path.splitext(stored_name)[0]}_zip{index}{os.path.splitext(member_name)[1].lower()}")
+                    with archive.open(member) as source, open(target_path, "wb") as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
+                    files.append((target_path, member_name))
+        elif extension in ALLOWED_EXTENSIONS:
+            files.append((stored_path, original_name))
+        else:
+            rejected.append(original_name)
+    return files, rejected
+
+def run_bulk_upload_job(job_id, job_dir):
+    update_ingest_job(job_id, status='running', progress=0.0)
+    file_ids = []
+    try:
+        files, rejected = expand_bulk_upload(job_dir)
+        indexed_files = []
+        for file_path, filename in files:
+            file_id = insert_document_record(filename)
+            file_ids.append(file_id)
+            indexed_files.append((file_path, file_id, filename))
+
+        report = index_documents_bulk(indexed_files, on_progress=_progress_reporter(job_id))
+        failed_file_ids = [entry['file_id'] for entry in report['files'] if not entry['success']]
+        if failed_file_ids:
+            delete_documents(failed_file_ids)
+        report['rejected'] = rejected
+
+        update_ingest_job(job_id, status='completed', progress=1.0, detail=json.dumps(report, ensure_ascii=False))
+    except Exception as e:
+        logging.error(f"Bulk upload job {job_id} failed: {e}")
+        delete_documents(file_ids)
+        update_ingest_job(job_id, status='failed', error=str(e))
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+def run_notion_job(job_id, incremental=True):
+    update_ingest_job(job_id, status='running', progress=0.0)
+    try:
+        with timed("notion", "sync_incremental" if incremental else "sync_full"):
+            count = index_notion(incremental=incremental, on_progress=_progress_reporter(job_id))
+        update_ingest_job(job_id, status='completed', progress=1.0, detail=f"{count} files indexed")
+    except Exception as e:
+        logging.error(f"Notion sync job {job_id} failed: {e}")
+        update_ingest_job(job_id, status='failed', error=str(e))
+
+def submit_upload_job(file_obj, filename): # сохраняет загрузку на диск и ставит индексацию в очередь
+    job_id = str(uuid.uuid4())
+    file_path = upload_path(job_id, filename)
+    # Каталог создаётся при первой загрузке, а не при импорте модуля
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    save_upload(file_obj, file_path)
+
+    insert_ingest_job(job_id, 'upload', filename=filename, file_path=file_path)
+    ingest_executor.submit(run_upload_job, job_id, file_path, filename)
+    return job_id
+
+def submit_bulk_upload_job(uploads): # uploads: список (file_obj, filename); архивы распаковываются уже в задаче
+    job_id = str(uuid.uuid4())
+    job_dir = os.path.join(UPLOAD_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    for index, (file_obj, filename) in enumerate(uploads):
+        save_upload(file_obj, os.path.join(job_dir, f"{index:05d}_{os.path.basename(filename)}"))
+
+    insert_ingest_job(job_id, 'bulk_upload', filename=f"{len(uploads)} files", file_path=job_dir)
+    ingest_executor.submit(run_bulk_upload_job, job_id, job_dir)
+    return job_id
+
+def submit_notion_job(incremental=True):
+    job_id = str(uuid.uuid4())
+    insert_ingest_job(job_id, 'notion')
+    ingest_executor.submit(run_notion_job, job_id, incremental)
+    return job_id
+
+def get_job_status(job_id):
+    job = get_ingest_job(job_id)
+    if job is None:
+        return None
+    job.pop('file_path', None)
+    if job['kind'] == 'bulk_upload' and job['status'] == 'completed' and job['detail']:
+        job['report'] = json.loads(job.pop('detail'))
+    return job
+
+def recover_jobs(): # после перезапуска: загрузки с сохранённым файлом ставятся в очередь заново, остальное помечается failed
+    for job in get_unfinished_ingest_jobs():
+        if job['kind'] == 'upload' and job['file_id'] is not None:
+            delete_doc_from_chroma(job['file_id'])
+            delete_document_record(job['file_id'])
+        if job['kind'] == 'upload' and job['file_path'] and os.path.exists(job['file_path']):
+            update_ingest_job(job['id'], status='queued', progress=0.0, file_id=None)
+            ingest_executor.submit(run_upload_job, job['id'], job['file_path'], job['filename'])
+        elif job['kind'] == 'bulk_upload':
+            shutil.rmtree(job['file_path'], ignore_errors=True)
+            update_ingest_job(job['id'], status='failed', error="Interrupted by server restart")
+        else:
+            update_ingest_job(job['id'], status='failed', error="Interrupted by server restart")
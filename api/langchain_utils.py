@@ -1,10 +1,114 @@
-from langchain_community.chat_models import ChatOllama
+from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from chroma_utils import vectorstore
+from chroma_utils import get_vectorstore, get_embedding_function, load_lexical_index
+from lexical_utils import lexical_index, reciprocal_rank_fusion
+from vectorstore_utils import batch_search_with_scores
+from cache_utils import lookup_answer, store_answer
+from context_utils import pack_context
+from metrics_utils import timed, record_stage, to_thread_timed
+from coalesce_utils import COALESCE_REQUESTS, start_flight, flight_key
+from collections import OrderedDict
+from typing import Dict
+import logging
+import os
+import re
+import threading
+import time
 
-retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+RETRIEVER_K = 5
+# fixed — всегда RETRIEVER_K чанков; adaptive — от RETRIEVER_MIN_K до RETRIEVER_MAX_K по порогу релевантности
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "adaptive")
+RETRIEVER_MIN_K = int(os.getenv("RETRIEVER_MIN_K", "2"))
+RETRIEVER_MAX_K = int(os.getenv("RETRIEVER_MAX_K", "8"))
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.2"))
+# Гибридный поиск: к векторной выдаче добавляется BM25, списки сливаются через reciprocal rank fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Пакетный поиск (/chat/batch): столько вопросов за один матричный запрос к хранилищу
+BATCH_SEARCH_SIZE = int(os.getenv("BATCH_SEARCH_SIZE", "256"))
+
+REFUSAL_ANSWER = "I don't have enough information in the provided documents to answer this question."
+
+_retrieval_stats = {"searches": 0, "chunks_returned": 0, "no_match": 0, "short_circuited": 0, "lexical_only_chunks": 0}
+_retrieval_lock = threading.Lock()
+
+def _count_retrieval(**counts):
+    with _retrieval_lock:
+        for stat, value in counts.items():
+            _retrieval_stats[stat] += value
+
+def select_relevant(results): # results — [(чанк, расстояние)] по убыванию близости; пустой список — ничто не прошло порог
+    if RETRIEVAL_MODE != "adaptive":
+        docs = [doc for doc, _ in results[:RETRIEVER_K]]
+        _count_retrieval(searches=1, chunks_returned=len(docs))
+        return docs
+
+    # Chroma возвращает расстояния; переводим их в релевантность 0..1 той же функцией, что и as_retriever
+    relevance = get_vectorstore()._select_relevance_score_fn()
+    scored = [(doc, relevance(distance)) for doc, distance in results]
+
+    docs = [doc for doc, score in scored if score >= RELEVANCE_THRESHOLD]
+    if docs and len(docs) < RETRIEVER_MIN_K:
+        docs = [doc for doc, _ in scored[:RETRIEVER_MIN_K]]
+    _count_retrieval(searches=1, chunks_returned=len(docs), no_match=0 if docs else 1)
+    return docs
+
+def search_k():
+    return RETRIEVER_MAX_K if RETRIEVAL_MODE == "adaptive" else RETRIEVER_K
+
+def search_by_vector(question_embedding):
+    with timed("chat", "vector_search"):
+        results = get_vectorstore().similarity_search_by_vector_with_relevance_scores(question_embedding, k=search_k())
+    return select_relevant(results)
+
+def fuse_lexical(query, docs): # добавляет к векторной выдаче BM25 через reciprocal rank fusion
+    # BM25 дополняет только релевантную векторную выдачу: если порог не прошёл ни один чанк, остаётся отказ без генерации
+    if not HYBRID_SEARCH or not docs:
+        return docs
+
+    load_lexical_index()
+    with timed("chat", "lexical_search"):
+        lexical_hits = lexical_index.search(query, k=RETRIEVER_MAX_K)
+    if not lexical_hits:
+        return docs
+
+    docs_by_id = {doc.id: doc for doc in docs}
+    fused_ids = reciprocal_rank_fusion([list(docs_by_id), [chunk_id for chunk_id, _ in lexical_hits]], k=RRF_K)[:RETRIEVER_MAX_K]
+    lexical_only = [chunk_id for chunk_id in fused_ids if chunk_id not in docs_by_id]
+    if lexical_only:
+        docs_by_id.update((doc.id, doc) for doc in get_vectorstore().get_by_ids(lexical_only))
+        _count_retrieval(lexical_only_chunks=len(lexical_only))
+    return [docs_by_id[chunk_id] for chunk_id in fused_ids if chunk_id in docs_by_id]
+
+def search_documents(query, question_embedding=None):
+    if question_embedding is None:
+        with timed("chat", "embed_query"):
+            question_embedding = get_embedding_function().embed_query(query)
+    return fuse_lexical(query, search_by_vector(question_embedding))
+
+def search_documents_batch(queries, question_embeddings): # один пакетный векторный поиск на все вопросы
+    with timed("batch", "vector_search"):
+        results = batch_search_with_scores(get_vectorstore(), question_embeddings, search_k())
+    return [fuse_lexical(query, select_relevant(query_results)) for query, query_results in zip(queries, results)]
+
+retriever = RunnableLambda(lambda query: search_documents(query)).with_config(run_name="hybrid_retriever")
+
+def get_retrieval_stats():
+    with _retrieval_lock:
+        stats = dict(_retrieval_stats)
+    stats.update(
+        mode=RETRIEVAL_MODE,
+        hybrid=HYBRID_SEARCH,
+        lexical_index=lexical_index.stats(),
+        min_k=RETRIEVER_MIN_K,
+        max_k=RETRIEVER_MAX_K,
+        relevance_threshold=RELEVANCE_THRESHOLD,
+        avg_chunks=stats['chunks_returned'] / stats['searches'] if stats['searches'] else 0.0
+    )
+    return stats
 
 contextualize_q_system_prompt = (
     "Given a chat history and the latest user question "
@@ -25,7 +129,7 @@ qa_prompt = ChatPromptTemplate.from_messages([
             "system",
             "Answer ONLY based on the document snippets below. "
             "If the snippets do not contain the answer – say exactly: "
-            "'I don't have enough information in the provided documents to answer this question.' "
+            f"'{REFUSAL_ANSWER}' "
             "Never use outside knowledge. Cite the source at the end [source: ...]\n\n"
             "Snippets:\n{context}",
         ),
@@ -37,9 +141,244 @@ document_prompt = PromptTemplate.from_template(
     "Источник: {source}\n{page_content}"
 )
 
-def get_rag_chain(model="llama3.2"):
-    llm = ChatOllama(model=model, temperature=0)
-    history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+# Слова, которые обычно ссылаются на предыдущие реплики диалога
+FOLLOW_UP_MARKERS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "him", "her",
+    "there", "then", "above", "previous", "same", "more", "else", "also", "why", "how about",
+    "он", "она", "оно", "они", "его", "её", "ее", "их", "ему", "ей", "им", "нему", "ней", "них",
+    "это", "этот", "эта", "эти", "этого", "этой", "этих", "этим", "тот", "та", "те", "того", "той", "тех",
+    "там", "тогда", "такой", "такая", "такие", "тоже", "также", "ещё", "еще", "подробнее", "почему", "а",
+}
+MIN_STANDALONE_WORDS = 4
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "1024"))
+REWRITE_HISTORY_TAIL = 2
+
+_rewrite_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_rewrite_stats = {"rewrites": 0, "skipped_no_history": 0, "skipped_standalone": 0, "cache_hits": 0}
+_rewrite_lock = threading.Lock()
+
+def is_standalone_question(question): # дешёвая эвристика: достаточно длинный вопрос без отсылок к истории
+    words = re.findall(r"\w+", question.lower())
+    if len(words) < MIN_STANDALONE_WORDS:
+        return False
+    lowered = " ".join(words)
+    return not any(re.search(rf"\b{re.escape(marker)}\b", lowered) for marker in FOLLOW_UP_MARKERS)
+
+def _history_tail_key(chat_history):
+    tail = chat_history[-REWRITE_HISTORY_TAIL:]
+    return tuple((message["role"], message["content"]) if isinstance(message, dict) else (message.type, message.content) for message in tail)
+
+def _count_rewrite(stat):
+    with _rewrite_lock:
+        _rewrite_stats[stat] += 1
+
+def create_cached_history_aware_retriever(llm, retriever, prompt):
+    rewrite_chain = prompt | llm | StrOutputParser()
+
+    def contextualize(inputs):
+        question = inputs["input"]
+        chat_history = inputs.get("chat_history") or []
+
+        if not chat_history:
+            _count_rewrite("skipped_no_history")
+            return question
+        if is_standalone_question(question):
+            _count_rewrite("skipped_standalone")
+            return question
+
+        key = (inputs.get("session_id"), _history_tail_key(chat_history), question)
+        with _rewrite_lock:
+            cached = _rewrite_cache.get(key)
+            if cached is not None:
+                _rewrite_cache.move_to_end(key)
+                _rewrite_stats["cache_hits"] += 1
+                return cached
+
+        with timed("chat", "rewrite"):
+            rewritten = rewrite_chain.invoke({"input": question, "chat_history": chat_history})
+        with _rewrite_lock:
+            _rewrite_stats["rewrites"] += 1
+            _rewrite_cache[key] = rewritten
+            if len(_rewrite_cache) > REWRITE_CACHE_SIZE:
+                _rewrite_cache.popitem(last=False)
+        return rewritten
+
+    return (RunnableLambda(contextualize) | retriever).with_config(run_name="chat_retriever_chain")
+
+def get_rewrite_stats():
+    with _rewrite_lock:
+        return dict(_rewrite_stats, cache_size=len(_rewrite_cache))
+
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# Реестр цепочек: одна ChatOllama, цепочка генерации и переформулирующий ретривер на модель на всё время жизни процесса.
+# ChatOllama из langchain_ollama держит постоянные httpx-клиенты (синхронный и асинхронный), поэтому соединения с Ollama
+# переиспользуются между запросами
+_llms: Dict[str, ChatOllama] = {}
+_chains: Dict[str, dict] = {}
+_chain_stats: Dict[str, dict] = {}
+_registry_lock = threading.RLock()
+
+def get_llm(model="llama3.2"):
+    llm = _llms.get(model)
+    if llm is None:
+        with _registry_lock:
+            llm = _llms.get(model)
+            if llm is None:
+                llm = ChatOllama(model=model, temperature=0, keep_alive=OLLAMA_KEEP_ALIVE, base_url=OLLAMA_BASE_URL)
+                _llms[model] = llm
+    return llm
+
+def build_chains(llm):
+    history_aware_retriever = create_cached_history_aware_retriever(llm, retriever, contextualize_q_prompt)
     question_answer_chain = create_stuff_documents_chain(llm, qa_prompt, document_prompt=document_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)    
-    return rag_chain
+    return {"qa": question_answer_chain, "retriever": history_aware_retriever}
+
+def _get_chains(model):
+    chains = _chains.get(model)
+    if chains is None:
+        with _registry_lock:
+            chains = _chains.get(model)
+            if chains is None:
+                start = time.perf_counter()
+                chains = build_chains(get_llm(model))
+                _chains[model] = chains
+                _chain_stats.setdefault(model, {})['build_seconds'] = time.perf_counter() - start
+    return chains
+
+def get_qa_chain(model="llama3.2"): # цепочка генерации по уже найденным документам (input, chat_history, context)
+    return _get_chains(model)["qa"]
+
+def get_history_aware_retriever(model="llama3.2"):
+    return _get_chains(model)["retriever"]
+
+def warmup_model(model="llama3.2"): # строит цепочку и загружает модель в память Ollama до первого запроса
+    _get_chains(model)
+    stats = _chain_stats.setdefault(model, {})
+    try:
+        start = time.perf_counter()
+        # Одного токена достаточно, чтобы Ollama загрузила модель и открылось соединение
+        get_llm(model).invoke("ping", options={"temperature": 0, "num_predict": 1})
+        stats['first_inference_seconds'] = time.perf_counter() - start
+        stats['warm'] = True
+    except Exception as e:
+        logging.error(f"Error warming up model {model}: {e}")
+        stats['warm'] = False
+        stats['error'] = str(e)
+    return stats
+
+def get_chain_stats():
+    return {model: dict(stats) for model, stats in _chain_stats.items()}
+
+def retrieve_for_cache(question): # один расчёт эмбеддинга и для поиска, и для ключа кэша ответов
+    with timed("chat", "embed_query"):
+        question_embedding = get_embedding_function().embed_query(question)
+    docs = search_documents(question, question_embedding)
+    return question_embedding, docs
+
+def retrieve_batch(questions): # пакетный путь без истории: все вопросы одним embed_documents и одним поиском на блок
+    with timed("batch", "embed"):
+        question_embeddings = get_embedding_function().embed_documents(questions)
+    docs_per_question = []
+    for start in range(0, len(questions), BATCH_SEARCH_SIZE):
+        stop = start + BATCH_SEARCH_SIZE
+        docs_per_question.extend(search_documents_batch(questions[start:stop], question_embeddings[start:stop]))
+    return question_embeddings, docs_per_question
+
+def retrieve_context(question, chat_history, session_id, model="llama3.2"): # (эмбеддинг вопроса или None, найденные чанки)
+    # Кэш ответов применяется только без истории: иначе ответ зависит от диалога
+    if not chat_history:
+        return retrieve_for_cache(question)
+
+    docs = get_history_aware_retriever(model).invoke({
+        "input": question,
+        "chat_history": chat_history,
+        "session_id": session_id
+    })
+    return None, docs
+
+def prepare_answer(question, chat_history, session_id, model="llama3.2"): # всё до генерации: поиск, упаковка контекста, кэш ответов
+    with timed("chat", "retrieval"):
+        question_embedding, docs = retrieve_context(question, chat_history, session_id, model)
+    packed_docs, context_stats, ready_answer = prepare_context(model, question_embedding, docs)
+    return question_embedding, docs, packed_docs, context_stats, ready_answer
+
+def prepare_context(model, question_embedding, docs): # упаковка найденных чанков и готовый ответ (отказ или кэш), если генерация не нужна
+    with timed("chat", "pack_context"):
+        packed_docs, context_stats = pack_context(docs)
+
+    # Нечего подставить в промпт — модель всё равно ответила бы отказом, не тратим на это генерацию
+    ready_answer = None
+    if not docs:
+        _count_retrieval(short_circuited=1)
+        ready_answer = REFUSAL_ANSWER
+    elif question_embedding is not None:
+        with timed("chat", "answer_cache"):
+            ready_answer = lookup_answer(model, question_embedding, docs)
+    return packed_docs, context_stats, ready_answer
+
+# Асинхронный путь: поиск и SQLite идут в пуле потоков, генерация — через astream без занятого потока.
+# timings — словарь этапов запроса: в цикле событий нет потока, к которому можно привязать track_stage_timings
+async def astart_generation(question, chat_history, model, question_embedding, docs, packed_docs, limiter, slot=None, timings=None):
+    # Возвращает Subscription, когда слот модели уже получен; при переполненной очереди — ModelOverloadedError.
+    # Вызывающий освобождает её через release(), даже если не прочитал ни одного токена
+    async def produce():
+        answer_parts = []
+        async for token in get_qa_chain(model).astream({"input": question, "chat_history": chat_history, "context": packed_docs}):
+            if token:
+                answer_parts.append(token)
+                yield token
+        if question_embedding is not None:
+            store_answer(model, question_embedding, docs, "".join(answer_parts))
+
+    # Без истории ответ зависит только от вопроса и контекста — такие одновременные запросы делят одну генерацию
+    key = flight_key(model, question, packed_docs) if COALESCE_REQUESTS and not chat_history else None
+    start = time.perf_counter()
+    subscription = start_flight(key, produce, limiter, slot.share() if slot is not None else None)
+    try:
+        await subscription.flight.wait_started()
+    except BaseException:
+        subscription.release()
+        raise
+    record_stage("chat", "queue_wait", time.perf_counter() - start, timings)
+    return subscription
+
+async def consume_generation(tokens, timings): # отдаёт токены дальше и меряет generation/first_token без времени потребителя
+    generation_start = time.perf_counter()
+    generation_seconds = 0.0
+    first = True
+    while True:
+        start = time.perf_counter()
+        token = await anext(tokens, None)
+        generation_seconds += time.perf_counter() - start
+        if token is None:
+            break
+        if first:
+            record_stage("chat", "first_token", time.perf_counter() - generation_start, timings)
+            first = False
+        yield token
+    record_stage("chat", "generation", generation_seconds, timings)
+
+async def _ready_tokens(answer):
+    yield answer
+
+async def aanswer_tokens(question, chat_history, session_id, limiter, model="llama3.2", timings=None, slot=None):
+    # (упакованные чанки, статистика контекста, итератор токенов, Subscription или None для готового ответа);
+    # к моменту возврата слот модели уже получен
+    question_embedding, docs, packed_docs, context_stats, ready_answer = await to_thread_timed(
+        timings, prepare_answer, question, chat_history, session_id, model)
+    if ready_answer is not None:
+        return packed_docs, context_stats, _ready_tokens(ready_answer), None
+
+    subscription = await astart_generation(question, chat_history, model, question_embedding, docs, packed_docs, limiter, slot, timings)
+    return packed_docs, context_stats, consume_generation(subscription, timings), subscription
+
+async def aanswer_question(question, chat_history, session_id, limiter, model="llama3.2", timings=None, slot=None):
+    packed_docs, context_stats, tokens, subscription = await aanswer_tokens(question, chat_history, session_id, limiter, model, timings, slot)
+    try:
+        answer = "".join([token async for token in tokens])
+    finally:
+        if subscription is not None:
+            subscription.release()
+    return answer, packed_docs, context_stats
@@ -0,0 +1,212 @@
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+import numpy as np
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Термы, встречающиеся больше чем в этой доле чанков, не ищутся: вклад в BM25 почти нулевой, а списки вхождений огромные.
+# Отсечка действует только на термы чаще LEXICAL_MAX_DF_MIN чанков — на небольших индексах доля в 10% это один-два
+# чанка, и без порога не находились бы даже редкие артикулы
+LEXICAL_MAX_DF = float(os.getenv("LEXICAL_MAX_DF", "0.1"))
+LEXICAL_MAX_DF_MIN = int(os.getenv("LEXICAL_MAX_DF_MIN", "1000"))
+# Термы больше чем в этой доле чанков не ищутся при любом размере индекса: они совпадают почти с любым вопросом
+LEXICAL_COMMON_DF = float(os.getenv("LEXICAL_COMMON_DF", "0.5"))
+LEXICAL_LOAD_PAGE_SIZE = 5000
+# Доля удалённых чанков, после которой списки вхождений пересобираются
+COMPACT_DEAD_RATIO = 0.25
+
+# Служебные слова в запросе не ищутся: на небольших индексах они есть почти в каждом чанке
+STOP_WORDS = frozenset("""
+a an and are as at be but by can do does for from how i if in is it my of on or that the this to was what when where which
+who why will with you your
+а без в во да для до его ее если же за и из или им их к как ко когда кто ли либо мне мы на над не нет ни но о об
+обо он она они оно от по под при про с со так там то тот у уже что чтобы это я
+""".split())
+
+TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+PART_RE = re.compile(r"\w+")
+
+def tokenize(text): # артикулы вида AB-123/4 индексируются целиком и по частям
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower().replace('ё', 'е')):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(PART_RE.findall(token))
+    return tokens
+
+class LexicalIndex:
+    """Incrementally maintained BM25 inverted index over the chunks stored in the vector store."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = {}  # term -> (array('i') номеров чанков, array('H') частот)
+        self._chunk_ids = []  # номер чанка -> id в векторном хранилище
+        self._chunk_numbers = {}  # id в векторном хранилище -> номер чанка
+        self._file_chunks = {}  # file_id -> номера чанков
+        self._lengths = np.zeros(1024, dtype=np.float32)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._live_count = 0
+        self._total_length = 0
+        self.load_seconds = None
+
+    def _grow(self, size):
+        if size <= len(self._lengths):
+            return
+        capacity = max(size, len(self._lengths) * 2)
+        lengths = np.zeros(capacity, dtype=np.float32)
+        lengths[:len(self._lengths)] = self._lengths
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._lengths, self._alive = lengths, alive
+
+    def _add(self, chunk_id, text, file_id):
+        if chunk_id in self._chunk_numbers:
+            return
+        number = len(self._chunk_ids)
+        self._chunk_ids.append(chunk_id)
+        self._chunk_numbers[chunk_id] = number
+        self._file_chunks.setdefault(str(file_id), []).append(number)
+
+        tokens = tokenize(text)
+        self._grow(number + 1)
+        self._lengths[number] = len(tokens)
+        self._alive[number] = True
+        self._live_count += 1
+        self._total_length += len(tokens)
+
+        for term, tf in Counter(tokens).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('i'), array('H'))
+            postings[0].append(number)
+            postings[1].append(min(tf, 65535))
+
+    def load(self, fetch_page): # fetch_page(offset, limit) -> (ids, texts, metadatas); однократно при первом обращении
+        with self._lock:
+            if self._loaded:
+                return
+            start = time.perf_counter()
+            offset = 0
+            while True:
+                ids, texts, metadatas = fetch_page(offset, LEXICAL_LOAD_PAGE_SIZE)
+                for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                    self._add(chunk_id, text or "", (metadata or {}).get('file_id'))
+                if len(ids) < LEXICAL_LOAD_PAGE_SIZE:
+                    break
+                offset += LEXICAL_LOAD_PAGE_SIZE
+            self._loaded = True
+            self.load_seconds = time.perf_counter() - start
+            print(f"Lexical index loaded: {self._live_count} chunks, {len(self._postings)} terms in {self.load_seconds:.1f}s")
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def add_documents(self, ids, docs):
+        with self._lock:
+            # До загрузки добавлять нечего: эти чанки уже в хранилище и попадут в индекс при load
+            if not self._loaded:
+                return
+            for chunk_id, doc in zip(ids, docs):
+                self._add(chunk_id, doc.page_content, doc.metadata.get('file_id'))
+
+    def remove_files(self, file_ids):
+        with self._lock:
+            if not self._loaded:
+                return 0
+            removed = 0
+            for file_id in file_ids:
+                for number in self._file_chunks.pop(str(file_id), []):
+                    if self._alive[number]:
+                        self._alive[number] = False
+                        self._live_count -= 1
+                        self._total_length -= int(self._lengths[number])
+                        removed += 1
+            if len(self._chunk_ids) and 1 - self._live_count / len(self._chunk_ids) > COMPACT_DEAD_RATIO:
+                self._compact()
+            return removed
+
+    def _compact(self): # выбрасывает удалённые чанки из списков вхождений и перенумеровывает живые
+        alive_numbers = np.flatnonzero(self._alive[:len(self._chunk_ids)])
+        renumber = np.full(len(self._chunk_ids), -1, dtype=np.int64)
+        renumber[alive_numbers] = np.arange(len(alive_numbers))
+
+        postings = {}
+        for term, (numbers, tfs) in self._postings.items():
+            old = np.array(numbers, dtype=np.int32)
+            new = renumber[old]
+            keep = new >= 0
+            if keep.any():
+                postings[term] = (array('i', new[keep].astype(np.int32).tobytes()),
+                                  array('H', np.array(tfs, dtype=np.uint16)[keep].tobytes()))
+        self._postings = postings
+
+        self._chunk_ids = [self._chunk_ids[number] for number in alive_numbers]
+        self._chunk_numbers = {chunk_id: number for number, chunk_id in enumerate(self._chunk_ids)}
+        self._file_chunks = {
+            file_id: [int(renumber[number]) for number in numbers if renumber[number] >= 0]
+            for file_id, numbers in self._file_chunks.items()
+        }
+        lengths = self._lengths[alive_numbers]
+        self._lengths = np.zeros(max(1024, len(alive_numbers) * 2), dtype=np.float32)
+        self._lengths[:len(alive_numbers)] = lengths
+        self._alive = np.zeros(len(self._lengths), dtype=bool)
+        self._alive[:len(alive_numbers)] = True
+
+    def search(self, query, k=10): # [(id в хранилище, BM25)] по убыванию
+        terms = set(tokenize(query)) - STOP_WORDS
+        with self._lock:
+            if not terms or not self._live_count:
+                return []
+            n = self._live_count
+            avg_length = self._total_length / n or 1.0
+            numbers_parts, score_parts = [], []
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                df = len(postings[0])
+                if df > max(LEXICAL_MAX_DF * n, LEXICAL_MAX_DF_MIN) or (df > 1 and df > LEXICAL_COMMON_DF * n):
+                    continue
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                numbers = np.array(postings[0], dtype=np.int32)
+                tf = np.array(postings[1], dtype=np.float32)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[numbers] / avg_length)
+                numbers_parts.append(numbers)
+                score_parts.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+
+            if not numbers_parts:
+                return []
+            numbers = np.concatenate(numbers_parts)
+            candidates, inverse = np.unique(numbers, return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            scores[~self._alive[candidates]] = 0.0
+
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            return [(self._chunk_ids[candidates[i]], float(scores[i])) for i in best if scores[i] > 0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "chunks": self._live_count,
+                "terms": len(self._postings),
+                "load_seconds": self.load_seconds
+            }
+
+lexical_index = LexicalIndex()
+
+def reciprocal_rank_fusion(rankings, k=60): # rankings: списки id по убыванию релевантности
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
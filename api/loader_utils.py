@@ -0,0 +1,131 @@
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+from langchain_core.documents import Document
+from typing import Iterator, List
+from itertools import islice
+from metrics_utils import record_stage, track_stage_timings
+from resource_utils import lazy_resource
+import os
+import time
+
+# Модуль без модели эмбеддингов и Chroma: его импортируют процессы пула разбора файлов; токенизатор лёгкий и грузится в каждом
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# tokens — чанки по окну модели эмбеддингов в word-piece (all-MiniLM-L6-v2 обрезает вход на 256, из них 2 — [CLS] и [SEP]);
+# chars — прежние 1000 символов, из которых у кириллицы заметная часть не доходит до модели
+SPLIT_MODE = os.getenv("SPLIT_MODE", "tokens")
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "254"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))
+
+# Приоритет места разреза перед токеном по тексту между ним и предыдущим: абзац, строка, конец предложения, пробел
+BREAK_PARAGRAPH, BREAK_LINE, BREAK_SENTENCE, BREAK_WORD, BREAK_NONE = 4, 3, 2, 1, 0
+
+def _load_split_tokenizer():
+    from tokenizers import Tokenizer
+    tokenizer = Tokenizer.from_pretrained(f"sentence-transformers/{EMBEDDING_MODEL_NAME}")
+    # В tokenizer.json модели включена обрезка; для разбиения нужны все токены текста
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+split_tokenizer = lazy_resource("split_tokenizer", _load_split_tokenizer)
+
+class TokenWindowSplitter(TextSplitter):
+    """Splits text into chunks of at most `chunk_size` word-pieces of the embedding model's tokenizer.
+
+    Each text is tokenized once and chunk boundaries are picked from the token offsets, preferring
+    a paragraph, line, sentence or word break in the second half of the window.
+    """
+
+    def __init__(self, tokenizer, chunk_size: int = CHUNK_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=self.count_tokens)
+        self._tokenizer = tokenizer  # LazyResource: токенизатор загружается при первом разбиении
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._tokenizer.get().encode(text, add_special_tokens=False).ids)
+
+    def _break_priorities(self, text, offsets):
+        priorities = [BREAK_NONE] * len(offsets)
+        for i in range(1, len(offsets)):
+            gap = text[offsets[i - 1][1]:offsets[i][0]]
+            if "\n\n" in gap:
+                priorities[i] = BREAK_PARAGRAPH
+            elif "\n" in gap:
+                priorities[i] = BREAK_LINE
+            elif gap and text[offsets[i - 1][1] - 1] in ".!?;:":
+                priorities[i] = BREAK_SENTENCE
+            elif gap:
+                priorities[i] = BREAK_WORD
+        return priorities
+
+    def split_text(self, text: str) -> List[str]:
+        offsets = self._tokenizer.get().encode(text, add_special_tokens=False).offsets
+        priorities = self._break_priorities(text, offsets)
+        size, overlap = self._chunk_size, self._chunk_overlap
+        chunks = []
+        start = 0
+        while start < len(offsets):
+            end = len(offsets)
+            if end - start > size:
+                # Лучший разрез во второй половине окна; при равном приоритете — самый поздний
+                end = max(range(start + size // 2 + 1, start + size + 1), key=lambda i: (priorities[i], i))
+            chunk = text[offsets[start][0]:offsets[end - 1][1]].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end == len(offsets):
+                break
+            # Следующий чанк начинается с начала слова не дальше overlap токенов назад
+            start = next((i for i in range(max(start + 1, end - overlap), end) if priorities[i] >= BREAK_WORD), end)
+        return chunks
+
+def create_text_splitter(mode: str = SPLIT_MODE) -> TextSplitter:
+    if mode == "tokens":
+        return TokenWindowSplitter(split_tokenizer)
+    if mode == "chars":
+        return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    raise ValueError(f"Unknown SPLIT_MODE: {mode}")
+
+text_splitter = create_text_splitter()
+
+def get_loader(file_path: str):
+    if file_path.endswith('.pdf'):
+        return PyPDFLoader(file_path)
+    elif file_path.endswith('.docx'):
+        return Docx2txtLoader(file_path)
+    elif file_path.endswith('.html'):
+        return UnstructuredHTMLLoader(file_path)
+    raise ValueError(f"Unsupported file type: {file_path}")
+
+def iter_splits(file_path: str) -> Iterator[Document]:
+    # Страницы разбираются по одной через lazy_load: в памяти только текущая страница и её чанки.
+    # PyPDFLoader отдаёт документ на страницу, так что чанки те же, что при split_documents(loader.load())
+    pages = iter(get_loader(file_path).lazy_load())
+    load_seconds = split_seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            load_seconds += time.perf_counter() - start
+            if page is None:
+                break
+            start = time.perf_counter()
+            splits = text_splitter.split_documents([page])
+            split_seconds += time.perf_counter() - start
+            yield from splits
+    finally:
+        record_stage("ingest", "load", load_seconds)
+        record_stage("ingest", "split", split_seconds)
+
+def iter_batches(items, size): # список по size элементов из итератора, не читая его дальше нужного
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+def load_and_split_document(file_path: str) -> List[Document]:
+    return list(iter_splits(file_path))
+
+def load_and_split_with_timings(file_path: str): # для пула процессов: метрики дочернего процесса возвращаются вместе с чанками
+    with track_stage_timings() as timings:
+        splits = load_and_split_document(file_path)
+    return splits, timings
@@ -1,37 +1,254 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest
-from langchain_utils import get_rag_chain
-from db_utils import insert_application_logs, get_chat_history, get_all_documents, insert_document_record, delete_document_record
-from chroma_utils import index_document_to_chroma, delete_doc_from_chroma
-from etl_notion import index_notion
+from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from pydantic_models import QueryInput, BatchQueryInput, QueryResponse, DocumentInfo, DeleteFileRequest, BulkDeleteRequest, ModelName
+from langchain_utils import (aanswer_question, aanswer_tokens, warmup_model, get_chain_stats, get_rewrite_stats, get_retrieval_stats,
+                             HYBRID_SEARCH)
+from db_utils import insert_application_logs, get_all_documents, delete_document_record, delete_notion_documents, get_document_ids_by_prefix
+from history_utils import build_chat_history, prompt_token_usage
+from chroma_utils import delete_doc_from_chroma, delete_documents, load_lexical_index, get_vectorstore, get_embedding_function
+from cache_utils import get_answer_cache_stats
+from embedding_utils import get_embedding_cache_stats
+from job_utils import submit_upload_job, submit_bulk_upload_job, submit_notion_job, get_job_status, recover_jobs, ingest_executor
+from resource_utils import get_resource_status, is_ready
+from metrics_utils import (timed, record_stage, record_token_usage, register_gauges, render_metrics, to_thread_timed,
+                           chat_requests_total, retrieved_chunks)
+from concurrency_utils import get_model_limiter, get_queue_stats, ModelOverloadedError
+from coalesce_utils import get_coalesce_stats
+from batch_utils import run_batch, BATCH_MAX_QUESTIONS
+from starlette.background import BackgroundTask
+from token_utils import estimate_tokens
+from contextlib import asynccontextmanager
 import os
 import uuid
 import logging
-import shutil
-from typing import Dict
+import json
+import threading
+import time
+from typing import List
 
 logging.basicConfig(filename='app.log', level=logging.INFO, encoding='utf-8')
 
-app = FastAPI()
+# Обязательные для /chat ресурсы; без них /ready отвечает 503. BM25-индекс нужен только гибридному поиску
+CHAT_RESOURCES = ["embedding_model", "vectorstore"] + (["lexical_index"] if HYBRID_SEARCH else [])
 
-indexing_tasks: Dict[str, str] = {}
+def warmup_resources():
+    # Порядок: хранилище и BM25-индекс, затем модель эмбеддингов, затем модели Ollama
+    for name, init in [("vectorstore", get_vectorstore), ("lexical_index", load_lexical_index),
+                       ("embedding_model", lambda: get_embedding_function().embed_query("warmup"))]:
+        if name not in CHAT_RESOURCES:
+            continue
+        try:
+            init()
+        except Exception as e:
+            logging.error(f"Warmup of {name} failed: {e}")
+
+    if os.getenv("WARMUP_MODELS", "1") != "1":
+        return
+    for model in ModelName:
+        stats = warmup_model(model.value)
+        logging.info(f"Warmup for model {model.value}: {stats}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    recover_jobs()
+    # Прогрев в фоне: сервер принимает запросы сразу, /list-docs и /sync-status не ждут модель
+    if os.getenv("WARMUP_RESOURCES", "1") == "1":
+        threading.Thread(target=warmup_resources, daemon=True).start()
+    yield
+    # Незавершённые задачи индексации подхватит recover_jobs при следующем старте
+    ingest_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
+
+# Статистика, которая уже отдаётся отдельными эндпоинтами, дублируется в /metrics как gauge
+register_gauges("rag_retrieval", get_retrieval_stats)
+register_gauges("rag_rewrite", get_rewrite_stats)
+register_gauges("rag_answer_cache", get_answer_cache_stats)
+register_gauges("rag_embedding_cache", get_embedding_cache_stats)
+register_gauges("rag_resource", get_resource_status)
+register_gauges("rag_chat_queue", get_queue_stats)
+register_gauges("rag_coalesce", get_coalesce_stats)
+
+def record_chat_metrics(endpoint, answer, docs, token_usage): # дополняет token_usage числом токенов ответа
+    token_usage["completion_tokens"] = estimate_tokens(answer)
+    record_token_usage(token_usage)
+    retrieved_chunks.observe(len(docs))
+    chat_requests_total.inc(endpoint=endpoint, outcome="ok")
+
+def timed_call(stage, func, *args): # для to_thread_timed: вызов func как этап чата
+    with timed("chat", stage):
+        return func(*args)
+
+def format_timings(timings):
+    return {stage: round(ms, 2) for stage, ms in timings.items()}
+
+@app.get("/ready")
+def ready():
+    ready = is_ready(CHAT_RESOURCES)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "components": get_resource_status(), "models": get_chain_stats()}
+    )
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/model-status")
+def model_status():
+    return get_chain_stats()
+
+@app.get("/rewrite-stats")
+def rewrite_stats():
+    return get_rewrite_stats()
+
+@app.get("/retrieval-stats")
+def retrieval_stats():
+    return get_retrieval_stats()
+
+@app.get("/answer-cache-stats")
+def answer_cache_stats():
+    return get_answer_cache_stats()
+
+@app.get("/embedding-cache-stats")
+def embedding_cache_stats():
+    return get_embedding_cache_stats()
+
+def overloaded_response(error: ModelOverloadedError):
+    return JSONResponse(status_code=error.status_code, headers={"Retry-After": str(error.retry_after)},
+                        content={"detail": f"Model is busy ({error.reason}), retry later", "retry_after": error.retry_after})
 
 @app.post("/chat", response_model=QueryResponse)
-def chat(query_input: QueryInput):
+async def chat(query_input: QueryInput):
     session_id = query_input.session_id or str(uuid.uuid4())
-    logging.info(f"Session ID: {session_id}, User Query: {query_input.question}, , Model: {query_input.model.value}")
-    
-    chat_history = get_chat_history(session_id)
-    rag_chain = get_rag_chain(query_input.model.value)
-    answer = rag_chain.invoke({
-        "input": query_input.question,
-        "chat_history": chat_history
-    })['answer']
+    model = query_input.model.value
+    logging.info(f"Session ID: {session_id}, User Query: {query_input.question}, , Model: {model}")
 
-    insert_application_logs(session_id, query_input.question, answer, query_input.model.value)
-    logging.info(f"Session ID: {session_id}, AI Response: {answer}")
-    return QueryResponse(answer=answer, session_id=session_id, model=query_input.model)
+    # Этапы запроса (история, переписывание вопроса, поиск, генерация, запись лога) пишутся в /metrics и, по запросу, в ответ
+    timings = {}
+    request_start = time.perf_counter()
+    limiter = get_model_limiter(model)
+    slot = None
+    try:
+        chat_history, history_stats = await to_thread_timed(timings, timed_call, "history", build_chat_history, session_id, model)
+        # С историей вопрос переписывается моделью ещё до поиска, поэтому слот берётся сразу;
+        # без истории — только перед генерацией, и только если нет такой же генерации в полёте
+        if chat_history:
+            slot = await limiter.acquire()
+            record_stage("chat", "queue_wait", slot.waited, timings)
+        answer, docs, context_stats = await aanswer_question(query_input.question, chat_history, session_id, limiter, model, timings, slot)
+    except ModelOverloadedError as e:
+        chat_requests_total.inc(endpoint="chat", outcome=e.reason)
+        return overloaded_response(e)
+    except Exception:
+        chat_requests_total.inc(endpoint="chat", outcome="error")
+        raise
+    finally:
+        if slot is not None:
+            slot.release()
+    token_usage = prompt_token_usage(query_input.question, chat_history, history_stats, docs, context_stats)
+    await to_thread_timed(timings, timed_call, "log", insert_application_logs, session_id, query_input.question, answer, model)
+    record_stage("chat", "total", time.perf_counter() - request_start, timings)
+    record_chat_metrics("chat", answer, docs, token_usage)
+    logging.info(f"Session ID: {session_id}, AI Response: {answer}, Token usage: {token_usage}, Timings: {format_timings(timings)}")
+    return QueryResponse(answer=answer, session_id=session_id, model=query_input.model, token_usage=token_usage,
+                         timings=format_timings(timings) if query_input.include_timings else None)
 
+@app.post("/chat/stream")
+async def chat_stream(query_input: QueryInput):
+    session_id = query_input.session_id or str(uuid.uuid4())
+    model = query_input.model.value
+    logging.info(f"Session ID: {session_id}, User Query: {query_input.question}, , Model: {model}, Stream: True")
+
+    # Поиск и получение слота модели — до начала ответа, чтобы при перегрузке вернуть 429/503, а не оборванный поток
+    timings = {}
+    request_start = time.perf_counter()
+    limiter = get_model_limiter(model)
+    slot = None
+    try:
+        chat_history, history_stats = await to_thread_timed(timings, timed_call, "history", build_chat_history, session_id, model)
+        if chat_history:
+            slot = await limiter.acquire()
+            record_stage("chat", "queue_wait", slot.waited, timings)
+        docs, context_stats, tokens, subscription = await aanswer_tokens(query_input.question, chat_history, session_id, limiter, model, timings, slot)
+    except ModelOverloadedError as e:
+        if slot is not None:
+            slot.release()
+        chat_requests_total.inc(endpoint="chat_stream", outcome=e.reason)
+        return overloaded_response(e)
+    except Exception:
+        if slot is not None:
+            slot.release()
+        chat_requests_total.inc(endpoint="chat_stream", outcome="error")
+        raise
+
+    def release():
+        if slot is not None:
+            slot.release()
+        if subscription is not None:
+            subscription.release()
+
+    # NDJSON: сначала источники, затем токены ответа, в конце событие done
+    async def generate():
+        answer_parts = []
+        sources = [{"source": doc.metadata.get("source"), "file_id": doc.metadata.get("file_id")} for doc in docs]
+        yield json.dumps({"type": "sources", "sources": sources}, ensure_ascii=False) + "\n"
+        try:
+            async for token in tokens:
+                answer_parts.append(token)
+                yield json.dumps({"type": "token", "content": token}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            chat_requests_total.inc(endpoint="chat_stream", outcome="error")
+            logging.error(f"Session ID: {session_id}, Stream error: {e}")
+            yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+            return
+        finally:
+            release()
+
+        answer = "".join(answer_parts)
+        try:
+            token_usage = prompt_token_usage(query_input.question, chat_history, history_stats, docs, context_stats)
+            await to_thread_timed(timings, timed_call, "log", insert_application_logs, session_id, query_input.question, answer, model)
+        except Exception as e:
+            # Ответ уже отдан, но запрос не завершён: в /metrics он должен попасть как ошибка
+            chat_requests_total.inc(endpoint="chat_stream", outcome="error")
+            logging.error(f"Session ID: {session_id}, Stream error: {e}")
+            yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+            return
+        record_chat_metrics("chat_stream", answer, docs, token_usage)
+        record_stage("chat", "stream_total", time.perf_counter() - request_start, timings)
+        logging.info(f"Session ID: {session_id}, AI Response: {answer}, Token usage: {token_usage}, Timings: {format_timings(timings)}")
+        done = {"type": "done", "session_id": session_id, "model": model, "token_usage": token_usage}
+        if query_input.include_timings:
+            done["timings"] = format_timings(timings)
+        yield json.dumps(done, ensure_ascii=False) + "\n"
+
+    # Фоновая задача освобождает слот и место в общей генерации, даже если клиент отключился до начала потока
+    return StreamingResponse(generate(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+@app.post("/chat/batch")
+async def chat_batch(batch_input: BatchQueryInput):
+    if not batch_input.questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+    if len(batch_input.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"Too many questions: at most {BATCH_MAX_QUESTIONS} per batch")
+    model = batch_input.model.value
+    logging.info(f"Batch of {len(batch_input.questions)} questions, Model: {model}")
+
+    # NDJSON: событие batch после пакетного поиска, затем ответы в порядке готовности (index — номер вопроса), в конце done
+    async def generate():
+        async for event in run_batch(batch_input.questions, model, get_model_limiter(model), batch_input.include_timings):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/queue-stats")
+def queue_stats():
+    return get_queue_stats()
+
+@app.get("/coalesce-stats")
+def coalesce_stats():
+    return get_coalesce_stats()
 
 @app.post("/upload-doc")
 def upload_and_index_document(file: UploadFile = File(...)):
@@ -41,23 +258,19 @@ def upload_and_index_document(file: UploadFile = File(...)):
     if file_extension not in allowed_extensions:
         raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}")
 
-    temp_file_path = f"temp_{file.filename}"
+    job_id = submit_upload_job(file.file, file.filename)
+    return {"message": f"File {file.filename} has been uploaded and queued for indexing.", "job_id": job_id, "status": "queued"}
 
-    try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+@app.post("/upload-docs")
+def upload_and_index_documents(files: List[UploadFile] = File(...)):
+    allowed_extensions = ['.pdf', '.docx', '.html', '.zip']
+    unsupported = [file.filename for file in files if os.path.splitext(file.filename)[1].lower() not in allowed_extensions]
 
-        file_id = insert_document_record(file.filename)
-        success = index_document_to_chroma(temp_file_path, file_id)
+    if unsupported:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {', '.join(unsupported)}. Allowed types are: {', '.join(allowed_extensions)}")
 
-        if success:
-            return {"message": f"File {file.filename} has been successfully uploaded and indexed.", "file_id": file_id}
-        else:
-            delete_document_record(file_id)
-            raise HTTPException(status_code=500, detail=f"Failed to index {file.filename}.")
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+    job_id = submit_bulk_upload_job([(file.file, file.filename) for file in files])
+    return {"message": f"{len(files)} files have been uploaded and queued for indexing.", "job_id": job_id, "status": "queued"}
 
 @app.get("/list-docs", response_model=list[DocumentInfo])
 def list_documents():
@@ -70,29 +283,34 @@ def delete_document(request: DeleteFileRequest):
     if chroma_delete_success:
         db_delete_success = delete_document_record(request.file_id)
         if db_delete_success:
+            delete_notion_documents([request.file_id], resync=True)
             return {"message": f"Successfully deleted document with file_id {request.file_id} from the system."}
         else:
             return {"error": f"Deleted from Chroma but failed to delete document with file_id {request.file_id} from the database."}
     else:
         return {"error": f"Failed to delete document with file_id {request.file_id} from Chroma."}
 
-@app.post("/sync-notion")
-def sync_notion(background_tasks: BackgroundTasks):
-    task_id = str(uuid.uuid4())
-    indexing_tasks[task_id] = "running"
-    
-    def run_indexing():
-        try:
-            count = index_notion()
-            indexing_tasks[task_id] = f"completed - {count} files indexed"
-        except Exception as e:
-            indexing_tasks[task_id] = f"failed - {str(e)}"
-
-    background_tasks.add_task(run_indexing)
+@app.post("/delete-docs")
+def delete_documents_bulk(request: BulkDeleteRequest):
+    # Пустой префикс совпал бы со всеми документами — такое удаление должно быть явным списком file_ids
+    if not request.file_ids and not request.filename_prefix:
+        raise HTTPException(status_code=400, detail="Provide file_ids or a non-empty filename_prefix")
+    file_ids = sorted(set(request.file_ids or []) | set(get_document_ids_by_prefix(request.filename_prefix) if request.filename_prefix else []))
+    result = delete_documents(file_ids)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=f"Failed to delete {result['file_ids']} documents from Chroma.")
+    # Документы из Notion: связи удаляются, а страницы заново проиндексирует следующая синхронизация
+    delete_notion_documents(file_ids, resync=True)
+    return {"deleted_documents": result["documents"], "deleted_chunks": result["chunks"], "matched_file_ids": result["file_ids"]}
 
+@app.post("/sync-notion")
+def sync_notion(full: bool = False):
+    task_id = submit_notion_job(incremental=not full)
     return {"message": "Notion synchronization started", "task_id": task_id}
 
 @app.get("/sync-status/{task_id}")
 def get_sync_status(task_id: str):
-    status = indexing_tasks.get(task_id, "unknown task")
-    return {"task_id": task_id, "status": status}
\ No newline at end of file
+    job = get_job_status(task_id)
+    if job is None:
+        return {"task_id": task_id, "status": "unknown task"}
+    return {"task_id": task_id, **job}
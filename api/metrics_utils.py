@@ -0,0 +1,182 @@
+import asyncio
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Гистограммы и счётчики в памяти процесса; /metrics отдаёт их в текстовом формате Prometheus
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+_metrics = []
+_collectors = []
+_tracking = threading.local()
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, key, (), value) for key, value in sorted(values.items())]
+
+class Histogram:
+    """Histogram per label set with fixed upper bounds; buckets are made cumulative on exposition."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}  # метки -> [счётчики по корзинам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+        samples = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", key, (), total))
+            samples.append((f"{self.name}_count", key, (), count))
+        return samples
+
+def counter(name, documentation):
+    metric = Counter(name, documentation)
+    _metrics.append(metric)
+    return metric
+
+def histogram(name, documentation, buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, documentation, buckets)
+    _metrics.append(metric)
+    return metric
+
+def register_gauges(prefix, collect): # collect() -> словарь статистики; числовые значения отдаются как gauge prefix_<ключ>
+    _collectors.append((prefix, collect))
+
+stage_seconds = histogram("rag_stage_duration_seconds", "Duration of pipeline stages (chat, ingest, notion).")
+notion_request_seconds = histogram("rag_notion_request_duration_seconds", "Duration of Notion API calls including retries.")
+notion_requests_total = counter("rag_notion_requests_total", "Notion API calls by method and outcome.")
+chat_requests_total = counter("rag_chat_requests_total", "Chat requests by endpoint and outcome.")
+tokens_total = counter("rag_tokens_total", "Estimated tokens by kind (question, history, context, prompt, completion).")
+retrieved_chunks = histogram("rag_retrieved_chunks", "Chunks retrieved and packed into the prompt per question.", COUNT_BUCKETS)
+ingest_chunks_total = counter("rag_ingest_chunks_total", "Chunks written to the vector store by source (upload, notion).")
+
+@contextmanager
+def track_stage_timings(timings=None): # собирает длительности этапов (мс) в словарь для текущего потока; вложенные вызовы тоже видят их
+    timings = {} if timings is None else timings
+    stack = getattr(_tracking, 'stack', None)
+    if stack is None:
+        stack = _tracking.stack = []
+    stack.append(timings)
+    try:
+        yield timings
+    finally:
+        # По идентичности, а не list.remove: вложенные словари с одинаковыми значениями равны
+        del stack[next(i for i in range(len(stack) - 1, -1, -1) if stack[i] is timings)]
+
+def record_stage(pipeline, stage, seconds, timings=None): # timings — явный словарь запроса для кода в цикле событий, где нет своего потока
+    stage_seconds.observe(seconds, pipeline=pipeline, stage=stage)
+    targets = list(getattr(_tracking, 'stack', None) or [])
+    if timings is not None and all(target is not timings for target in targets):
+        targets.append(timings)
+    for target in targets:
+        target[stage] = target.get(stage, 0.0) + seconds * 1000
+
+@contextmanager
+def timed(pipeline, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(pipeline, stage, time.perf_counter() - start)
+
+async def to_thread_timed(timings, func, *args): # синхронная часть запроса в пуле потоков; её этапы попадают в timings
+    def call():
+        with track_stage_timings(timings):
+            return func(*args)
+    return await asyncio.to_thread(call)
+
+def record_token_usage(token_usage):
+    for kind in ("question_tokens", "history_tokens", "context_tokens", "prompt_tokens", "completion_tokens"):
+        if token_usage.get(kind):
+            tokens_total.inc(token_usage[kind], kind=kind[:-len("_tokens")])
+
+def _gauge_samples():
+    lines = []
+    for prefix, collect in _collectors:
+        try:
+            stats = collect()
+        except Exception:
+            continue
+        for key, value in sorted(_flatten(stats).items()):
+            name = f"{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(float(value))}")
+    return lines
+
+def _flatten(stats, prefix=""):
+    flat = {}
+    for key, value in stats.items():
+        name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}{key}")
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}_"))
+        elif isinstance(value, (bool, int, float)):
+            flat[name] = value
+    return flat
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, extra, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key, extra)} {_format_value(value)}")
+    lines.extend(_gauge_samples())
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from enum import Enum
 from datetime import datetime
+from typing import Dict, List, Optional
 
 class ModelName(str, Enum):
     LLAMA3_2 = "llama3.2"
@@ -11,11 +12,19 @@ class QueryInput(BaseModel):
     question: str
     session_id: str = Field(default=None)
     model: ModelName = Field(default=ModelName.LLAMA3_2)
+    include_timings: bool = Field(default=False)
+
+class BatchQueryInput(BaseModel):
+    questions: List[str]
+    model: ModelName = Field(default=ModelName.LLAMA3_2)
+    include_timings: bool = Field(default=False)
 
 class QueryResponse(BaseModel):
     answer: str
     session_id: str
     model: ModelName
+    token_usage: Optional[Dict[str, int]] = None
+    timings: Optional[Dict[str, float]] = None
 
 class DocumentInfo(BaseModel):
     id: int
@@ -24,3 +33,7 @@ class DocumentInfo(BaseModel):
 
 class DeleteFileRequest(BaseModel):
     file_id: int
+
+class BulkDeleteRequest(BaseModel):
+    file_ids: List[int] = Field(default_factory=list)
+    filename_prefix: Optional[str] = None
@@ -0,0 +1,52 @@
+import threading
+import time
+
+# Тяжёлые ресурсы (модель эмбеддингов, векторное хранилище, клиенты API) создаются при первом обращении,
+# а не при импорте; время инициализации каждого видно в /ready
+_resources = {}
+
+class LazyResource:
+    """Value built by `factory` on first `get()`; thread-safe, remembers init time and the last error."""
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._value = None
+        self._ready = False
+        self._lock = threading.Lock()
+        self.init_seconds = None
+        self.error = None
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.init_seconds = time.perf_counter() - start
+                self.error = None
+                self._ready = True
+        return self._value
+
+    @property
+    def ready(self):
+        return self._ready
+
+    def status(self):
+        return {"ready": self._ready, "init_seconds": self.init_seconds, "error": self.error}
+
+def lazy_resource(name, factory):
+    resource = LazyResource(name, factory)
+    _resources[name] = resource
+    return resource
+
+def get_resource_status():
+    return {name: resource.status() for name, resource in _resources.items()}
+
+def is_ready(names):
+    return all(_resources[name].ready for name in names)
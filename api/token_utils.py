@@ -0,0 +1,13 @@
+import math
+import os
+
+# Грубая оценка числа токенов без токенизатора модели: llama3.2 в среднем даёт ~3.5 символа на токен
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def estimate_messages_tokens(messages):
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
@@ -0,0 +1,531 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# chroma — Chroma в ./chroma_db; numpy — плоский/IVF индекс на memory-mapped массивах в ./numpy_store
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+NUMPY_STORE_DIR = os.getenv("NUMPY_STORE_DIR", "./numpy_store")
+NUMPY_STORE_DTYPE = os.getenv("NUMPY_STORE_DTYPE", "float32")  # float32 или int8
+# IVF включается, когда в хранилище не меньше NUMPY_IVF_MIN_ROWS чанков; меньше — точный перебор.
+# Центроиды обучаются в фоновом потоке; пока обучение идёт, поиск использует прежние списки или точный перебор
+NUMPY_IVF_MIN_ROWS = int(os.getenv("NUMPY_IVF_MIN_ROWS", "200000"))
+NUMPY_IVF_NPROBE = int(os.getenv("NUMPY_IVF_NPROBE", "16"))
+SEARCH_BLOCK_ROWS = 65536
+INT8_DECODE_ROWS = 1024
+# Поля метаданных, по которым возможна фильтрация, и массивы с их кодами
+FILTER_FIELDS = {"file_id": "file_codes", "source": "source_codes"}
+
+def create_vectorstore(embedding_function: Embeddings, kind: str = VECTOR_STORE) -> VectorStore:
+    if kind == "chroma":
+        from langchain_chroma import Chroma
+        return Chroma(persist_directory="./chroma_db", embedding_function=embedding_function)
+    if kind == "numpy":
+        return NumpyVectorStore(NUMPY_STORE_DIR, embedding_function, dtype=NUMPY_STORE_DTYPE)
+    raise ValueError(f"Unknown VECTOR_STORE: {kind}")
+
+def batch_search_with_scores(store: VectorStore, embeddings: List[List[float]], k: int,
+                             filter: Optional[dict] = None) -> List[List[Tuple[Document, float]]]:
+    """Top-k (document, distance) lists for many query vectors in one call to the store."""
+    if isinstance(store, NumpyVectorStore):
+        return store.batch_similarity_search_by_vector(embeddings, k, filter)
+    # Chroma принимает сразу несколько эмбеддингов в одном query; langchain_chroma это не оборачивает
+    results = store._collection.query(query_embeddings=embeddings, n_results=k, where=filter,
+                                      include=["documents", "metadatas", "distances"])
+    return [
+        [(Document(page_content=text, metadata=metadata or {}, id=chunk_id), distance)
+         for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)]
+        for ids, texts, metadatas, distances in zip(results["ids"], results["documents"], results["metadatas"], results["distances"])
+    ]
+
+def delete_where(store: VectorStore, where: dict) -> int:
+    """Delete every chunk matching a metadata filter in one call; returns the number of chunks removed."""
+    if isinstance(store, NumpyVectorStore):
+        return store.delete(where=where)
+    # include=[] — Chroma отдаёт только id, без текстов, метаданных и векторов
+    matched = len(store._collection.get(where=where, include=[])["ids"])
+    if matched:
+        store._collection.delete(where=where)
+    return matched
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _value_key(value): # 5 и "5" — разные значения, как и в Chroma
+    return json.dumps(value, ensure_ascii=False)
+
+class NumpyVectorStore(VectorStore):
+    """Vector store over memory-mapped float32/int8 arrays with exact or IVF top-k; texts and metadata live in SQLite.
+
+    Distances are squared L2 between unit vectors (2 - 2·cos), the same scale as Chroma's default space,
+    so relevance thresholds carry over between backends. Filters support equality and $in on file_id and source.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function: Embeddings, dtype: str = "float32",
+                 ivf_min_rows: int = NUMPY_IVF_MIN_ROWS, nprobe: int = NUMPY_IVF_NPROBE):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        self._embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._ivf_lock = threading.Lock()  # одно обучение IVF за раз
+        self._ivf_training = False
+        os.makedirs(persist_directory, exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(persist_directory, "store.db"), check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, text TEXT, metadata TEXT);
+            CREATE TABLE IF NOT EXISTS codes (field TEXT NOT NULL, value TEXT NOT NULL, code INTEGER NOT NULL, PRIMARY KEY (field, value));
+            CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        info = dict(self._db.execute('SELECT key, value FROM store_info').fetchall())
+        self.dtype = info.get('dtype', dtype)
+        self.dim = int(info['dim']) if 'dim' in info else None
+        self.size = int(info.get('size', 0))
+
+        self._codes = {field: {} for field in FILTER_FIELDS}
+        for field, value, code in self._db.execute('SELECT field, value, code FROM codes'):
+            self._codes[field][value] = code
+
+        self._arrays = {}
+        self._centroids = None
+        self._ivf_rows = None
+        self._ivf_trained_size = 0
+        if self.dim is not None:
+            self._open_arrays(max(self.size, 1024))
+            self._load_ivf()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    # --- хранение ---
+
+    def _array_specs(self):
+        specs = {
+            "vectors": (np.int8 if self.dtype == "int8" else np.float32, (self.dim,)),
+            "file_codes": (np.int32, ()),
+            "source_codes": (np.int32, ()),
+            "alive": (np.uint8, ()),
+            "ivf_lists": (np.int32, ()),
+        }
+        if self.dtype == "int8":
+            specs["scales"] = (np.float32, ())
+        return specs
+
+    def _open_arrays(self, capacity): # файлы растут удвоением; старые строки не копируются
+        for name, (dtype, tail) in self._array_specs().items():
+            path = os.path.join(self.persist_directory, f"{name}.bin")
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(tail, dtype=np.int64))
+            old_array = self._arrays.get(name)
+            if old_array is not None:
+                old_array.flush()
+            with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+                current = f.seek(0, os.SEEK_END)
+                if current < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+                    if name == "ivf_lists":
+                        f.seek(current)
+                        f.write(np.full(capacity - current // row_bytes, -1, dtype=np.int32).tobytes())
+            self._arrays[name] = np.memmap(path, dtype=dtype, mode="r+", shape=(capacity,) + tail)
+        self.capacity = capacity
+
+    def _ensure_capacity(self, rows):
+        if rows > self.capacity:
+            self._open_arrays(max(rows, self.capacity * 2))
+
+    def _code(self, field, value):
+        key = _value_key(value)
+        code = self._codes[field].get(key)
+        if code is None:
+            code = len(self._codes[field])
+            self._codes[field][key] = code
+            self._db.execute('INSERT INTO codes (field, value, code) VALUES (?, ?, ?)', (field, key, code))
+        return code
+
+    def _write_vectors(self, rows, vectors):
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._arrays["vectors"][rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._arrays["scales"][rows] = scales
+        else:
+            self._arrays["vectors"][rows] = vectors
+
+    def _read_vectors(self, rows, arrays=None): # rows — срез или массив номеров строк; arrays — снимок self._arrays
+        arrays = arrays or self._arrays
+        block = arrays["vectors"][rows]
+        if self.dtype == "int8":
+            return block.astype(np.float32) * arrays["scales"][rows][:, None]
+        return block
+
+    def _scores(self, rows, queries, arrays): # косинусы queries (m, dim) со строками rows -> (m, len(rows))
+        block = arrays["vectors"][rows]
+        if self.dtype != "int8":
+            return queries @ block.T
+        # int8 распаковывается кусками, помещающимися в кэш CPU; масштаб строки умножается на готовые скоры
+        scores = np.empty((len(queries), len(block)), dtype=np.float32)
+        for start in range(0, len(block), INT8_DECODE_ROWS):
+            scores[:, start:start + INT8_DECODE_ROWS] = queries @ block[start:start + INT8_DECODE_ROWS].astype(np.float32).T
+        return scores * arrays["scales"][rows]
+
+    def _flush(self):
+        for array in self._arrays.values():
+            array.flush()
+
+    # --- запись ---
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [chunk_id or str(uuid.uuid4()) for chunk_id in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = _normalize(self._embedding_function.embed_documents(texts))
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._db.executemany('INSERT OR REPLACE INTO store_info (key, value) VALUES (?, ?)',
+                                     [('dim', str(self.dim)), ('dtype', self.dtype)])
+                self._open_arrays(max(1024, len(texts)))
+            self._delete_ids(ids)
+
+            start = self.size
+            rows = np.arange(start, start + len(texts))
+            self._ensure_capacity(start + len(texts))
+            self._write_vectors(rows, vectors)
+            self._arrays["file_codes"][rows] = [self._code("file_id", m.get("file_id")) for m in metadatas]
+            self._arrays["source_codes"][rows] = [self._code("source", m.get("source")) for m in metadatas]
+            self._arrays["alive"][rows] = 1
+            if self._centroids is not None:
+                self._assign_to_lists(rows, vectors)
+            self._flush()
+
+            self.size = start + len(texts)
+            self._db.executemany('INSERT INTO chunks (row, id, text, metadata) VALUES (?, ?, ?, ?)', [
+                (int(row), chunk_id, text, json.dumps(metadata, ensure_ascii=False))
+                for row, chunk_id, text, metadata in zip(rows, ids, texts, metadatas)
+            ])
+            self._db.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('size', ?)", (str(self.size),))
+            self._db.commit()
+            # После обновления size: запись, перешедшая порог IVF, сразу запускает обучение
+            self._schedule_ivf()
+        return ids
+
+    def _delete_rows(self, rows):
+        if len(rows) == 0:
+            return 0
+        self._arrays["alive"][rows] = 0
+        self._arrays["alive"].flush()
+        self._db.executemany('DELETE FROM chunks WHERE row = ?', [(int(row),) for row in rows])
+        return len(rows)
+
+    def _delete_ids(self, ids):
+        rows = [row for (row,) in self._select_rows_by_ids(ids)]
+        return self._delete_rows(np.array(rows, dtype=np.int64))
+
+    def _select_rows_by_ids(self, ids):
+        result = []
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            result.extend(self._db.execute(f'SELECT row FROM chunks WHERE id IN ({placeholders})', batch).fetchall())
+        return result
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, **kwargs: Any) -> int:
+        with self._lock:
+            if ids:
+                deleted = self._delete_ids(list(ids))
+            elif where:
+                deleted = self._delete_rows(self._matching_rows(where))
+            else:
+                deleted = 0
+            self._db.commit()
+            return deleted
+
+    # --- фильтры ---
+
+    def _where_mask(self, where, size):
+        if not where:
+            return None
+        if "$and" in where:
+            masks = [self._where_mask(clause, size) for clause in where["$and"]]
+            return np.logical_and.reduce(masks)
+        if "$or" in where:
+            masks = [self._where_mask(clause, size) for clause in where["$or"]]
+            return np.logical_or.reduce(masks)
+        if len(where) != 1:
+            return self._where_mask({"$and": [{field: condition} for field, condition in where.items()]}, size)
+
+        field, condition = next(iter(where.items()))
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"NumpyVectorStore can only filter by {', '.join(FILTER_FIELDS)}, got {field}")
+        if isinstance(condition, dict):
+            operator, operand = next(iter(condition.items()))
+            if operator == "$in":
+                values = operand
+            elif operator == "$eq":
+                values = [operand]
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+        else:
+            values = [condition]
+        codes = [self._codes[field][_value_key(v)] for v in values if _value_key(v) in self._codes[field]]
+        return np.isin(self._arrays[FILTER_FIELDS[field]][:size], codes)
+
+    def _matching_rows(self, where):
+        if self.dim is None:
+            return np.array([], dtype=np.int64)
+        valid = self._arrays["alive"][:self.size] == 1
+        mask = self._where_mask(where, self.size)
+        if mask is not None:
+            valid &= mask
+        return np.flatnonzero(valid)
+
+    # --- IVF ---
+
+    def _load_ivf(self):
+        path = os.path.join(self.persist_directory, "ivf_centroids.npy")
+        if os.path.exists(path):
+            self._centroids = np.load(path)
+            self._ivf_rows = self._group_lists(np.asarray(self._arrays["ivf_lists"][:self.size]), len(self._centroids))
+            self._ivf_trained_size = int(self._db.execute(
+                "SELECT value FROM store_info WHERE key = 'ivf_trained_size'").fetchone()[0])
+
+    @staticmethod
+    def _group_lists(lists, nlist): # номер списка для каждой строки -> строки каждого списка
+        order = np.argsort(lists, kind="stable")
+        bounds = np.searchsorted(lists[order], np.arange(nlist + 1))
+        return [[order[bounds[i]:bounds[i + 1]]] for i in range(nlist)]
+
+    def _assign_to_lists(self, rows, vectors):
+        lists = np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+        self._arrays["ivf_lists"][rows] = lists
+        for list_number in np.unique(lists):
+            self._ivf_rows[list_number].append(rows[lists == list_number])
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10, sample_size: int = 100000, seed: int = 0):
+        """Train k-means centroids on a sample and assign every stored vector to its nearest list.
+
+        Training and assignment read a snapshot of the rows outside the store lock; only the swap to the new
+        lists holds it, so searches and writes keep using the previous lists meanwhile.
+        """
+        with self._ivf_lock:
+            # Строки только дописываются в конец, поэтому первые size строк можно читать без блокировки
+            with self._lock:
+                size = self.size
+                alive_rows = np.flatnonzero(self._arrays["alive"][:size] == 1)
+                arrays = dict(self._arrays)
+            if len(alive_rows) == 0:
+                return
+            nlist = nlist or max(1, int(np.sqrt(len(alive_rows))))
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(alive_rows, min(sample_size, len(alive_rows)), replace=False))
+            sample_vectors = _normalize(self._read_vectors(sample, arrays))
+            centroids = sample_vectors[rng.choice(len(sample_vectors), min(nlist, len(sample_vectors)), replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample_vectors @ centroids.T, axis=1)
+                for i in range(len(centroids)):
+                    members = sample_vectors[assignment == i]
+                    if len(members):
+                        centroids[i] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            lists = np.empty(size, dtype=np.int32)
+            for start in range(0, size, SEARCH_BLOCK_ROWS):
+                stop = min(size, start + SEARCH_BLOCK_ROWS)
+                lists[start:stop] = np.argmax(_normalize(self._read_vectors(slice(start, stop), arrays)) @ centroids.T, axis=1)
+
+            with self._lock:
+                self._centroids = centroids
+                self._arrays["ivf_lists"][:size] = lists
+                self._ivf_rows = self._group_lists(lists, len(centroids))
+                # Строки, дописанные во время обучения, распределяются уже по новым спискам
+                if self.size > size:
+                    self._assign_to_lists(np.arange(size, self.size), _normalize(self._read_vectors(slice(size, self.size))))
+                self._flush()
+                np.save(os.path.join(self.persist_directory, "ivf_centroids.npy"), centroids)
+                self._ivf_trained_size = len(alive_rows)
+                self._db.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('ivf_trained_size', ?)", (str(len(alive_rows)),))
+                self._db.commit()
+
+    def _list_rows(self, list_number): # строки, добавленные после обучения, лежат отдельными кусками до первого поиска
+        pieces = self._ivf_rows[list_number]
+        if len(pieces) != 1:
+            self._ivf_rows[list_number] = pieces = [np.concatenate(pieces) if pieces else np.array([], dtype=np.int64)]
+        return pieces[0]
+
+    def _schedule_ivf(self): # вызывается под self._lock
+        # Центроиды переобучаются, когда хранилище выросло в 4 раза с момента обучения
+        if self.size < self.ivf_min_rows or self._ivf_training:
+            return
+        if self._centroids is None or self.size > 4 * self._ivf_trained_size:
+            self._ivf_training = True
+            threading.Thread(target=self._train_ivf, name="ivf-train", daemon=True).start()
+
+    def _train_ivf(self): # фоновый поток
+        try:
+            self.build_ivf()
+        except Exception as e:
+            print(f"IVF training failed: {e}")
+        finally:
+            with self._lock:
+                self._ivf_training = False
+
+    # --- поиск ---
+
+    def _merge_top_k(self, best_scores, best_rows, scores, rows, k):
+        if scores.shape[1] > k:
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, part, axis=1)
+            rows = np.take_along_axis(rows, part, axis=1)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+        if scores.shape[1] > k:
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, part, axis=1)
+            rows = np.take_along_axis(rows, part, axis=1)
+        return scores, rows
+
+    def _search(self, queries, k, where=None): # queries: (m, dim) нормированные; -> [[(row, cos)]] для каждого запроса
+        with self._lock:
+            if self.dim is None or self.size == 0:
+                return [[] for _ in queries]
+            self._schedule_ivf()
+            use_ivf = self.size >= self.ivf_min_rows and self._centroids is not None
+            size = self.size
+            valid = self._arrays["alive"][:size] == 1
+            mask = self._where_mask(where, size)
+            if mask is not None:
+                valid &= mask
+            ivf_rows = [self._list_rows(i) for i in range(len(self._ivf_rows))] if use_ivf else None
+            centroids = self._centroids
+            arrays = dict(self._arrays)
+
+        results = []
+        if use_ivf:
+            probes = np.argsort(-(queries @ centroids.T), axis=1)[:, :self.nprobe]
+            for query, query_probes in zip(queries, probes):
+                rows = np.concatenate([ivf_rows[i] for i in query_probes])
+                rows = np.sort(rows[valid[rows]])
+                if len(rows) == 0:
+                    results.append([])
+                    continue
+                scores = self._scores(rows, query[None, :], arrays)[0]
+                top = np.argsort(-scores)[:k]
+                results.append([(int(rows[i]), float(scores[i])) for i in top])
+            return results
+
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, size, SEARCH_BLOCK_ROWS):
+            stop = min(size, start + SEARCH_BLOCK_ROWS)
+            block_valid = valid[start:stop]
+            if not block_valid.any():
+                continue
+            # Скоры считаются по всему блоку без копирования; удалённые и отфильтрованные строки просто отбрасываются
+            scores = self._scores(slice(start, stop), queries, arrays)
+            scores[:, ~block_valid] = -np.inf
+            rows = np.broadcast_to(np.arange(start, stop), scores.shape)
+            best_scores, best_rows = self._merge_top_k(best_scores, best_rows, scores, rows, k)
+
+        for scores, rows in zip(best_scores, best_rows):
+            order = [i for i in np.argsort(-scores) if np.isfinite(scores[i])]
+            results.append([(int(rows[i]), float(scores[i])) for i in order])
+        return results
+
+    def _documents_for_rows(self, rows):
+        with self._lock:
+            found = {}
+            for i in range(0, len(rows), 500):
+                batch = [int(row) for row in rows[i:i + 500]]
+                placeholders = ",".join("?" * len(batch))
+                for row, chunk_id, text, metadata in self._db.execute(
+                        f'SELECT row, id, text, metadata FROM chunks WHERE row IN ({placeholders})', batch):
+                    found[row] = Document(page_content=text, metadata=json.loads(metadata), id=chunk_id)
+        return found
+
+    def batch_similarity_search_by_vector(self, embeddings: List[List[float]], k: int = 4,
+                                          filter: Optional[dict] = None) -> List[List[Tuple[Document, float]]]:
+        """Top-k for many query vectors at once: one matrix product per block of stored vectors."""
+        hits = self._search(_normalize(embeddings), k, filter)
+        documents = self._documents_for_rows(sorted({row for query_hits in hits for row, _ in query_hits}))
+        return [[(documents[row], 2.0 - 2.0 * score) for row, score in query_hits if row in documents] for query_hits in hits]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4,
+                                                          filter: Optional[dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.batch_similarity_search_by_vector([embedding], k, filter)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    # --- чтение ---
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Optional[List[str]] = None, **kwargs: Any) -> dict:
+        """Chroma-compatible get: {"ids", "documents", "metadatas"} in insertion order."""
+        include = include if include is not None else ["metadatas", "documents"]
+        with self._lock:
+            if ids is not None:
+                rows = sorted(row for (row,) in self._select_rows_by_ids(list(ids)))
+                if where:
+                    matching = set(self._matching_rows(where).tolist())
+                    rows = [row for row in rows if row in matching]
+            else:
+                rows = self._matching_rows(where).tolist()
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+
+            result = {"ids": [], "documents": [] if "documents" in include else None,
+                      "metadatas": [] if "metadatas" in include else None}
+            for i in range(0, len(rows), 500):
+                batch = rows[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                for _, chunk_id, text, metadata in self._db.execute(
+                        f'SELECT row, id, text, metadata FROM chunks WHERE row IN ({placeholders}) ORDER BY row', batch):
+                    result["ids"].append(chunk_id)
+                    if result["documents"] is not None:
+                        result["documents"].append(text)
+                    if result["metadatas"] is not None:
+                        result["metadatas"].append(json.loads(metadata))
+            return result
+
+    def get_by_ids(self, ids, /) -> List[Document]:
+        page = self.get(ids=list(ids))
+        return [Document(page_content=text, metadata=metadata, id=chunk_id)
+                for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"])]
+
+    def count(self, where: Optional[dict] = None) -> int:
+        with self._lock:
+            return len(self._matching_rows(where))
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = NUMPY_STORE_DIR, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
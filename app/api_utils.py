@@ -1,7 +1,8 @@
+import json
 import requests
 import streamlit as st
 
-def get_api_response(question, session_id, model):
+def get_api_response(question, session_id, model, on_token=None):
     headers = {
         'accept': 'application/json',
         'Content-Type': 'application/json'
@@ -13,6 +14,9 @@ def get_api_response(question, session_id, model):
     if session_id:
         data["session_id"] = session_id
 
+    if on_token is not None:
+        return get_api_response_stream(data, headers, on_token)
+
     try:
         response = requests.post("http://localhost:8000/chat", headers=headers, json=data)
         if response.status_code == 200:
@@ -24,6 +28,44 @@ def get_api_response(question, session_id, model):
         st.error(f"An error occurred: {str(e)}")
         return None
 
+def get_api_response_stream(data, headers, on_token): # Читает NDJSON-поток /chat/stream и передаёт токены в on_token
+    answer_parts = []
+    sources = []
+    result = None
+
+    try:
+        with requests.post("http://localhost:8000/chat/stream", headers=headers, json=data, stream=True) as response:
+            if response.status_code != 200:
+                st.error(f"API request failed with status code {response.status_code}: {response.text}")
+                return None
+
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                event_type = event.get("type")
+
+                if event_type == "sources":
+                    sources = event.get("sources", [])
+                elif event_type == "token":
+                    answer_parts.append(event["content"])
+                    on_token(event["content"])
+                elif event_type == "error":
+                    st.error(f"An error occurred while generating the answer: {event.get('detail')}")
+                    return None
+                elif event_type == "done":
+                    result = {
+                        "answer": "".join(answer_parts),
+                        "session_id": event.get("session_id"),
+                        "model": event.get("model"),
+                        "sources": sources,
+                        "token_usage": event.get("token_usage")
+                    }
+        return result
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+        return None
+
 def list_documents():
     try:
         response = requests.get("http://localhost:8000/list-docs")
@@ -17,8 +17,16 @@ def display_chat_interface():
         with st.chat_message("user", avatar="👤"):
             st.markdown(prompt)
 
-        with st.spinner("Поиск ответа..."):
-            response = get_api_response(prompt, st.session_state.session_id, st.session_state.model)
+        with st.chat_message("assistant", avatar="💬"):
+            answer_placeholder = st.empty()
+            answer_placeholder.markdown("Поиск ответа...")
+            streamed_tokens = []
+
+            def render_token(token):
+                streamed_tokens.append(token)
+                answer_placeholder.markdown("".join(streamed_tokens) + "▌")
+
+            response = get_api_response(prompt, st.session_state.session_id, st.session_state.model, on_token=render_token)
             
             if response:
                 st.session_state.session_id = response.get('session_id')
@@ -28,15 +36,17 @@ def display_chat_interface():
                     "avatar": "💬"
                 })
                 
-                with st.chat_message("assistant", avatar="💬"):
-                    st.markdown(response['answer'])
+                answer_placeholder.markdown(response['answer'])
                     
-                    with st.expander("Details"):
-                        st.subheader("Generated Answer")
-                        st.code(response['answer'])
-                        st.subheader("Model Used")
-                        st.code(response['model'])
-                        st.subheader("Session ID")
-                        st.code(response['session_id'])
+                with st.expander("Details"):
+                    st.subheader("Generated Answer")
+                    st.code(response['answer'])
+                    st.subheader("Sources")
+                    st.code("\n".join(sorted({str(source.get('source')) for source in response.get('sources', [])})))
+                    st.subheader("Model Used")
+                    st.code(response['model'])
+                    st.subheader("Session ID")
+                    st.code(response['session_id'])
             else:
-                st.error("Failed to get a response from the API. Please try again.")
\ No newline at end of file
+                answer_placeholder.empty()
+                st.error("Failed to get a response from the API. Please try again.")
@@ -71,7 +71,8 @@ def track_sync_status(task_id): # Отслеживает статус синхр
         status_response = get_sync_status(task_id)
         if status_response:
             status = status_response.get('status', 'unknown')
-            status_placeholder.info(f"Статус синхронизации: {status}")
+            progress = status_response.get('progress') or 0
+            status_placeholder.info(f"Статус синхронизации: {status} ({progress:.0%})")
             
             if "completed" in status or "failed" in status:
                 break
@@ -82,8 +83,8 @@ def track_sync_status(task_id): # Отслеживает статус синхр
     if status_response:
         final_status = status_response.get('status', 'unknown')
         if "completed" in final_status:
-            status_placeholder.success(f"Синхронизация завершена! {final_status}")
+            status_placeholder.success(f"Синхронизация завершена! {status_response.get('detail') or final_status}")
         elif "failed" in final_status:
-            status_placeholder.error(f"Синхронизация завершилась с ошибкой: {final_status}")
+            status_placeholder.error(f"Синхронизация завершилась с ошибкой: {status_response.get('error') or final_status}")
         else:
             status_placeholder.warning(f"Статус: {final_status}")
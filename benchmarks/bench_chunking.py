@@ -0,0 +1,88 @@
+"""Character versus token-window chunking: chunk count, word-pieces lost to the model's truncation and embed throughput.
+
+Runs on synthetic Latin and Cyrillic text (or on --files) with the real all-MiniLM-L6-v2 tokenizer and model:
+
+    python benchmarks/bench_chunking.py --output chunking.json
+    python benchmarks/bench_chunking.py --files docs/a.pdf docs/b.docx --skip-embed
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "api"))
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import sentence, LATIN_WORDS, CYRILLIC_WORDS
+from langchain_core.documents import Document
+from loader_utils import EMBEDDING_MODEL_NAME, create_text_splitter, get_loader, split_tokenizer
+
+MODEL_WINDOW = 254  # 256 минус [CLS] и [SEP]
+
+def synthetic_pages(words, pages, seed):
+    rng = np.random.default_rng(seed)
+    return [Document(page_content="\n\n".join(" ".join(sentence(rng, words) for _ in range(6)) for _ in range(5)))
+            for _ in range(pages)]
+
+def measure(mode, pages, model):
+    splitter = create_text_splitter(mode)
+    start = time.perf_counter()
+    chunks = [doc.page_content for doc in splitter.split_documents(pages)]
+    split_seconds = time.perf_counter() - start
+
+    tokenizer = split_tokenizer.get()
+    lengths = np.array([len(encoding.ids) for encoding in tokenizer.encode_batch(chunks, add_special_tokens=False)])
+    result = {
+        "mode": mode,
+        "chunks": len(chunks),
+        "avg_chars": float(np.mean([len(chunk) for chunk in chunks])),
+        "avg_word_pieces": float(lengths.mean()),
+        "truncated_chunks": float(np.mean(lengths > MODEL_WINDOW)),
+        "discarded_word_pieces": float(np.maximum(lengths - MODEL_WINDOW, 0).sum() / lengths.sum()),
+        "split_seconds": split_seconds
+    }
+    if model is not None:
+        start = time.perf_counter()
+        model.encode(chunks, batch_size=64)
+        embed_seconds = time.perf_counter() - start
+        result.update({
+            "embed_seconds": embed_seconds,
+            "chunks_per_second": len(chunks) / embed_seconds,
+            # Word-piece, которые действительно дошли до модели (без обрезанных), в секунду
+            "embedded_word_pieces_per_second": float(np.minimum(lengths, MODEL_WINDOW).sum() / embed_seconds)
+        })
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--files", nargs="*")
+    parser.add_argument("--skip-embed", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if args.files:
+        corpora = {"files": [page for path in args.files for page in get_loader(path).lazy_load()]}
+    else:
+        corpora = {"latin": synthetic_pages(LATIN_WORDS, args.pages, 1), "cyrillic": synthetic_pages(CYRILLIC_WORDS, args.pages, 2)}
+
+    model = None
+    if not args.skip_embed:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        model.encode(["warmup"])
+
+    result = {"benchmark": "chunking", "model": EMBEDDING_MODEL_NAME, "corpora": {}}
+    for name, pages in corpora.items():
+        result["corpora"][name] = [measure(mode, pages, model) for mode in ("chars", "tokens")]
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
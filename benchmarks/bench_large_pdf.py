@@ -0,0 +1,110 @@
+"""Peak RSS and wall time of indexing one large PDF: whole-document load versus streaming page-by-page ingest.
+
+Each mode runs in its own process (ru_maxrss is per process) with a fresh store in a temporary directory:
+
+    python benchmarks/bench_large_pdf.py --pages 2000 --output large_pdf.json
+    python benchmarks/bench_large_pdf.py --pages 2000 --embeddings model --vector-store numpy
+
+--embeddings hash (default) replaces the embedding model with a deterministic hash so that the numbers
+show the loader, splitter and store rather than the model's own memory, which is the same in both modes.
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "api"))
+sys.path.insert(0, BENCH_DIR)
+
+from langchain_core.embeddings import Embeddings
+from corpus import write_pdf
+
+DIM = 384
+LOAD_WRITE_BATCH = 5000
+
+class HashEmbeddings(Embeddings):
+    """Unit vectors seeded by the text hash: stable across runs, no model in memory."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).normal(size=DIM)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_mode(mode, pdf_path, embeddings):
+    import chroma_utils
+    from loader_utils import get_loader, text_splitter, iter_batches
+    if embeddings == "hash":
+        chroma_utils.cached_embedding_function._underlying = HashEmbeddings()
+    chroma_utils.get_vectorstore()
+    baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    if mode == "load":
+        # Прежний путь: весь документ и все чанки в памяти. Прежний единственный add_chunks на 2000 страницах падает
+        # (Chroma принимает не больше 5461 записи за раз), поэтому готовый список пишется кусками по LOAD_WRITE_BATCH
+        splits = text_splitter.split_documents(get_loader(pdf_path).load())
+        for split in splits:
+            split.metadata['file_id'] = 1
+            split.metadata['source'] = os.path.basename(pdf_path)
+        for batch in iter_batches(splits, LOAD_WRITE_BATCH):
+            chroma_utils.add_chunks(batch)
+        chunks = len(splits)
+    else:
+        chunks = chroma_utils.stream_document_to_chroma(pdf_path, 1, os.path.basename(pdf_path))
+    seconds = time.perf_counter() - start
+    return {"mode": mode, "chunks": chunks, "seconds": seconds,
+            "baseline_rss_mb": baseline, "peak_rss_mb": peak_rss_mb(), "delta_rss_mb": peak_rss_mb() - baseline}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--modes", default="load,stream")
+    parser.add_argument("--embeddings", choices=("hash", "model"), default="hash")
+    parser.add_argument("--vector-store", default=os.getenv("VECTOR_STORE", "chroma"))
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.pdf, args.embeddings)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="rag_large_pdf_")
+    try:
+        pdf_path = os.path.join(workdir, f"large_{args.pages}.pdf")
+        write_pdf(pdf_path, args.pages, np.random.default_rng(0))
+        result = {"benchmark": "large_pdf", "pages": args.pages, "pdf_mb": os.path.getsize(pdf_path) / 2 ** 20,
+                  "embeddings": args.embeddings, "vector_store": args.vector_store, "runs": []}
+        for mode in args.modes.split(","):
+            mode_dir = os.path.join(workdir, mode)
+            os.makedirs(mode_dir)
+            env = dict(os.environ, VECTOR_STORE=args.vector_store, WARMUP_RESOURCES="0")
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-mode", mode, "--pdf", pdf_path,
+                                     "--embeddings", args.embeddings], cwd=mode_dir, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            result["runs"].append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
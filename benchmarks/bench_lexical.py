@@ -0,0 +1,95 @@
+"""Latency of the BM25 index and the fused hybrid ranking on a synthetic corpus.
+
+    python benchmarks/bench_lexical.py --chunks 1000000 --output lexical.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from langchain_core.documents import Document
+from lexical_utils import LexicalIndex, reciprocal_rank_fusion
+
+SYLLABLES = ["ка", "ро", "ми", "на", "ст", "ол", "ве", "ри", "do", "ta", "ne", "ly", "pro", "ser", "ion", "ment"]
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES, rng.integers(2, 5))))
+    words = sorted(words)
+    codes = [f"{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}-{i:05d}" for i in range(size // 10)]
+    return words, codes
+
+def percentile(values, q):
+    return float(np.percentile(values, q) * 1000)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1_000_000)
+    parser.add_argument("--chunk-tokens", type=int, default=150)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    words, codes = make_vocabulary(args.vocabulary, rng)
+    # Частоты слов по закону Ципфа, как в естественном тексте
+    weights = 1.0 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+
+    index = LexicalIndex()
+    index.load(lambda offset, limit: ([], [], []))
+
+    build_seconds = 0.0
+    for batch_start in range(0, args.chunks, 10_000):
+        numbers = range(batch_start, min(args.chunks, batch_start + 10_000))
+        token_ids = rng.choice(len(words), size=(len(numbers), args.chunk_tokens), p=weights)
+        batch_ids = [f"chunk-{number}" for number in numbers]
+        batch_docs = [
+            Document(page_content=" ".join([words[i] for i in row] + [codes[number % len(codes)]]), metadata={"file_id": number // 50})
+            for number, row in zip(numbers, token_ids.tolist())
+        ]
+        start = time.perf_counter()
+        index.add_documents(batch_ids, batch_docs)
+        build_seconds += time.perf_counter() - start
+
+    queries = []
+    for _ in range(args.queries):
+        query_words = [words[i] for i in rng.choice(len(words), rng.integers(2, 6), p=weights)]
+        if rng.random() < 0.5:
+            query_words.append(codes[rng.integers(len(codes))])
+        queries.append(" ".join(query_words))
+
+    lexical_latencies, fused_latencies = [], []
+    for query in queries:
+        vector_ids = [f"chunk-{i}" for i in rng.integers(args.chunks, size=args.k)]
+        start = time.perf_counter()
+        hits = index.search(query, k=args.k)
+        lexical_latencies.append(time.perf_counter() - start)
+        reciprocal_rank_fusion([vector_ids, [chunk_id for chunk_id, _ in hits]])[:args.k]
+        fused_latencies.append(time.perf_counter() - start)
+
+    result = {
+        "benchmark": "lexical",
+        "chunks": args.chunks,
+        "chunk_tokens": args.chunk_tokens,
+        "queries": args.queries,
+        "index": index.stats(),
+        "build_seconds": build_seconds,
+        "build_chunks_per_second": args.chunks / build_seconds,
+        "lexical_ms": {"p50": percentile(lexical_latencies, 50), "p95": percentile(lexical_latencies, 95), "p99": percentile(lexical_latencies, 99)},
+        "fused_ms": {"p50": percentile(fused_latencies, 50), "p95": percentile(fused_latencies, 95), "p99": percentile(fused_latencies, 99)}
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Load time, query latency and recall of the vector store backends on a synthetic clustered corpus.
+
+One backend per run, so that memory use of one does not affect the other:
+
+    python benchmarks/bench_vectorstore.py --backend chroma --chunks 100000 --output chroma_100k.json
+    python benchmarks/bench_vectorstore.py --backend numpy --dtype int8 --chunks 1000000 --output numpy_int8_1m.json
+    python benchmarks/bench_vectorstore.py --backend numpy --ivf --chunks 1000000 --output numpy_ivf_1m.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from langchain_core.embeddings import Embeddings
+from vectorstore_utils import NumpyVectorStore
+
+DIM = 384
+BATCH = 5000
+CLUSTERS = 2000
+
+class BatchEmbeddings(Embeddings):
+    """Returns precomputed vectors: the benchmark sets `batch` before every add_texts call."""
+
+    def __init__(self):
+        self.batch = None
+        self.query = None
+
+    def embed_documents(self, texts):
+        return self.batch.tolist()
+
+    def embed_query(self, text):
+        return self.query.tolist()
+
+def corpus_batch(start, stop, centers):
+    rng = np.random.default_rng(start)
+    assignment = rng.integers(len(centers), size=stop - start)
+    vectors = centers[assignment] + rng.normal(scale=0.35, size=(stop - start, DIM)).astype(np.float32) / np.sqrt(DIM) * 3
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_queries(count, chunks, centers):
+    rng = np.random.default_rng(12345)
+    rows = rng.integers(chunks, size=count)
+    queries = []
+    for row in rows:
+        base = corpus_batch(row // BATCH * BATCH, min(chunks, row // BATCH * BATCH + BATCH), centers)[row % BATCH]
+        query = base + rng.normal(scale=0.02, size=DIM)
+        queries.append(query / np.linalg.norm(query))
+    return np.array(queries, dtype=np.float32)
+
+def exact_top_k(queries, chunks, centers, k):
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, chunks, BATCH):
+        vectors = corpus_batch(start, min(chunks, start + BATCH), centers).astype(np.float32)
+        scores = np.concatenate([best_scores, queries @ vectors.T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(vectors)), (len(queries), len(vectors)))], axis=1)
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores, best_rows = np.take_along_axis(scores, part, axis=1), np.take_along_axis(rows, part, axis=1)
+    return [set(f"c{row}" for row in rows) for rows in best_rows]
+
+def open_store(args, directory, embeddings):
+    if args.backend == "chroma":
+        from langchain_chroma import Chroma
+        return Chroma(persist_directory=directory, embedding_function=embeddings)
+    return NumpyVectorStore(directory, embeddings, dtype=args.dtype,
+                            ivf_min_rows=0 if args.ivf else 10 ** 12, nprobe=args.nprobe)
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+def latency_summary(latencies):
+    return {q: float(np.percentile(latencies, int(q[1:])) * 1000) for q in ("p50", "p95", "p99")}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["chroma", "numpy"], required=True)
+    parser.add_argument("--dtype", choices=["float32", "int8"], default="float32")
+    parser.add_argument("--ivf", action="store_true")
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    centers = np.random.default_rng(0).normal(size=(CLUSTERS, DIM)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    directory = tempfile.mkdtemp(prefix=f"bench_{args.backend}_")
+    embeddings = BatchEmbeddings()
+
+    try:
+        store = open_store(args, directory, embeddings)
+        start = time.perf_counter()
+        for batch_start in range(0, args.chunks, BATCH):
+            batch_stop = min(args.chunks, batch_start + BATCH)
+            embeddings.batch = corpus_batch(batch_start, batch_stop, centers)
+            store.add_texts([f"chunk {row}" for row in range(batch_start, batch_stop)],
+                            metadatas=[{"file_id": row // 100, "source": f"doc{row // 100}.pdf"} for row in range(batch_start, batch_stop)],
+                            ids=[f"c{row}" for row in range(batch_start, batch_stop)])
+        insert_seconds = time.perf_counter() - start
+        ivf_build_seconds = None
+        if args.backend == "numpy" and args.ivf:
+            start = time.perf_counter()
+            store.build_ivf()
+            ivf_build_seconds = time.perf_counter() - start
+        del store
+
+        queries = make_queries(args.queries, args.chunks, centers)
+        expected = exact_top_k(queries, args.chunks, centers, args.k)
+
+        # Загрузка: новый объект над сохранёнными данными плюс первый запрос
+        start = time.perf_counter()
+        store = open_store(args, directory, embeddings)
+        open_seconds = time.perf_counter() - start
+        store.similarity_search_by_vector(queries[0].tolist(), k=args.k)
+        load_seconds = time.perf_counter() - start
+
+        latencies, recalls = [], []
+        for query, truth in zip(queries, expected):
+            start = time.perf_counter()
+            docs = store.similarity_search_by_vector(query.tolist(), k=args.k)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len({doc.id for doc in docs} & truth) / args.k)
+
+        file_filter = {"file_id": {"$in": list(range(0, args.chunks // 100, 7))}}
+        filtered_latencies = []
+        for query in queries[:50]:
+            start = time.perf_counter()
+            store.similarity_search_by_vector(query.tolist(), k=args.k, filter=file_filter)
+            filtered_latencies.append(time.perf_counter() - start)
+
+        batch_seconds = None
+        if args.backend == "numpy":
+            start = time.perf_counter()
+            store.batch_similarity_search_by_vector(queries.tolist(), k=args.k)
+            batch_seconds = time.perf_counter() - start
+
+        result = {
+            "benchmark": "vectorstore",
+            "backend": args.backend,
+            "dtype": args.dtype if args.backend == "numpy" else None,
+            "index": ("ivf" if args.ivf else "flat") if args.backend == "numpy" else "hnsw",
+            "chunks": args.chunks,
+            "queries": args.queries,
+            "k": args.k,
+            "insert_seconds": insert_seconds,
+            "ivf_build_seconds": ivf_build_seconds,
+            "open_seconds": open_seconds,
+            "load_seconds": load_seconds,
+            "query_ms": latency_summary(latencies),
+            "filtered_query_ms": latency_summary(filtered_latencies),
+            "batch_query_ms_per_question": batch_seconds / args.queries * 1000 if batch_seconds is not None else None,
+            "recall_at_k": float(np.mean(recalls)),
+            "disk_mb": directory_size(directory) / 2 ** 20
+        }
+        print(json.dumps(result, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Synthetic PDF/DOCX documents for ingest and retrieval benchmarks, written without third-party libraries."""
+import os
+import zipfile
+import numpy as np
+
+LATIN_WORDS = (
+    "policy vacation request approval manager invoice contract supplier delivery warehouse shipment "
+    "payment salary bonus training onboarding laptop access password server backup incident report "
+    "quarter budget forecast customer support ticket escalation warranty return refund product price "
+    "discount region office schedule meeting deadline project milestone release feature defect"
+).split()
+CYRILLIC_WORDS = (
+    "отпуск заявка согласование руководитель счёт договор поставщик доставка склад отгрузка оплата "
+    "зарплата премия обучение ноутбук доступ пароль сервер резервная копия инцидент отчёт квартал бюджет "
+    "прогноз клиент поддержка гарантия возврат товар цена скидка регион офис график совещание срок проект"
+).split()
+
+def product_code(rng):
+    return f"{chr(65 + rng.integers(26))}{chr(65 + rng.integers(26))}-{rng.integers(100, 1000)}"
+
+def sentence(rng, words, length=None):
+    length = length or int(rng.integers(8, 20))
+    tokens = [words[i] for i in rng.integers(len(words), size=length)]
+    if rng.random() < 0.3:
+        tokens[int(rng.integers(length))] = product_code(rng)
+    return " ".join(tokens).capitalize() + "."
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path, pages, rng, lines_per_page=40):
+    """Minimal PDF with one Helvetica text stream per page (Latin text: base fonts have no Cyrillic)."""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    page_ids = []
+    for page in range(pages):
+        lines = [sentence(rng, LATIN_WORDS, 10) for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        content_id, page_id = 4 + 2 * page, 5 + 2 * page
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream.encode("latin-1"))
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(page_id)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{i} 0 R" for i in page_ids).encode(), len(page_ids))
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for number in sorted(objects):
+            offsets[number] = f.tell()
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, objects[number]))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for number in sorted(objects):
+            f.write(b"%010d 00000 n \n" % offsets[number])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+def _xml_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def write_docx(path, paragraphs, rng):
+    """Minimal DOCX (document.xml only) with mixed Russian and English paragraphs."""
+    body = "".join(
+        f"<w:p><w:r><w:t>{_xml_escape(' '.join(sentence(rng, CYRILLIC_WORDS if rng.random() < 0.6 else LATIN_WORDS) for _ in range(4)))}</w:t></w:r></w:p>"
+        for _ in range(paragraphs)
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml",
+                         '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        archive.writestr("_rels/.rels",
+                         '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/></Relationships>')
+        archive.writestr("word/document.xml",
+                         '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                         f"<w:body>{body}</w:body></w:document>")
+
+def generate_corpus(directory, documents, seed=0, pdf_pages=(2, 12), docx_paragraphs=(10, 60)):
+    """Writes `documents` files alternating PDF and DOCX; returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for number in range(documents):
+        if number % 2 == 0:
+            path = os.path.join(directory, f"report_{number:05d}.pdf")
+            write_pdf(path, int(rng.integers(*pdf_pages)), rng)
+        else:
+            path = os.path.join(directory, f"memo_{number:05d}.docx")
+            write_docx(path, int(rng.integers(*docx_paragraphs)), rng)
+        paths.append(path)
+    return paths
+
+def generate_questions(count, seed=1):
+    rng = np.random.default_rng(seed)
+    return [f"What does the {' '.join(LATIN_WORDS[i] for i in rng.integers(len(LATIN_WORDS), size=3))} policy say about {product_code(rng)}?"
+            if rng.random() < 0.5 else
+            f"Что сказано про {' '.join(CYRILLIC_WORDS[i] for i in rng.integers(len(CYRILLIC_WORDS), size=3))}?"
+            for _ in range(count)]
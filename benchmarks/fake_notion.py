@@ -0,0 +1,188 @@
+"""Stand-in for the Notion API serving a synthetic workspace: search, block children, database queries and file downloads.
+
+    python benchmarks/fake_notion.py --port 8765 --pages 50 --databases 2 --rows 20
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+from corpus import CYRILLIC_WORDS, LATIN_WORDS, generate_corpus, sentence
+
+PAGE_SIZE = 100
+EDITED_AT = "2026-01-01T00:00:00.000Z"
+
+def rich_text(text):
+    return [{"type": "text", "text": {"content": text}, "plain_text": text}]
+
+def title_property(text):
+    return {"id": "title", "type": "title", "title": rich_text(text)}
+
+class Workspace:
+    """Deterministic synthetic workspace: top-level pages and databases with row pages, block trees and attachments."""
+
+    def __init__(self, base_url, pages=50, databases=2, rows=20, blocks=30, nested_fraction=0.2,
+                 attachment_fraction=0.2, seed=0):
+        rng = np.random.default_rng(seed)
+        self.base_url = base_url
+        self.objects = []  # результаты search
+        self.children = {}  # block_id -> дочерние блоки
+        self.database_rows = {}
+        self.files = {}  # имя -> путь к файлу
+
+        attachment_pages = int(round((pages + databases * rows) * attachment_fraction))
+        self.files_dir = tempfile.mkdtemp(prefix="fake_notion_files_")
+        for path in generate_corpus(self.files_dir, attachment_pages, seed=seed + 1, pdf_pages=(1, 4), docx_paragraphs=(5, 20)):
+            self.files[os.path.basename(path)] = path
+        file_names = iter(sorted(self.files))
+
+        def make_page(title, properties=None):
+            page_id = str(uuid.UUID(int=int(rng.integers(2 ** 63)) << 64 | len(self.children)))
+            self.children[page_id] = self._make_blocks(page_id, blocks, nested_fraction, rng)
+            file_name = next(file_names, None) if rng.random() < attachment_fraction else None
+            if file_name:
+                self.children[page_id].append({
+                    "object": "block", "id": str(uuid.uuid4()), "type": "file", "has_children": False,
+                    "file": {"type": "file", "name": file_name, "file": {"url": f"{self.base_url}/files/{file_name}"}}
+                })
+            return {"object": "page", "id": page_id, "last_edited_time": EDITED_AT,
+                    "properties": properties or {"title": title_property(title)}}
+
+        for number in range(pages):
+            self.objects.append(make_page(f"Page {number} {sentence(rng, LATIN_WORDS, 3)}"))
+        for number in range(databases):
+            database_id = str(uuid.uuid4())
+            self.objects.append({"object": "database", "id": database_id, "last_edited_time": EDITED_AT,
+                                 "title": rich_text(f"Database {number}")})
+            self.database_rows[database_id] = [
+                make_page(None, {"Name": title_property(f"Row {number}-{row} {sentence(rng, CYRILLIC_WORDS, 3)}")})
+                for row in range(rows)
+            ]
+
+    def _make_blocks(self, parent_id, count, nested_fraction, rng, depth=0):
+        blocks = []
+        for _ in range(count):
+            block_type = ["paragraph", "heading_2", "bulleted_list_item", "quote"][int(rng.integers(4))]
+            words = CYRILLIC_WORDS if rng.random() < 0.5 else LATIN_WORDS
+            block = {"object": "block", "id": str(uuid.uuid4()), "type": block_type,
+                     block_type: {"rich_text": rich_text(" ".join(sentence(rng, words) for _ in range(3)))},
+                     "has_children": depth < 2 and rng.random() < nested_fraction}
+            if block["has_children"]:
+                self.children[block["id"]] = self._make_blocks(block["id"], 3, nested_fraction, rng, depth + 1)
+            blocks.append(block)
+        return blocks
+
+def paginate(items, cursor, page_size):
+    start = int(cursor or 0)
+    page_size = min(int(page_size or PAGE_SIZE), PAGE_SIZE)
+    end = start + page_size
+    return {"object": "list", "results": items[start:end], "has_more": end < len(items),
+            "next_cursor": str(end) if end < len(items) else None}
+
+class FakeNotionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeNotion/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, data, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status, body, headers=None):
+        self._send(status, json.dumps(body).encode(), headers=headers)
+
+    def _admit(self): # задержка ответа и лимит запросов, как у настоящего API
+        server = self.server
+        with server.stats_lock:
+            server.stats["requests"] += 1
+            now = time.monotonic()
+            server.request_times = [t for t in server.request_times if now - t < 1.0]
+            limited = server.config.rate_limit > 0 and len(server.request_times) >= server.config.rate_limit
+            if limited:
+                server.stats["rate_limited"] += 1
+            else:
+                server.request_times.append(now)
+        if limited:
+            self._send_json(429, {"object": "error", "status": 429, "code": "rate_limited", "message": "Rate limited"},
+                            headers={"Retry-After": "1"})
+            return False
+        time.sleep(server.config.latency_ms / 1000)
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        workspace = self.server.workspace
+        if url.path.startswith("/files/"):
+            path = workspace.files.get(os.path.basename(url.path))
+            if path is None:
+                self._send_json(404, {"message": "not found"})
+                return
+            with open(path, "rb") as f:
+                self._send(200, f.read(), content_type="application/octet-stream")
+            return
+
+        if not self._admit():
+            return
+        parts = url.path.strip("/").split("/")
+        if parts[:2] == ["v1", "blocks"] and len(parts) == 4 and parts[3] == "children":
+            query = parse_qs(url.query)
+            self._send_json(200, paginate(workspace.children.get(parts[2], []),
+                                          query.get("start_cursor", [None])[0], query.get("page_size", [None])[0]))
+        else:
+            self._send_json(404, {"object": "error", "status": 404, "code": "object_not_found", "message": url.path})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self._admit():
+            return
+        workspace = self.server.workspace
+        parts = url.path.strip("/").split("/")
+        if parts == ["v1", "search"]:
+            self._send_json(200, paginate(workspace.objects, body.get("start_cursor"), body.get("page_size")))
+        elif parts[:2] in (["v1", "databases"], ["v1", "data_sources"]) and len(parts) == 4 and parts[3] == "query":
+            self._send_json(200, paginate(workspace.database_rows.get(parts[2], []), body.get("start_cursor"), body.get("page_size")))
+        else:
+            self._send_json(404, {"object": "error", "status": 404, "code": "object_not_found", "message": url.path})
+
+def start_fake_notion(port=0, latency_ms=20.0, rate_limit=0, **workspace_options):
+    """Starts the server in a daemon thread; returns it (`server.server_address`, `server.stats`, `server.workspace`)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeNotionHandler)
+    server.daemon_threads = True
+    server.config = argparse.Namespace(latency_ms=latency_ms, rate_limit=rate_limit)
+    server.stats = {"requests": 0, "rate_limited": 0}
+    server.stats_lock = threading.Lock()
+    server.request_times = []
+    server.workspace = Workspace(f"http://127.0.0.1:{server.server_address[1]}", **workspace_options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--databases", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests per second before 429; 0 disables")
+    args = parser.parse_args()
+    server = start_fake_notion(args.port, args.latency_ms, args.rate_limit, pages=args.pages, databases=args.databases, rows=args.rows)
+    print(f"Fake Notion listening on http://127.0.0.1:{server.server_address[1]} "
+          f"({len(server.workspace.objects)} objects, {len(server.workspace.files)} attachments)")
+    threading.Event().wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Stand-in for the Ollama HTTP API: /api/chat and /api/generate stream tokens at a fixed rate.
+
+    python benchmarks/fake_ollama.py --port 11435 --tokens-per-second 40 --answer-tokens 120
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORDS = ("According to the provided documents the request must be approved by the manager "
+                "before the deadline [source: report.pdf]").split()
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOllama/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path in ("/", "/api/version"):
+            self._send_json(200, {"version": "fake"})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "llama3.2"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json(404, {"error": "not found"})
+            return
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.server.config
+        chat = self.path == "/api/chat"
+
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+            self.server.stats["active"] += 1
+            self.server.stats["max_active"] = max(self.server.stats["max_active"], self.server.stats["active"])
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            time.sleep(config.first_token_ms / 1000)
+            interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+            started = time.perf_counter()
+            # num_predict из options ограничивает ответ, как в Ollama (прогрев модели просит один токен)
+            answer_tokens = min(config.answer_tokens, (payload.get("options") or {}).get("num_predict") or config.answer_tokens)
+            for i in range(answer_tokens):
+                token = ANSWER_WORDS[i % len(ANSWER_WORDS)] + " "
+                self._write_line({"model": payload.get("model"), "done": False,
+                                  **({"message": {"role": "assistant", "content": token}} if chat else {"response": token})})
+                # Темп выдерживается относительно начала генерации, а не между токенами, чтобы не накапливать ошибку
+                delay = started + (i + 1) * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self._write_line({"model": payload.get("model"), "done": True, "eval_count": answer_tokens,
+                              **({"message": {"role": "assistant", "content": ""}} if chat else {"response": ""})})
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            with self.server.stats_lock:
+                self.server.stats["active"] -= 1
+
+    def _write_line(self, body):
+        data = (json.dumps(body) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+def start_fake_ollama(port=0, tokens_per_second=40.0, answer_tokens=120, first_token_ms=50.0):
+    """Starts the server in a daemon thread; returns it (`server.server_address`, `server.stats`)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.config = argparse.Namespace(tokens_per_second=tokens_per_second, answer_tokens=answer_tokens, first_token_ms=first_token_ms)
+    server.stats = {"requests": 0, "active": 0, "max_active": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    server = start_fake_ollama(args.port, args.tokens_per_second, args.answer_tokens, args.first_token_ms)
+    print(f"Fake Ollama listening on http://127.0.0.1:{server.server_address[1]}")
+    threading.Event().wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Retrieval latency over the store in the current directory (run by run_suite.py with cwd set to the server workdir).
+
+Prints one JSON object: embedding and search latency percentiles, and the average number of chunks returned.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import generate_questions
+from chroma_utils import get_embedding_function, get_vectorstore, load_lexical_index
+from langchain_utils import search_documents
+
+def latency_summary(latencies):
+    return {q: float(np.percentile(latencies, int(q[1:])) * 1000) for q in ("p50", "p95", "p99")}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    questions = generate_questions(args.queries)
+    embeddings = get_embedding_function()
+    start = time.perf_counter()
+    get_vectorstore()
+    load_lexical_index()
+    embeddings.embed_query("warmup")
+    load_seconds = time.perf_counter() - start
+
+    embed_latencies, search_latencies, returned = [], [], []
+    for question in questions:
+        start = time.perf_counter()
+        question_embedding = embeddings.embed_query(question)
+        embedded = time.perf_counter()
+        docs = search_documents(question, question_embedding)
+        search_latencies.append(time.perf_counter() - embedded)
+        embed_latencies.append(embedded - start)
+        returned.append(len(docs))
+
+    store = get_vectorstore()
+    print(json.dumps({
+        "chunks": store._collection.count() if hasattr(store, "_collection") else store.count(),
+        "load_seconds": load_seconds,
+        "embed_ms": latency_summary(embed_latencies),
+        "search_ms": latency_summary(search_latencies),
+        "docs_per_query": float(np.mean(returned))
+    }))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Offline end-to-end benchmark: the API runs as a subprocess against a fake Ollama and a fake Notion.
+
+Measures ingest throughput (/upload-docs), retrieval latency versus corpus size, /chat latency under
+concurrent sessions and /sync-notion wall time (full and incremental); writes JSON so runs can be compared:
+
+    python benchmarks/run_suite.py --corpus-steps 20,100,400 --sessions 1,4,16 --output results/baseline.json
+    python benchmarks/run_suite.py --quick --output /tmp/smoke.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from corpus import generate_corpus, generate_questions
+from fake_notion import start_fake_notion
+from fake_ollama import start_fake_ollama
+
+UPLOAD_BATCH = 50
+
+def latency_summary(latencies):
+    if not latencies:
+        return None
+    return {q: float(np.percentile(latencies, int(q[1:])) * 1000) for q in ("p50", "p95", "p99")}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def start_api(workdir, port, ollama_url, notion_url, args):
+    env = dict(os.environ,
+               PYTHONPATH=os.path.join(REPO_DIR, "api"),
+               OLLAMA_BASE_URL=ollama_url,
+               NOTION_BASE_URL=notion_url,
+               NOTION_SECRET="bench",
+               UPLOAD_DIR=os.path.join(workdir, "uploads"),
+               WARMUP_MODELS="0",
+               VECTOR_STORE=args.vector_store)
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, env
+
+def wait_ready(base_url, process, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"API exited with code {process.returncode}, see server.log")
+        try:
+            if requests.get(f"{base_url}/ready", timeout=5).status_code == 200:
+                return time.perf_counter() - start
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"API was not ready after {timeout} s")
+
+def wait_job(base_url, job_id, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        job = requests.get(f"{base_url}/sync-status/{job_id}", timeout=30).json()
+        if job.get("status") in ("completed", "failed"):
+            return job, time.perf_counter() - start
+        time.sleep(0.25)
+    raise TimeoutError(f"Job {job_id} did not finish after {timeout} s")
+
+def ingest(base_url, paths, timeout):
+    # Загрузка пачками по UPLOAD_BATCH файлов; пропускная способность считается по отчётам задач и по общему времени
+    start = time.perf_counter()
+    reports = []
+    for batch_start in range(0, len(paths), UPLOAD_BATCH):
+        handles = [open(path, "rb") for path in paths[batch_start:batch_start + UPLOAD_BATCH]]
+        try:
+            response = requests.post(f"{base_url}/upload-docs", timeout=300,
+                                     files=[("files", (os.path.basename(handle.name), handle)) for handle in handles])
+            response.raise_for_status()
+        finally:
+            for handle in handles:
+                handle.close()
+        job, _ = wait_job(base_url, response.json()["job_id"], timeout)
+        if job["status"] != "completed":
+            raise RuntimeError(f"Ingest job failed: {job.get('error')}")
+        reports.append(job["report"])
+    wall_seconds = time.perf_counter() - start
+    chunks = sum(report["chunks"] for report in reports)
+    index_seconds = sum(report["seconds"] for report in reports)
+    return {
+        "documents": len(paths),
+        "failed": sum(report["failed"] for report in reports),
+        "chunks": chunks,
+        "wall_seconds": wall_seconds,
+        "index_seconds": index_seconds,
+        "chunks_per_second": chunks / index_seconds if index_seconds else 0.0,
+        "wall_chunks_per_second": chunks / wall_seconds if wall_seconds else 0.0
+    }
+
+def probe_retrieval(workdir, env, queries):
+    result = subprocess.run([sys.executable, os.path.join(BENCH_DIR, "retrieval_probe.py"), "--queries", str(queries)],
+                            cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def run_chat_load(base_url, sessions, questions_per_session, model):
+    latencies, errors, stage_timings = [], [], {}
+    lock = threading.Lock()
+
+    def session(number):
+        session_id = f"bench-{uuid.uuid4()}"
+        # Разные вопросы в каждой сессии, чтобы не мерить кэш ответов
+        for question in generate_questions(questions_per_session, seed=1000 + number):
+            start = time.perf_counter()
+            try:
+                response = requests.post(f"{base_url}/chat", timeout=600,
+                                         json={"question": question, "session_id": session_id, "model": model, "include_timings": True})
+                response.raise_for_status()
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                for stage, ms in (response.json().get("timings") or {}).items():
+                    stage_timings.setdefault(stage, []).append(ms / 1000)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(number,)) for number in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "latency_ms": latency_summary(latencies),
+        "stage_ms": {stage: latency_summary(values) for stage, values in sorted(stage_timings.items())},
+        "throughput_rps": len(latencies) / wall_seconds if wall_seconds else 0.0
+    }
+
+def run_notion_sync(base_url, notion_server, full, timeout):
+    requests_before = notion_server.stats["requests"]
+    response = requests.post(f"{base_url}/sync-notion", params={"full": str(full).lower()}, timeout=30)
+    response.raise_for_status()
+    job, wall_seconds = wait_job(base_url, response.json()["task_id"], timeout)
+    return {
+        "mode": "full" if full else "incremental",
+        "status": job["status"],
+        "detail": job.get("detail") or job.get("error"),
+        "wall_seconds": wall_seconds,
+        "notion_requests": notion_server.stats["requests"] - requests_before,
+        "rate_limited": notion_server.stats["rate_limited"]
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus-steps", default="20,100,400", help="cumulative document counts after each ingest step")
+    parser.add_argument("--sessions", default="1,4,16", help="concurrent /chat sessions per load level")
+    parser.add_argument("--questions-per-session", type=int, default=5)
+    parser.add_argument("--retrieval-queries", type=int, default=100)
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--vector-store", default=os.getenv("VECTOR_STORE", "chroma"))
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--notion-pages", type=int, default=50)
+    parser.add_argument("--notion-databases", type=int, default=2)
+    parser.add_argument("--notion-rows", type=int, default=20)
+    parser.add_argument("--notion-latency-ms", type=float, default=20.0)
+    parser.add_argument("--notion-rate-limit", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--job-timeout", type=float, default=3600)
+    parser.add_argument("--skip", default="", help="comma-separated parts to skip: ingest,retrieval,chat,notion")
+    parser.add_argument("--quick", action="store_true", help="small smoke run: 10 documents, 1 and 2 sessions, 10 Notion pages")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    if args.quick:
+        args.corpus_steps, args.sessions, args.questions_per_session = "10", "1,2", 2
+        args.retrieval_queries, args.notion_pages, args.notion_databases, args.notion_rows = 20, 10, 1, 5
+        args.tokens_per_second, args.answer_tokens = 200.0, 40
+    skip = set(filter(None, args.skip.split(",")))
+    corpus_steps = [int(step) for step in args.corpus_steps.split(",")]
+    sessions = [int(count) for count in args.sessions.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    ollama = start_fake_ollama(tokens_per_second=args.tokens_per_second, answer_tokens=args.answer_tokens, first_token_ms=args.first_token_ms)
+    notion = start_fake_notion(latency_ms=args.notion_latency_ms, rate_limit=args.notion_rate_limit,
+                               pages=args.notion_pages, databases=args.notion_databases, rows=args.notion_rows)
+    base_url = f"http://127.0.0.1:{args.port}"
+    process, env = start_api(workdir, args.port, f"http://127.0.0.1:{ollama.server_address[1]}",
+                             f"http://127.0.0.1:{notion.server_address[1]}", args)
+
+    result = {
+        "benchmark": "e2e",
+        "git_commit": git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep_workdir")},
+        "ready_seconds": None,
+        "ingest": [],
+        "retrieval": [],
+        "chat": [],
+        "notion_sync": [],
+        "ollama": None
+    }
+    try:
+        result["ready_seconds"] = wait_ready(base_url, process, args.ready_timeout)
+        corpus_dir = os.path.join(workdir, "corpus")
+        ingested = 0
+        for step in corpus_steps:
+            if "ingest" not in skip and step > ingested:
+                # Новые документы с отдельным seed, чтобы каждый шаг добавлял уникальные тексты
+                paths = generate_corpus(os.path.join(corpus_dir, f"step_{step}"), step - ingested, seed=step)
+                result["ingest"].append({"corpus_documents": step, **ingest(base_url, paths, args.job_timeout)})
+                ingested = step
+            if "retrieval" not in skip:
+                result["retrieval"].append({"corpus_documents": ingested, **probe_retrieval(workdir, env, args.retrieval_queries)})
+
+        if "chat" not in skip:
+            for count in sessions:
+                result["chat"].append(run_chat_load(base_url, count, args.questions_per_session, args.model))
+        result["ollama"] = dict(ollama.stats)
+
+        if "notion" not in skip:
+            result["notion_sync"].append(run_notion_sync(base_url, notion, True, args.job_timeout))
+            result["notion_sync"].append(run_notion_sync(base_url, notion, False, args.job_timeout))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        ollama.shutdown()
+        notion.shutdown()
+        shutil.rmtree(notion.workspace.files_dir, ignore_errors=True)
+        if args.keep_workdir:
+            print(f"Workdir kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
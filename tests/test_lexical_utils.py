@@ -0,0 +1,46 @@
+"""BM25 search over small and medium indexes: rare codes and word forms must be found.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from lexical_utils import LexicalIndex
+
+def build_index(texts):
+    index = LexicalIndex()
+    ids = [f"chunk-{i}" for i in range(len(texts))]
+    index.load(lambda offset, limit: (ids[offset:offset + limit], texts[offset:offset + limit],
+                                      [{"file_id": 1}] * len(ids[offset:offset + limit])))
+    return index
+
+class LexicalSearchTest(unittest.TestCase):
+    def test_small_index_finds_code_and_word_form(self):
+        index = build_index([
+            "Артикул AB-123/4: насос циркуляционный",
+            "График отпусков на 2024 год",
+            "Инструкция по охране труда",
+            "Регламент закупок оборудования",
+            "Контакты службы поддержки",
+        ])
+        self.assertEqual([chunk_id for chunk_id, _ in index.search("AB-123/4")][0], "chunk-0")
+        self.assertEqual([chunk_id for chunk_id, _ in index.search("отпусков")], ["chunk-1"])
+
+    def test_code_in_several_chunks_of_medium_index(self):
+        texts = [f"Раздел {i}: общие положения и порядок работы" for i in range(40)]
+        for i in (3, 11, 19, 27, 35):
+            texts[i] += ", изделие XK-7781"
+        found = {chunk_id for chunk_id, _ in build_index(texts).search("XK-7781", k=10)}
+        self.assertEqual(found, {"chunk-3", "chunk-11", "chunk-19", "chunk-27", "chunk-35"})
+
+    def test_stop_words_and_common_terms_match_nothing(self):
+        texts = [f"Раздел {i}: общие положения и порядок работы в отделе" for i in range(40)]
+        index = build_index(texts)
+        self.assertEqual(index.search("What is the weather in Paris?"), [])
+        self.assertEqual(index.search("как в разделе про порядок работы"), [])
+
+if __name__ == "__main__":
+    unittest.main()